@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+# benchsis.py - Benchmarks for Ensymble SIS file generation and parsing
+#
+# This program is part of Ensymble developer utilities for Symbian OS(TM).
+#
+# Ensymble is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Ensymble is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ensymble; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##############################################################################
+
+import sys
+import os
+import time
+import getopt
+
+from ensymble.utils import sisfile
+from ensymble.utils import sisfield
+from ensymble.utils import symbianutil
+
+try:
+    import resource
+except ImportError:
+    # Not available on all platforms, peak memory usage is not reported.
+    resource = None
+
+
+##############################################################################
+# Parameters
+##############################################################################
+
+DEFAULTNUMFILES     = 10000     # Number of SISFileDescription entries
+DEFAULTROUNDS       = 3         # Number of times each benchmark is run
+CRCDATASIZE         = 262144    # Bytes of SIS file to calculate CRC-16 of
+
+
+##############################################################################
+# Benchmarks
+##############################################################################
+
+def makesis(numfiles):
+    '''Generate a SIS file with numfiles small files in it.'''
+
+    sw = sisfile.SimpleSISWriter(["EN"], ["Benchmark"], 0x01234567L,
+                                 (1, 0, 0), "Ensymble", ["Ensymble"],
+                                 time.gmtime(1000000000))
+    for n in xrange(numfiles):
+        contents = "File number %d\n" % n
+        sw.addfile(contents, u"c:\\data\\bench\\file%05d.txt" % n)
+    return sw.tostring()
+
+def benchbuild(numfiles):
+    makesis(numfiles)
+
+def benchparse(sisstring):
+    sisfield.SISField(sisstring[16:])
+
+def benchwalk(sisstring):
+    contents = sisfield.SISField(sisstring[16:])
+    files = contents.Controller.Data.InstallBlock.Files
+    for n in xrange(len(files)):
+        files[n].Target.String
+
+def benchmodify(sisstring):
+    contents = sisfield.SISField(sisstring[16:])
+    files = contents.Controller.Data.InstallBlock.Files
+    files[len(files) / 2].Target.String = u"c:\\data\\bench\\modified.txt"
+    contents.tostring()
+
+def makepayloads():
+    '''Collect the source files of Ensymble itself, to be used as
+    typical compressible file contents.'''
+
+    payloads = []
+    topdir = os.path.dirname(os.path.dirname(os.path.abspath(sisfile.__file__)))
+    for dirpath, dirnames, filenames in os.walk(topdir):
+        for filename in filenames:
+            if filename.endswith(".py"):
+                f = file(os.path.join(dirpath, filename), "rb")
+                payloads.append(f.read())
+                f.close()
+    return payloads
+
+def benchcompress(payloads, profile):
+    size = 0
+    for contents in payloads:
+        size += len(sisfile.compressfile(contents, profile)[0])
+    return size
+
+def crc16ccittbitwise(string, initialvalue = 0x0000, finalxor = 0x0000):
+    '''The original bit-by-bit CCITT CRC-16 algorithm, for reference.'''
+
+    value = initialvalue
+    for c in string:
+        value ^= (ord(c) << 8)
+        for b in xrange(8):
+            value <<= 1
+            if value & 0x10000:
+                value ^= 0x1021
+            value &= 0xffff
+
+    return value ^ finalxor
+
+def checkcrc16(string):
+    '''Verify that symbianutil CRC-16 functions give results
+    identical to the bit-by-bit algorithm.'''
+
+    for length in (0, 1, 2, 3, 7, 64, 1000, len(string)):
+        data = string[:length]
+        for initialvalue in (0x0000, 0x1d0f, 0xffff):
+            value = crc16ccittbitwise(data, initialvalue, 0x5a5a)
+            if symbianutil.crc16ccitt(data, initialvalue, 0x5a5a) != value:
+                return False
+
+            # Feed data in uneven pieces.
+            crcobj = symbianutil.CRC16CCITT(initialvalue, 0x5a5a)
+            for pos in xrange(0, length, 1237):
+                crcobj.update(buffer(data, pos, 1237))
+            if crcobj.getvalue() != value:
+                return False
+
+    return True
+
+def runbench(name, func, rounds, *args):
+    '''Run a benchmark several times and print the best time.
+    Return the result of the last run.'''
+
+    best = None
+    for n in xrange(rounds):
+        start = time.time()
+        result = func(*args)
+        elapsed = time.time() - start
+        if best == None or elapsed < best:
+            best = elapsed
+    print "%-30s %8.3f s" % (name, best)
+    return result
+
+
+##############################################################################
+# Main program
+##############################################################################
+
+def main():
+    pgmname = sys.argv[0]
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "n:r:h",
+                                   ["files=", "rounds=", "help"])
+    except getopt.GetoptError, e:
+        print "%s: %s" % (pgmname, e)
+        sys.exit(2)
+
+    numfiles = DEFAULTNUMFILES
+    rounds = DEFAULTROUNDS
+    for opt, arg in opts:
+        if opt in ("-n", "--files"):
+            numfiles = int(arg)
+        elif opt in ("-r", "--rounds"):
+            rounds = int(arg)
+        else:
+            print "usage: %s [--files N] [--rounds N]" % pgmname
+            sys.exit(0)
+
+    print "%d SISFileDescription entries, best of %d rounds" % (numfiles,
+                                                                rounds)
+
+    sisstring = makesis(numfiles)
+
+    runbench("build SIS", benchbuild, rounds, numfiles)
+    runbench("parse SIS", benchparse, rounds, sisstring)
+    runbench("parse SIS, access all files", benchwalk, rounds, sisstring)
+    runbench("parse SIS, modify one file", benchmodify, rounds, sisstring)
+
+    # CRC-16 against the original bit-by-bit algorithm.
+    crcdata = sisstring[:CRCDATASIZE]
+    print "CRC-16 of %d bytes, results identical: %s" % (len(crcdata),
+        (checkcrc16(crcdata) and "yes") or "NO")
+    runbench("CRC-16, bit-by-bit", crc16ccittbitwise, 1, crcdata)
+    runbench("CRC-16, symbianutil", symbianutil.crc16ccitt, rounds, crcdata)
+
+    # Time / size trade-off of compression profiles.
+    payloads = makepayloads()
+    totalsize = sum([len(contents) for contents in payloads])
+    print "%d source files, %d bytes" % (len(payloads), totalsize)
+    for profile in ("fast", "normal", "max", "exhaustive"):
+        size = runbench("compress, %s profile" % profile, benchcompress,
+                        rounds, payloads, profile)
+        print "%-30s %8d bytes (%.1f %%)" % ("", size,
+                                             100.0 * size / totalsize)
+
+    if resource != None:
+        print "%-30s %8d kB" % ("peak memory usage",
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+if __name__ == '__main__':
+    main()
@@ -24,7 +24,7 @@
 actions - Commands used by the ensymble tool
 """
 __all__ = ["altere32", "genuid", "infoe32", "mergesis", "py2sis", "signsis",
-           "simplesis"]
+           "simplesis", "unsis", "validatesis"]
 
 cmddict = {}
 for _ in __all__:
@@ -40,7 +40,8 @@ from utils import cryptutil
 shorthelp = 'Merge several SIS packages into one'
 longhelp  = '''mergesis
     [--cert=mycert.cer] [--privkey=mykey.key] [--passphrase=12345]
-    [--encoding=terminal,filesystem] [--verbose]
+    [--encoding=terminal,filesystem] [--compression=max] [--cachedir=dir]
+    [--verbose]
     <infile> [mergefile]... <outfile>
 
 Merge several SIS packages into one and sign the resulting SIS file with
@@ -56,6 +57,8 @@ Options:
     privkey     - Private key of the certificate (PEM format)
     passphrase  - Pass phrase of the private key (insecure, use stdin instead)
     encoding    - Local character encodings for terminal and filesystem
+    compression - Compression profile: fast, normal, max or exhaustive
+    cachedir    - Directory for caching signatures (none by default)
     verbose     - Print extra statistics
 
 Merging SIS files that already contain other SIS files is not supported.
@@ -69,7 +72,6 @@ Merging SIS files that already contain other SIS files is not supported.
 MAXPASSPHRASELENGTH     = 256
 MAXCERTIFICATELENGTH    = 65536
 MAXPRIVATEKEYLENGTH     = 65536
-MAXSISFILESIZE          = 1024 * 1024 * 8   # Eight megabytes
 
 
 ##############################################################################
@@ -110,10 +112,10 @@ def run(pgmname, argv):
         gopt = getopt.getopt
 
     # Parse command line arguments.
-    short_opts = "a:k:p:e:vh"
+    short_opts = "a:k:p:e:z:vh"
     long_opts = [
         "cert=", "privkey=", "passphrase=",
-        "encoding=", "verbose", "debug", "help"
+        "encoding=", "compression=", "cachedir=", "verbose", "debug", "help"
     ]
     args = gopt(argv, short_opts, long_opts)
 
@@ -192,6 +194,18 @@ def run(pgmname, argv):
 
             passphrase = passphrase.strip()
 
+    # Determine compression profile. Only affects fields that
+    # need to be compressed again, such as the SISController.
+    compression = opts.get("--compression", opts.get("-z", "max"))
+    sisfield.setcompressionprofile(compression)
+
+    # Determine signature cache directory.
+    sigcache = None
+    cachedir = opts.get("--cachedir", None)
+    if cachedir != None:
+        cachedir = cachedir.decode(terminalenc).encode(filesystemenc)
+        sigcache = sisfile.SignatureCache(cachedir)
+
     # Determine verbosity.
     verbose = False
     if "--verbose" in opts.keys() or "-v" in opts.keys():
@@ -213,6 +227,8 @@ def run(pgmname, argv):
     # cert                 Certificate in PEM format
     # privkey              Certificate private key in PEM format
     # passphrase           Pass phrase of priv. key, terminalenc encoded string
+    # compression          Compression profile name
+    # sigcache             SignatureCache instance or None
     # verbose              Boolean indicating verbose terminal output
 
     if verbose:
@@ -227,37 +243,78 @@ def run(pgmname, argv):
             privkey.decode(filesystemenc).encode(terminalenc)) or "<default>")
         print
 
-    insis = []
-    for n in xrange(len(infiles)):
-        # Read input SIS files.
-        f = file(infiles[n], "rb")
-        instring = f.read(MAXSISFILESIZE + 1)
-        f.close()
-
-        if len(instring) > MAXSISFILESIZE:
-            raise ValueError("%s: input SIS file too large" % infiles[n])
-
-        if n == 0:
-            # Store UIDs for later use.
-            uids = instring[:16]    # UID1, UID2, UID3 and UIDCRC
-
-        # Convert input SIS file to SISFields.
-        sf, rlen = sisfield.SISField(instring[16:], False)
-
-        # Ignore extra bytes after SIS file.
-        if len(instring) > (rlen + 16):
-            print ("%s: %s: warning: %d extra bytes after SIS file (ignored)" %
-                   (pgmname, infiles[n], (len(instring) - (rlen + 16))))
-
-        # Try to release some memory early.
-        del instring
-
-        # Check that there are no embedded SIS files.
-        if len(sf.Data.DataUnits) > 1:
-            raise ValueError("%s: input SIS file contains "
-                             "embedded SIS files" % infiles[n])
-
-        insis.append(sf)
+    # Open input SIS files. The files are not read into memory. Only the
+    # SISControllers are parsed, SISDataUnits are copied verbatim.
+    instrings = []
+    try:
+        insis = []
+        for n in xrange(len(infiles)):
+            instring = sisfile.mapfile(infiles[n])
+            instrings.append(instring)
+
+            if n == 0:
+                # Store UIDs for later use.
+                uids = instring[:16]    # UID1, UID2, UID3 and UIDCRC
+
+            # Convert input SIS file to SISFields.
+            sf, rlen = sisfield.SISField(instring, False, 16)
+
+            # Ignore extra bytes after SIS file.
+            if len(instring) > (rlen + 16):
+                print ("%s: %s: warning: %d extra bytes after SIS file "
+                       "(ignored)" % (pgmname, infiles[n],
+                                      (len(instring) - (rlen + 16))))
+
+            # Check that there are no embedded SIS files.
+            if len(sf.Data.DataUnits) > 1:
+                raise ValueError("%s: input SIS file contains "
+                                 "embedded SIS files" % infiles[n])
+
+            insis.append(sf)
+
+        mergesisfiles(pgmname, insis, certdata, privkeydata, passphrase,
+                      sigcache)
+
+        # Write output SIS file. The input files are still needed while
+        # writing, so when overwriting one, write to a temporary file first.
+        samefile = False
+        for infile in infiles:
+            samefile = samefile or (os.path.abspath(outfile) ==
+                                    os.path.abspath(infile))
+            try:
+                samefile = samefile or os.path.samefile(outfile, infile)
+            except (AttributeError, OSError):
+                # os.path.samefile() not available or outfile does not exist.
+                pass
+
+        if samefile:
+            tmpfile = outfile + ".tmp"
+        else:
+            tmpfile = outfile
+
+        f = file(tmpfile, "wb")
+        try:
+            sisfile.writesiscontents(f, uids, insis[0])
+        finally:
+            f.close()
+    finally:
+        for instring in instrings:
+            sisfile.unmapfile(instring)
+
+    if samefile:
+        try:
+            os.rename(tmpfile, outfile)
+        except OSError:
+            # Cannot rename over an existing file on all platforms.
+            os.remove(outfile)
+            os.rename(tmpfile, outfile)
+
+def mergesisfiles(pgmname, insis, certdata, privkeydata, passphrase,
+                  sigcache):
+    '''Add SIS files as embedded SIS files into the first one and sign it.
+
+    The SISDataUnits of the added SIS files are not parsed but appended
+    to the SISData of the first SIS file as is.'''
 
     # Temporarily remove the SISDataIndex SISField from the first SISController.
     ctrlfield = insis[0].Controller.Data
@@ -272,7 +329,7 @@ def run(pgmname, argv):
 
     for n in xrange(1, len(insis)):
         # Append SISDataUnit SISFields into SISData array of the first SIS file.
-        insis[0].Data.DataUnits.append(insis[n].Data.DataUnits[0])
+        insis[0].Data.DataUnits.append(insis[n].Data.DataUnits.getrawitem(0))
 
         # Set data index in SISController SISField.
         insis[n].Controller.Data.DataIndex.DataIndex = n
@@ -283,7 +340,8 @@ def run(pgmname, argv):
     # Calculate a signature of the modified SISController.
     string = ctrlfield.tostring()
     string = sisfield.stripheaderandpadding(string)
-    signature, algoid = sisfile.signstring(privkeydata, passphrase, string)
+    signature, algoid = sisfile.signstring(privkeydata, passphrase, string,
+                                           sigcache)
 
     # Create a SISCertificateChain SISField from certificate data.
     sf1 = sisfield.SISBlob(Data = cryptutil.certtobinary(certdata))
@@ -303,12 +361,3 @@ def run(pgmname, argv):
     # Set certificate, restore data index.
     ctrlfield.Signature0 = sf7
     ctrlfield.DataIndex = didxfield
-
-    # Convert SISFields to string.
-    outstring = insis[0].tostring()
-
-    # Write output SIS file.
-    f = file(outfile, "wb")
-    f.write(uids)
-    f.write(outstring)
-    f.close()
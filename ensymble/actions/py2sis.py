@@ -49,7 +49,9 @@ longhelp  = '''py2sis
     [--textfile=mytext_%C.txt] [--cert=mycert.cer] [--privkey=mykey.key]
     [--passphrase=12345] [--heapsize=min,max] [--caps=Cap1+Cap2+...]
     [--vendor="Vendor Name",...] [--autostart] [--runinstall]
-    [--encoding=terminal,filesystem] [--verbose]
+    [--encoding=terminal,filesystem] [--jobs=N]
+    [--cachedir=dir] [--cachesize=N] [--sigcache] [--compression=max]
+    [--verbose]
     <src> [sisfile]
 
 Create a SIS package for a "Python for S60" application.
@@ -76,6 +78,11 @@ Options:
     runinstall   - Application is automatically started after installation
     heapsize     - Application heap size, min. and/or max. ("4k,1M" by default)
     encoding     - Local character encodings for terminal and filesystem
+    jobs         - Number of files to compress in parallel (1 by default)
+    cachedir     - Directory for caching compressed files
+    cachesize    - Compression cache size limit in megabytes
+    sigcache     - Also cache RSA signatures in cachedir
+    compression  - Compression profile: fast, normal, max or exhaustive
     verbose      - Print extra statistics
 
 If no certificate and its private key are given, a default self-signed
@@ -149,13 +156,14 @@ def run(pgmname, argv):
         gopt = getopt.getopt
 
     # Parse command line arguments.
-    short_opts = "u:n:r:l:i:s:c:f:x:t:a:k:p:b:d:gRH:e:vh"
+    short_opts = "u:n:r:l:i:s:c:f:x:t:a:k:p:b:d:gRH:e:j:z:vh"
     long_opts = [
         "uid=", "appname=", "version=", "lang=", "icon=",
         "shortcaption=", "caption=", "drive=", "extrasdir=", "textfile=",
         "cert=", "privkey=", "passphrase=", "caps=", "vendor=",
         "autostart", "runinstall", "heapsize=",
-        "encoding=", "verbose", "debug", "help"
+        "encoding=", "jobs=", "cachedir=", "cachesize=", "sigcache",
+        "compression=", "verbose", "debug", "help"
     ]
     args = gopt(argv, short_opts, long_opts)
 
@@ -447,6 +455,46 @@ def run(pgmname, argv):
         print ("%s: warning: minimum heap size larger than "
                "maximum heap size" % pgmname)
 
+    # Determine number of parallel compression jobs.
+    jobs = opts.get("--jobs", opts.get("-j", "1"))
+    try:
+        jobs = int(jobs)
+        if jobs < 1:
+            raise ValueError
+    except ValueError:
+        raise ValueError("invalid number of jobs '%s'" % jobs)
+
+    # Determine compression profile.
+    compression = opts.get("--compression", opts.get("-z", "max"))
+    if compression not in sisfield.compressionprofiles:
+        raise ValueError("invalid compression profile '%s'" % compression)
+
+    # Determine compression and signature cache directory and size limit.
+    cache = None
+    sigcache = None
+    cachedir = opts.get("--cachedir", None)
+    cachesize = opts.get("--cachesize", None)
+    if cachedir != None:
+        cachedir = cachedir.decode(terminalenc).encode(filesystemenc)
+        if cachesize == None:
+            cachesize = sisfile.DEFAULTCACHESIZE
+        else:
+            try:
+                if int(cachesize) < 0:
+                    raise ValueError
+                cachesize = int(cachesize) * 1024 * 1024
+            except ValueError:
+                raise ValueError("invalid cache size '%s'" % cachesize)
+        cache = sisfile.CompressionCache(cachedir, cachesize)
+        if "--sigcache" in opts.keys():
+            # Signatures are derived from the private key, cache
+            # them only on request.
+            sigcache = sisfile.SignatureCache(cachedir)
+    elif cachesize != None:
+        raise ValueError("cache size given without cache directory")
+    elif "--sigcache" in opts.keys():
+        raise ValueError("signature cache requested without cache directory")
+
     # Determine verbosity.
     verbose = False
     if "--verbose" in opts.keys() or "-v" in opts.keys():
@@ -488,6 +536,10 @@ def run(pgmname, argv):
     # runinstall    Boolean requesting application autorun after installation
     # heapsizemin   Heap that must be available for the application to start
     # heapsizemax   Maximum amount of heap the application can allocate
+    # jobs          Number of files to compress in parallel
+    # cache         CompressionCache instance or None
+    # sigcache      SignatureCache instance or None
+    # compression   Compression profile name
     # verbose       Boolean indicating verbose terminal output
 
     if verbose:
@@ -523,11 +575,16 @@ def run(pgmname, argv):
         print "Autostart on boot   %s"      % ((autostart and "Yes") or "No")
         print "Run after install   %s"      % ((runinstall and "Yes") or "No")
         print "Heap size in bytes  %d, %d" % (heapsizemin, heapsizemax)
+        print "Cache directory     %s"      % ((cachedir and
+            cachedir.decode(filesystemenc).encode(terminalenc)) or "<none>")
+        print "Signature cache     %s"      % ((sigcache and "Yes") or "No")
         print
 
     # Generate SimpleSISWriter object.
     sw = sisfile.SimpleSISWriter(lang, caption, uid3, version,
-                                 vendor[0], vendor)
+                                 vendor[0], vendor, jobs = jobs,
+                                 cache = cache, profile = compression,
+                                 sigcache = sigcache)
 
     # Add text file or files to the SIS object. Text dialog is
     # supposed to be displayed before anything else is installed.
@@ -702,6 +759,13 @@ def run(pgmname, argv):
     # Generate SIS file out of the SimpleSISWriter object.
     sw.tofile(outfile)
 
+    if verbose:
+        # Report how each file was compressed.
+        for target, uncomplen, complen, desc in sw.getcompressioninfo():
+            print "%8d -> %8d bytes  %s (%s)" % (uncomplen, complen,
+                (target or "<no target>").encode(terminalenc), desc)
+        print
+
 
 ##############################################################################
 # Module-level functions which are normally only used by this module
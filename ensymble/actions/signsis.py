@@ -28,8 +28,15 @@ import getopt
 import getpass
 import locale
 import struct
+import traceback
 from hashlib import sha1
 
+try:
+    import multiprocessing
+except ImportError:
+    # Not available on Python <v2.6, only serial signing is supported.
+    multiprocessing = None
+
 from utils import sisfile
 from utils import sisfield
 from utils import symbianutil
@@ -44,8 +51,9 @@ shorthelp = 'Sign a SIS package'
 longhelp  = '''signsis
     [--unsign] [--cert=mycert.cer] [--privkey=mykey.key] [--passphrase=12345]
     [--execaps=Cap1+Cap2+...] [--dllcaps=Cap1+Cap2+...]
-    [--encoding=terminal,filesystem] [--verbose]
-    <infile> [outfile]
+    [--encoding=terminal,filesystem] [--compression=max] [--cachedir=dir]
+    [--batch] [--manifest=files.txt] [--jobs=N] [--verbose]
+    <infile> [outfile] [infile2 outfile2 ...]
 
 Sign a SIS file with the certificate provided (stripping out any
 existing certificates, if any). Optionally modify capabilities of
@@ -61,7 +69,12 @@ Options:
     execaps     - Capability names, separated by "+" (not altered by default)
     dllcaps     - Capability names, separated by "+" (not altered by default)
     encoding    - Local character encodings for terminal and filesystem
+    compression - Compression profile: fast, normal, max or exhaustive
+    cachedir    - Directory for caching signatures (none by default)
     verbose     - Print extra statistics
+    batch       - Sign several SIS files, given as infile outfile pairs
+    manifest    - File listing SIS files to sign, "infile<TAB>outfile" per line
+    jobs        - Number of SIS files to sign in parallel in batch mode
 
 If no certificate and its private key are given, a default self-signed
 certificate is used to sign the SIS file. Software authors are encouraged
@@ -71,6 +84,10 @@ distributed.
 Embedded SIS files are ignored, i.e their certificates are not modified.
 Also, capabilities of EXE and DLL files inside embedded SIS files are
 not affected.
+
+In batch mode (options "--batch" or "--manifest"), the private key is
+decrypted only once and a summary of signed and failed SIS files is
+printed at the end.
 '''
 
 
@@ -122,19 +139,17 @@ def run(pgmname, argv):
         gopt = getopt.getopt
 
     # Parse command line arguments.
-    short_opts = "ua:k:p:b:d:e:vh"
+    short_opts = "ua:k:p:b:d:e:z:m:j:vh"
     long_opts = [
         "unsign", "cert=", "privkey=", "passphrase=", "execaps=",
-        "dllcaps=", "encoding=", "verbose", "debug", "help"
+        "dllcaps=", "encoding=", "compression=", "cachedir=", "batch",
+        "manifest=", "jobs=", "verbose", "debug", "help"
     ]
     args = gopt(argv, short_opts, long_opts)
 
     opts = dict(args[0])
     pargs = args[1]
 
-    if len(pargs) == 0:
-        raise ValueError("no SIS file name given")
-
     # Override character encoding of command line and filesystem.
     encs = opts.get("--encoding", opts.get("-e", "%s,%s" % (terminalenc,
                                                             filesystemenc)))
@@ -143,21 +158,58 @@ def run(pgmname, argv):
     except (ValueError, TypeError):
         raise ValueError("invalid encoding string '%s'" % encs)
 
-    # Get input SIS file name.
-    infile = pargs[0].decode(terminalenc).encode(filesystemenc)
+    # Get batch mode options.
+    manifest = opts.get("--manifest", opts.get("-m", None))
+    batch = False
+    if "--batch" in opts.keys() or manifest != None:
+        batch = True
+
+    # Get input and output SIS file names.
+    filepairs = []
+    if manifest != None:
+        # Read (infile, outfile) pairs from manifest file.
+        manifest = manifest.decode(terminalenc).encode(filesystemenc)
+        f = file(manifest, "r")
+        lines = f.readlines()
+        f.close()
 
-    # Determine output SIS file name.
-    if len(pargs) == 1:
-        # No output file, overwrite original SIS file.
-        outfile = infile
-    elif len(pargs) == 2:
-        outfile = pargs[1].decode(terminalenc).encode(filesystemenc)
-        if os.path.isdir(outfile):
-            # Output to directory, use input file name.
-            outfile = os.path.join(outfile, os.path.basename(infile))
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if line.strip() == "" or line.lstrip().startswith("#"):
+                # Skip empty lines and comments.
+                continue
+            names = line.split("\t")
+            if len(names) > 2:
+                raise ValueError("invalid line in manifest file: '%s'" % line)
+            filepairs.append(makefilepair(names, terminalenc, filesystemenc))
+
+        if len(pargs) > 0:
+            raise ValueError("SIS file names given with a manifest file")
+    elif batch:
+        # Command line contains (infile, outfile) pairs.
+        if len(pargs) % 2 != 0:
+            raise ValueError("batch mode needs infile outfile pairs")
+        for n in xrange(0, len(pargs), 2):
+            filepairs.append(makefilepair(pargs[n:(n + 2)],
+                                          terminalenc, filesystemenc))
+    elif len(pargs) <= 2:
+        if len(pargs) > 0:
+            filepairs.append(makefilepair(pargs, terminalenc, filesystemenc))
     else:
         raise ValueError("wrong number of arguments")
 
+    if len(filepairs) == 0:
+        raise ValueError("no SIS file name given")
+
+    # Determine number of parallel signing jobs.
+    jobs = opts.get("--jobs", opts.get("-j", "1"))
+    try:
+        jobs = int(jobs)
+        if jobs < 1:
+            raise ValueError
+    except ValueError:
+        raise ValueError("invalid number of jobs '%s'" % jobs)
+
     # Get unsign option.
     unsign = False
     if "--unsign" in opts.keys() or "-u" in opts.keys():
@@ -169,6 +221,8 @@ def run(pgmname, argv):
     if unsign:
         if cert != None or privkey != None:
             raise ValueError("certificate or private key given when unsigning")
+        certdata = None
+        privkeydata = None
     elif cert != None and privkey != None:
         # Convert file names from terminal encoding to filesystem encoding.
         cert = cert.decode(terminalenc).encode(filesystemenc)
@@ -234,6 +288,18 @@ def run(pgmname, argv):
     else:
         dllcapmask = None
 
+    # Determine compression profile. Only affects fields that
+    # need to be compressed again, such as the SISController.
+    compression = opts.get("--compression", opts.get("-z", "max"))
+    sisfield.setcompressionprofile(compression)
+
+    # Determine signature cache directory.
+    sigcache = None
+    cachedir = opts.get("--cachedir", None)
+    if cachedir != None:
+        cachedir = cachedir.decode(terminalenc).encode(filesystemenc)
+        sigcache = sisfile.SignatureCache(cachedir)
+
     # Determine verbosity.
     verbose = False
     if "--verbose" in opts.keys() or "-v" in opts.keys():
@@ -250,21 +316,28 @@ def run(pgmname, argv):
     #
     # terminalenc          Terminal character encoding (autodetected)
     # filesystemenc        File system name encoding (autodetected)
-    # infile               Input SIS file name, filesystemenc encoded
-    # outfile              Output SIS file name, filesystemenc encoded
+    # filepairs            List of (infile, outfile), filesystemenc encoded
     # cert                 Certificate in PEM format
     # privkey              Certificate private key in PEM format
     # passphrase           Pass phrase of priv. key, terminalenc encoded string
     # execaps, execapmask  Capability names and bitmask for EXE files or None
     # dllcaps, dllcapmask  Capability names and bitmask for DLL files or None
+    # compression          Compression profile name
+    # sigcache             SignatureCache instance or None
+    # batch                Boolean indicating batch mode
+    # jobs                 Number of SIS files to sign in parallel
     # verbose              Boolean indicating verbose terminal output
 
     if verbose:
         print
-        print "Input SIS file    %s"        % (
-            infile.decode(filesystemenc).encode(terminalenc))
-        print "Output SIS file   %s"        % (
-            outfile.decode(filesystemenc).encode(terminalenc))
+        if batch:
+            print "SIS files         %d"    % len(filepairs)
+            print "Parallel jobs     %d"    % jobs
+        else:
+            print "Input SIS file    %s"    % (
+                filepairs[0][0].decode(filesystemenc).encode(terminalenc))
+            print "Output SIS file   %s"    % (
+                filepairs[0][1].decode(filesystemenc).encode(terminalenc))
         if unsign:
             print "Remove signatures Yes"
         else:
@@ -284,96 +357,228 @@ def run(pgmname, argv):
             print "DLL capabilities  <not set>"
         print
 
-    # Read input SIS file.
-    f = file(infile, "rb")
-    instring = f.read(MAXSISFILESIZE + 1)
-    f.close()
+    if not batch:
+        # Sign a single SIS file, errors are reported as-is.
+        infile, outfile = filepairs[0]
+        signsisfile(pgmname, infile, outfile, unsign, certdata, privkeydata,
+                    passphrase, execapmask, dllcapmask, compression,
+                    sigcache)
+        return
 
-    if len(instring) > MAXSISFILESIZE:
-        raise ValueError("input SIS file too large")
+    if not unsign:
+        # Decrypt the private key only once for all SIS files.
+        privkeydata = cryptutil.preparekey(privkeydata, passphrase)[0]
+        passphrase = None
+
+    # Sign SIS files, in parallel worker processes if requested.
+    results = []
+    pool = None
+    if jobs > 1 and len(filepairs) > 1 and multiprocessing != None:
+        try:
+            pool = multiprocessing.Pool(min(jobs, len(filepairs)))
+        except (OSError, ImportError, NotImplementedError):
+            # Some platforms lack working process synchronization.
+            pool = None
 
-    # Convert input SIS file to SISFields.
-    uids = instring[:16]    # UID1, UID2, UID3 and UIDCRC
-    insis, rlen = sisfield.SISField(instring[16:], False)
+    try:
+        for infile, outfile in filepairs:
+            args = (pgmname, infile, outfile, unsign, certdata, privkeydata,
+                    passphrase, execapmask, dllcapmask, compression,
+                    sigcache)
+            if pool != None:
+                results.append(pool.apply_async(batchsignsisfile, args))
+            else:
+                results.append(batchsignsisfile(*args))
+
+        if pool != None:
+            results = [r.get() for r in results]
+    finally:
+        if pool != None:
+            pool.terminate()
+            pool.join()
+
+    # Print a summary.
+    failed = 0
+    print
+    for (infile, outfile), error in zip(filepairs, results):
+        infile = infile.decode(filesystemenc).encode(terminalenc)
+        outfile = outfile.decode(filesystemenc).encode(terminalenc)
+        if error == None:
+            print "OK      %s -> %s" % (infile, outfile)
+        else:
+            print "FAILED  %s: %s" % (infile, error)
+            failed += 1
+    print
 
-    # Ignore extra bytes after SIS file.
-    if len(instring) > (rlen + 16):
-        print ("%s: warning: %d extra bytes after input SIS file (ignored)" %
-               (pgmname, (len(instring) - (rlen + 16))))
+    if failed > 0:
+        raise ValueError("%d of %d SIS files could not be signed" %
+                         (failed, len(filepairs)))
+    print "%s: %d SIS files signed" % (pgmname, len(filepairs))
 
-    # Try to release some memory early.
-    del instring
 
-    # Check if there are embedded SIS files. Warn if there are.
-    if len(insis.Data.DataUnits) > 1:
-        print ("%s: warning: input SIS file contains "
-               "embedded SIS files (ignored)" % pgmname)
+##############################################################################
+# Module-level functions which are normally only used by this module
+##############################################################################
 
-    # Modify EXE- and DLL-files according to new capabilities.
-    if execaps != None or dllcaps != None:
-        # Generate FileIndex to SISFileDescription mapping.
-        sisfiledescmap = mapfiledesc(insis.Controller.Data.InstallBlock)
+def signsisfile(pgmname, infile, outfile, unsign, certdata, privkeydata,
+                passphrase, execapmask, dllcapmask, compression, sigcache):
+    '''Sign (or unsign) a single SIS file and modify capabilities of its
+    EXE- and DLL-files, if requested.'''
 
-        exemods, dllmods = modifycaps(insis, sisfiledescmap,
-                                      execapmask, dllcapmask)
-        print ("%s: %d EXE-files will be modified, "
-               "%d DLL-files will be modified" % (pgmname, exemods, dllmods))
+    # Worker processes may not inherit the compression profile.
+    sisfield.setcompressionprofile(compression)
 
-    # Temporarily remove the SISDataIndex SISField from SISController.
-    ctrlfield = insis.Controller.Data
-    didxfield = ctrlfield.DataIndex
-    ctrlfield.DataIndex = None
+    # Open input SIS file. The file is not read into memory. Only the
+    # SISController is parsed and re-generated. Unless capabilities are
+    # modified, SISData is copied to the output file verbatim.
+    instring = sisfile.mapfile(infile)
 
-    if not unsign:
-        # Remove old signatures.
-        if len(ctrlfield.getsignatures()) > 0:
-            print ("%s: warning: removing old signatures "
-                   "from input SIS file" % pgmname)
+    try:
+        if ((execapmask != None or dllcapmask != None) and
+            len(instring) > MAXSISFILESIZE):
+            raise ValueError("input SIS file too large")
+
+        # Convert input SIS file to SISFields.
+        uids = instring[:16]    # UID1, UID2, UID3 and UIDCRC
+        insis, rlen = sisfield.SISField(instring, False, 16)
+
+        # Ignore extra bytes after SIS file.
+        if len(instring) > (rlen + 16):
+            print ("%s: warning: %d extra bytes after input SIS file "
+                   "(ignored)" % (pgmname, (len(instring) - (rlen + 16))))
+
+        # Check if there are embedded SIS files. Warn if there are.
+        if len(insis.Data.DataUnits) > 1:
+            print ("%s: warning: input SIS file contains "
+                   "embedded SIS files (ignored)" % pgmname)
+
+        # Modify EXE- and DLL-files according to new capabilities.
+        datamodified = False
+        if execapmask != None or dllcapmask != None:
+            # Generate FileIndex to SISFileDescription mapping.
+            sisfiledescmap = mapfiledesc(insis.Controller.Data.InstallBlock,
+                                         {})
+
+            exemods, dllmods = modifycaps(insis, sisfiledescmap,
+                                          execapmask, dllcapmask)
+            print ("%s: %d EXE-files will be modified, "
+                   "%d DLL-files will be modified" %
+                   (pgmname, exemods, dllmods))
+            datamodified = (exemods + dllmods) > 0
+
+        # Temporarily remove the SISDataIndex SISField from SISController.
+        ctrlfield = insis.Controller.Data
+        didxfield = ctrlfield.DataIndex
+        ctrlfield.DataIndex = None
+
+        if not unsign:
+            # Remove old signatures.
+            if len(ctrlfield.getsignatures()) > 0:
+                print ("%s: warning: removing old signatures "
+                       "from input SIS file" % pgmname)
+                ctrlfield.setsignatures([])
+
+            # Calculate a signature of the modified SISController.
+            string = ctrlfield.tostring()
+            string = sisfield.stripheaderandpadding(string)
+            signature, algoid = sisfile.signstring(privkeydata, passphrase,
+                                                   string, sigcache)
+
+            # Create a SISCertificateChain SISField from certificate data.
+            sf1 = sisfield.SISBlob(Data = cryptutil.certtobinary(certdata))
+            sf2 = sisfield.SISCertificateChain(CertificateData = sf1)
+
+            # Create a SISSignature SISField from calculated signature.
+            sf3 = sisfield.SISString(String = algoid)
+            sf4 = sisfield.SISSignatureAlgorithm(AlgorithmIdentifier = sf3)
+            sf5 = sisfield.SISBlob(Data = signature)
+            sf6 = sisfield.SISSignature(SignatureAlgorithm = sf4,
+                                        SignatureData = sf5)
+
+            # Create a new SISSignatureCertificateChain SISField.
+            sa  = sisfield.SISArray(SISFields = [sf6])
+            sf7 = sisfield.SISSignatureCertificateChain(Signatures = sa,
+                                                        CertificateChain = sf2)
+
+            # Set new certificate.
+            ctrlfield.Signature0 = sf7
+        else:
+            # Unsign, remove old signatures.
             ctrlfield.setsignatures([])
 
-        # Calculate a signature of the modified SISController.
-        string = ctrlfield.tostring()
-        string = sisfield.stripheaderandpadding(string)
-        signature, algoid = sisfile.signstring(privkeydata, passphrase, string)
-
-        # Create a SISCertificateChain SISField from certificate data.
-        sf1 = sisfield.SISBlob(Data = cryptutil.certtobinary(certdata))
-        sf2 = sisfield.SISCertificateChain(CertificateData = sf1)
-
-        # Create a SISSignature SISField from calculated signature.
-        sf3 = sisfield.SISString(String = algoid)
-        sf4 = sisfield.SISSignatureAlgorithm(AlgorithmIdentifier = sf3)
-        sf5 = sisfield.SISBlob(Data = signature)
-        sf6 = sisfield.SISSignature(SignatureAlgorithm = sf4,
-                                    SignatureData = sf5)
-
-        # Create a new SISSignatureCertificateChain SISField.
-        sa  = sisfield.SISArray(SISFields = [sf6])
-        sf7 = sisfield.SISSignatureCertificateChain(Signatures = sa,
-                                                    CertificateChain = sf2)
-
-        # Set new certificate.
-        ctrlfield.Signature0 = sf7
-    else:
-        # Unsign, remove old signatures.
-        ctrlfield.setsignatures([])
+        # Restore data index.
+        ctrlfield.DataIndex = didxfield
+
+        # Update checksums, if present in the input SIS file.
+        if insis.ControllerChecksum != None:
+            cw = sisfile.ChecksumWriter()
+            insis.Controller.writeto(cw)
+            insis.ControllerChecksum.Checksum = cw.getvalue()
+        if insis.DataChecksum != None and datamodified:
+            cw = sisfile.ChecksumWriter()
+            insis.Data.writeto(cw)
+            insis.DataChecksum.Checksum = cw.getvalue()
+
+        # Write output SIS file. The input file is still needed while writing,
+        # so when overwriting it, write to a temporary file first.
+        samefile = (os.path.abspath(outfile) == os.path.abspath(infile))
+        try:
+            samefile = samefile or os.path.samefile(outfile, infile)
+        except (AttributeError, OSError):
+            # os.path.samefile() not available or outfile does not exist.
+            pass
+
+        if samefile:
+            tmpfile = outfile + ".tmp"
+        else:
+            tmpfile = outfile
+
+        f = file(tmpfile, "wb")
+        try:
+            f.write(uids)
+            insis.writeto(f)
+        finally:
+            f.close()
+    finally:
+        sisfile.unmapfile(instring)
+
+    if samefile:
+        try:
+            os.rename(tmpfile, outfile)
+        except OSError:
+            # Cannot rename over an existing file on all platforms.
+            os.remove(outfile)
+            os.rename(tmpfile, outfile)
+
+def batchsignsisfile(*args):
+    '''Sign a SIS file in batch mode. Return None on success or
+    an error message on failure.'''
 
-    # Restore data index.
-    ctrlfield.DataIndex = didxfield
+    try:
+        signsisfile(*args)
+    except Exception, e:
+        if debug:
+            # Debug output requested, print exception traceback.
+            traceback.print_exc()
+        return str(e)
+    return None
 
-    # Convert SISFields to string.
-    outstring = insis.tostring()
+def makefilepair(names, terminalenc, filesystemenc):
+    '''Convert an input SIS file name and an optional output SIS file name
+    to an (infile, outfile) pair in filesystem encoding.'''
 
-    # Write output SIS file.
-    f = file(outfile, "wb")
-    f.write(uids)
-    f.write(outstring)
-    f.close()
+    infile = names[0].decode(terminalenc).encode(filesystemenc)
 
+    if len(names) < 2 or names[1] == "":
+        # No output file, overwrite original SIS file.
+        outfile = infile
+    else:
+        outfile = names[1].decode(terminalenc).encode(filesystemenc)
+        if os.path.isdir(outfile):
+            # Output to directory, use input file name.
+            outfile = os.path.join(outfile, os.path.basename(infile))
 
-##############################################################################
-# Module-level functions which are normally only used by this module
-##############################################################################
+    return (infile, outfile)
 
 def modifycaps(siscontents, sisfiledescmap, execapmask, dllcapmask):
     '''Scan SISData SISFields for EXE- and DLL-files
@@ -392,18 +597,20 @@ def modifycaps(siscontents, sisfiledescmap, execapmask, dllcapmask):
     for fileindex in xrange(len(sisfiledata)):
         capmask = None
 
-        # Get file contents (uncompressed).
-        contents = sisfiledata[fileindex].FileData.Data
-
-        # Determine file type.
-        if execapmask != None and contents[:4] == exeuids:
+        # Determine file type. Only decompress the first few bytes.
+        filedata = sisfiledata[fileindex].FileData
+        uids = filedata.peekdata(4)
+        if execapmask != None and uids == exeuids:
             capmask = execapmask
             exemods += 1
-        elif dllcapmask != None and contents[:4] == dlluids:
+        elif dllcapmask != None and uids == dlluids:
             capmask = dllcapmask
             dllmods += 1
 
         if capmask != None:
+            # Get file contents (uncompressed).
+            contents = filedata.Data
+
             # Modify capabilities contained in the E32Image header.
             contents = symbianutil.e32imagecrc(contents, capabilities = capmask)
 
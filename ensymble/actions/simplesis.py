@@ -48,7 +48,8 @@ longhelp  = '''simplesis
     [--caption="Package Name",...] [--drive=C] [--textfile=mytext_%C.txt]
     [--cert=mycert.cer] [--privkey=mykey.key] [--passphrase=12345]
     [--vendor="Vendor Name",...] [--encoding=terminal,filesystem]
-    [--verbose]
+    [--jobs=N] [--cachedir=dir] [--cachesize=N] [--sigcache]
+    [--compression=max] [--verbose]
     <srcdir> [sisfile]
 
 Create a SIS package from a directory structure. Only supports very
@@ -69,6 +70,11 @@ Options:
     passphrase   - Pass phrase of the private key (insecure, use stdin instead)
     vendor       - Vendor name or a comma separated list of names in all lang.
     encoding     - Local character encodings for terminal and filesystem
+    jobs         - Number of files to compress in parallel (1 by default)
+    cachedir     - Directory for caching compressed files
+    cachesize    - Compression cache size limit in megabytes
+    sigcache     - Also cache RSA signatures in cachedir
+    compression  - Compression profile: fast, normal, max or exhaustive
     verbose      - Print extra statistics
 
 If no certificate and its private key are given, a default self-signed
@@ -138,11 +144,12 @@ def run(pgmname, argv):
         gopt = getopt.getopt
 
     # Parse command line arguments.
-    short_opts = "u:r:l:c:f:t:a:k:p:d:e:vh"
+    short_opts = "u:r:l:c:f:t:a:k:p:d:e:j:z:vh"
     long_opts = [
         "uid=", "version=", "lang=", "caption=",
         "drive=", "textfile=", "cert=", "privkey=", "passphrase=", "vendor=",
-        "encoding=", "verbose", "debug", "help"
+        "encoding=", "jobs=", "cachedir=", "cachesize=", "sigcache",
+        "compression=", "verbose", "debug", "help"
     ]
     args = gopt(argv, short_opts, long_opts)
 
@@ -347,6 +354,46 @@ def run(pgmname, argv):
 
             passphrase = passphrase.strip()
 
+    # Determine number of parallel compression jobs.
+    jobs = opts.get("--jobs", opts.get("-j", "1"))
+    try:
+        jobs = int(jobs)
+        if jobs < 1:
+            raise ValueError
+    except ValueError:
+        raise ValueError("invalid number of jobs '%s'" % jobs)
+
+    # Determine compression profile.
+    compression = opts.get("--compression", opts.get("-z", "max"))
+    if compression not in sisfield.compressionprofiles:
+        raise ValueError("invalid compression profile '%s'" % compression)
+
+    # Determine compression and signature cache directory and size limit.
+    cache = None
+    sigcache = None
+    cachedir = opts.get("--cachedir", None)
+    cachesize = opts.get("--cachesize", None)
+    if cachedir != None:
+        cachedir = cachedir.decode(terminalenc).encode(filesystemenc)
+        if cachesize == None:
+            cachesize = sisfile.DEFAULTCACHESIZE
+        else:
+            try:
+                if int(cachesize) < 0:
+                    raise ValueError
+                cachesize = int(cachesize) * 1024 * 1024
+            except ValueError:
+                raise ValueError("invalid cache size '%s'" % cachesize)
+        cache = sisfile.CompressionCache(cachedir, cachesize)
+        if "--sigcache" in opts.keys():
+            # Signatures are derived from the private key, cache
+            # them only on request.
+            sigcache = sisfile.SignatureCache(cachedir)
+    elif cachesize != None:
+        raise ValueError("cache size given without cache directory")
+    elif "--sigcache" in opts.keys():
+        raise ValueError("signature cache requested without cache directory")
+
     # Determine verbosity.
     verbose = False
     if "--verbose" in opts.keys() or "-v" in opts.keys():
@@ -379,6 +426,10 @@ def run(pgmname, argv):
     # privkey       Certificate private key in PEM format
     # passphrase    Pass phrase of private key, terminalenc encoded string
     # vendor        List of Unicode vendor names, one per language
+    # jobs          Number of files to compress in parallel
+    # cache         CompressionCache instance or None
+    # sigcache      SignatureCache instance or None
+    # compression   Compression profile name
     # verbose       Boolean indicating verbose terminal output
 
     if verbose:
@@ -403,11 +454,16 @@ def run(pgmname, argv):
             privkey.decode(filesystemenc).encode(terminalenc)) or "<default>")
         print "Vendor name(s)      %s"          % ", ".join(
             [s.encode(terminalenc) for s in vendor])
+        print "Cache directory     %s"          % ((cachedir and
+            cachedir.decode(filesystemenc).encode(terminalenc)) or "<none>")
+        print "Signature cache     %s"        % ((sigcache and "Yes") or "No")
         print
 
     # Generate SimpleSISWriter object.
     sw = sisfile.SimpleSISWriter(lang, caption, puid, version,
-                                 vendor[0], vendor)
+                                 vendor[0], vendor, jobs = jobs,
+                                 cache = cache, profile = compression,
+                                 sigcache = sigcache)
 
     # Add text file or files to the SIS object. Text dialog is
     # supposed to be displayed before anything else is installed.
@@ -449,6 +505,13 @@ def run(pgmname, argv):
     # Generate SIS file out of the SimpleSISWriter object.
     sw.tofile(outfile)
 
+    if verbose:
+        # Report how each file was compressed.
+        for target, uncomplen, complen, desc in sw.getcompressioninfo():
+            print "%8d -> %8d bytes  %s (%s)" % (uncomplen, complen,
+                (target or "<no target>").encode(terminalenc), desc)
+        print
+
 
 ##############################################################################
 # Module-level functions which are normally only used by this module
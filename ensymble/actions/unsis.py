@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+# cmd_unsis.py - Ensymble command line tool, unsis command
+# Copyright 2006, 2007 Jussi Ylänen
+#
+# This file is part of Ensymble developer utilities for Symbian OS(TM).
+#
+# Ensymble is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Ensymble is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ensymble; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##############################################################################
+
+import sys
+import os
+import getopt
+import locale
+import traceback
+
+try:
+    import multiprocessing
+except ImportError:
+    # Not available on Python <v2.6, only serial extraction is supported.
+    multiprocessing = None
+
+from utils import sisfile
+from utils import sisfield
+
+
+##############################################################################
+# Help texts
+##############################################################################
+
+shorthelp = 'Extract the files of a SIS package'
+longhelp  = '''unsis
+    [--encoding=terminal,filesystem] [--manifest=manifest.txt] [--jobs=N]
+    [--verbose]
+    <infile> [outdir]
+
+Extract all files of a SIS package into a directory. Target paths of the
+files are mapped to paths under the output directory. The SHA-1 digest of
+each file is checked during extraction.
+
+Options:
+    infile      - Path of the SIS file
+    outdir      - Output directory (SIS file name without extension by default)
+    encoding    - Local character encodings for terminal and filesystem
+    manifest    - List of extracted files ("manifest.txt" in outdir by default)
+    jobs        - Number of files to extract in parallel (1 by default)
+    verbose     - Print extra statistics
+
+Files of embedded SIS files are extracted as well. When several files have
+the same target path, a number is appended to the names of the later ones.
+'''
+
+
+##############################################################################
+# Parameters
+##############################################################################
+
+MANIFESTNAME = "manifest.txt"   # Default manifest file name
+
+
+##############################################################################
+# Global variables
+##############################################################################
+
+debug = False
+reader = None   # SISReader instance of this process
+
+
+##############################################################################
+# Public module-level functions
+##############################################################################
+
+def run(pgmname, argv):
+    global debug, reader
+
+    # Determine system character encodings.
+    try:
+        # getdefaultlocale() may sometimes return None.
+        # Fall back to ASCII encoding in that case.
+        terminalenc = locale.getdefaultlocale()[1] + ""
+    except TypeError:
+        # Invalid locale, fall back to ASCII terminal encoding.
+        terminalenc = "ascii"
+
+    try:
+        # sys.getfilesystemencoding() was introduced in Python v2.3 and
+        # it can sometimes return None. Fall back to ASCII if something
+        # goes wrong.
+        filesystemenc = sys.getfilesystemencoding() + ""
+    except (AttributeError, TypeError):
+        filesystemenc = "ascii"
+
+    try:
+        gopt = getopt.gnu_getopt
+    except:
+        # Python <v2.3, GNU-style parameter ordering not supported.
+        gopt = getopt.getopt
+
+    # Parse command line arguments.
+    short_opts = "e:m:j:vh"
+    long_opts = [
+        "encoding=", "manifest=", "jobs=", "verbose", "debug", "help"
+    ]
+    args = gopt(argv, short_opts, long_opts)
+
+    opts = dict(args[0])
+    pargs = args[1]
+
+    if len(pargs) == 0:
+        raise ValueError("no SIS file name given")
+    elif len(pargs) > 2:
+        raise ValueError("wrong number of arguments")
+
+    # Override character encoding of command line and filesystem.
+    encs = opts.get("--encoding", opts.get("-e", "%s,%s" % (terminalenc,
+                                                            filesystemenc)))
+    try:
+        terminalenc, filesystemenc = encs.split(",")
+    except (ValueError, TypeError):
+        raise ValueError("invalid encoding string '%s'" % encs)
+
+    # Get input SIS file name.
+    infile = pargs[0].decode(terminalenc).encode(filesystemenc)
+
+    # Determine output directory.
+    if len(pargs) == 2:
+        outdir = pargs[1].decode(terminalenc).encode(filesystemenc)
+    else:
+        # No output directory given, use input file name without extension.
+        outdir = os.path.splitext(os.path.basename(infile))[0]
+    if os.path.exists(outdir) and not os.path.isdir(outdir):
+        raise ValueError("%s: not a directory" % outdir)
+
+    # Determine manifest file name.
+    manifest = opts.get("--manifest", opts.get("-m", None))
+    if manifest != None:
+        manifest = manifest.decode(terminalenc).encode(filesystemenc)
+    else:
+        manifest = os.path.join(outdir, MANIFESTNAME)
+
+    # Determine number of parallel extraction jobs.
+    jobs = opts.get("--jobs", opts.get("-j", "1"))
+    try:
+        jobs = int(jobs)
+        if jobs < 1:
+            raise ValueError
+    except ValueError:
+        raise ValueError("invalid number of jobs '%s'" % jobs)
+
+    # Determine verbosity.
+    verbose = False
+    if "--verbose" in opts.keys() or "-v" in opts.keys():
+        verbose = True
+
+    # Determine if debug output is requested.
+    if "--debug" in opts.keys():
+        debug = True
+
+    # Ingredients for successful SIS extraction:
+    #
+    # terminalenc          Terminal character encoding (autodetected)
+    # filesystemenc        File system name encoding (autodetected)
+    # infile               Input SIS file name, filesystemenc encoded
+    # outdir               Output directory name, filesystemenc encoded
+    # manifest             Manifest file name, filesystemenc encoded
+    # jobs                 Number of files to extract in parallel
+    # verbose              Boolean indicating verbose terminal output
+
+    if verbose:
+        print
+        print "Input SIS file    %s"        % (
+            infile.decode(filesystemenc).encode(terminalenc))
+        print "Output directory  %s"        % (
+            outdir.decode(filesystemenc).encode(terminalenc))
+        print "Manifest file     %s"        % (
+            manifest.decode(filesystemenc).encode(terminalenc))
+        print "Parallel jobs     %d"        % jobs
+        print
+
+    # Open input SIS file. Only the SISControllers are parsed.
+    reader = sisfile.SISReader(infile)
+    try:
+        if reader.extralength > 0:
+            print ("%s: warning: %d extra bytes after input SIS file "
+                   "(ignored)" % (pgmname, reader.extralength))
+
+        # Determine output file names. Never overwrite the manifest.
+        reserved = []
+        absoutdir = os.path.join(os.path.abspath(outdir), "")
+        absmanifest = os.path.abspath(manifest)
+        if absmanifest.startswith(absoutdir):
+            reserved.append(absmanifest[len(absoutdir):])
+        filepaths = makefilepaths(reader.files, filesystemenc, reserved)
+
+        # Create directories for output files. Files which cannot be
+        # created are reported along with other extraction failures.
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        results = {}
+        order = []
+        for index, path in filepaths:
+            dirname = os.path.dirname(os.path.join(outdir, path))
+            try:
+                if not os.path.isdir(dirname):
+                    os.makedirs(dirname)
+            except OSError, e:
+                results[index] = str(e)
+            else:
+                order.append((index, path))
+
+        # Extract files, in parallel worker processes if requested.
+        # Largest files are started first, to keep the workers busy.
+        order.sort(key = lambda item:
+                   -reader.files[item[0]].uncompressedlength)
+        pool = None
+        if jobs > 1 and len(order) > 1 and multiprocessing != None:
+            try:
+                pool = multiprocessing.Pool(min(jobs, len(order)),
+                                            openreader, (infile,))
+            except (OSError, ImportError, NotImplementedError):
+                # Some platforms lack working process synchronization.
+                pool = None
+
+        try:
+            for index, path in order:
+                args = (index, os.path.join(outdir, path))
+                if pool != None:
+                    results[index] = pool.apply_async(extractfile, args)
+                else:
+                    results[index] = extractfile(*args)
+
+            if pool != None:
+                for index, path in order:
+                    results[index] = results[index].get()
+        finally:
+            if pool != None:
+                pool.terminate()
+                pool.join()
+
+        # Report results and list extracted files in the manifest.
+        failed = 0
+        lines = ["# Files extracted from %s" % infile,
+                 "# path<TAB>target<TAB>length<TAB>SHA-1<TAB>MIME type"]
+        for index, path in filepaths:
+            entry = reader.files[index]
+            target = entry.target.encode(terminalenc, "replace")
+            error = results[index]
+            if error == None:
+                lines.append("%s\t%s\t%d\t%s\t%s" % (
+                    path, entry.target.encode("utf-8"),
+                    entry.uncompressedlength, entry.hash.encode("hex"),
+                    entry.mimetype.encode("utf-8")))
+                if verbose:
+                    print "OK      %s -> %s" % (target,
+                        path.decode(filesystemenc).encode(terminalenc))
+            else:
+                print "FAILED  %s: %s" % (target, error)
+                failed += 1
+        if verbose or failed > 0:
+            print
+    finally:
+        reader.close()
+        reader = None
+
+    f = file(manifest, "wb")
+    try:
+        f.write("\n".join(lines) + "\n")
+    finally:
+        f.close()
+
+    if failed > 0:
+        raise ValueError("%d of %d files could not be extracted" %
+                         (failed, len(filepaths)))
+    print "%s: %d files extracted to %s" % (pgmname, len(filepaths),
+        outdir.decode(filesystemenc).encode(terminalenc))
+
+
+##############################################################################
+# Module-level functions which are normally only used by this module
+##############################################################################
+
+def makefilepaths(files, filesystemenc, reserved = None):
+    '''Map target paths of SISFileEntry instances to relative output file
+    paths. Return a list of (index, path) tuples, one per extracted file.
+
+    No output file path is the same as another one, or a directory of
+    another one. Relative file paths in the optional reserved list are
+    never used.'''
+
+    filepaths = []
+    used = {}   # Lower case file paths in use
+    dirs = {}   # Lower case directory paths in use
+    dirmap = {} # Lower case target directories to output directories
+
+    def adddirs(path):
+        path = os.path.dirname(path)
+        while path != "":
+            dirs[path.lower()] = True
+            path = os.path.dirname(path)
+
+    for path in (reserved or []):
+        used[path.lower()] = True
+        adddirs(path)
+
+    for index in xrange(len(files)):
+        entry = files[index]
+        if entry.offset == None or entry.operation == sisfield.EOpNull:
+            # No file data, nothing to extract.
+            continue
+
+        # Convert "!:\sys\bin\file.exe" to "!/sys/bin/file.exe".
+        # Never go outside the output directory.
+        names = []
+        for name in entry.target.replace(u"/", u"\\").split(u"\\"):
+            name = name.replace(u":", u"")
+            if name in (u"", u".", u".."):
+                continue
+            try:
+                names.append(name.encode(filesystemenc))
+            except UnicodeError:
+                names.append(name.encode(filesystemenc,
+                                         "replace").replace("?", "_"))
+        if len(names) == 0:
+            # No target path, e.g. text shown during installation.
+            names = ["file%d" % index]
+
+        # A directory may have the same name as a file extracted earlier.
+        # Rename the directory then, the same way for all files in it.
+        dirpath = ""
+        for n in xrange(len(names) - 1):
+            key = os.path.join(*names[:n + 1]).lower()
+            if key not in dirmap:
+                basepath = os.path.join(dirpath, names[n])
+                path = basepath
+                count = 1
+                while path.lower() in used or (path != basepath and
+                                               path.lower() in dirs):
+                    path = "%s.%d" % (basepath, count)
+                    count += 1
+                dirmap[key] = path
+            dirpath = dirmap[key]
+
+        # Several files may share a target path: language dependent files
+        # and files of embedded SIS files. A file may also have the same
+        # name as a directory of another file. Symbian OS ignores case.
+        basepath = os.path.join(dirpath, names[-1])
+        path = basepath
+        count = 1
+        while path.lower() in used or path.lower() in dirs:
+            path = "%s.%d" % (basepath, count)
+            count += 1
+        used[path.lower()] = True
+        adddirs(path)
+
+        filepaths.append((index, path))
+
+    return filepaths
+
+def openreader(infile):
+    '''Open the SIS file in a worker process.'''
+
+    global reader
+
+    reader = sisfile.SISReader(infile)
+
+def extractfile(index, path):
+    '''Extract a file of the SIS file opened in this process. Return None
+    on success or an error message on failure.'''
+
+    try:
+        f = file(path, "wb")
+        try:
+            for block in reader.iterfile(reader.files[index]):
+                f.write(block)
+        finally:
+            f.close()
+    except Exception, e:
+        if debug:
+            # Debug output requested, print exception traceback.
+            traceback.print_exc()
+
+        # Do not leave incomplete or damaged files behind.
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return str(e)
+    return None
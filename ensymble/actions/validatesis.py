@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+# cmd_validatesis.py - Ensymble command line tool, validatesis command
+# Copyright 2006, 2007 Jussi Ylänen
+#
+# This file is part of Ensymble developer utilities for Symbian OS(TM).
+#
+# Ensymble is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Ensymble is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ensymble; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##############################################################################
+
+import sys
+import getopt
+import locale
+import traceback
+
+from utils import sisfile
+from utils import sisfield
+
+
+##############################################################################
+# Help texts
+##############################################################################
+
+shorthelp = 'Check the structure of SIS packages'
+longhelp  = '''validatesis
+    [--hashes] [--encoding=terminal,filesystem] [--verbose]
+    <infile>...
+
+Check the structure and checksums of SIS files, without unpacking them.
+The first error found in each SIS file is reported, with its offset.
+
+Options:
+    infile      - Path of the SIS file/files
+    hashes      - Also check the SHA-1 digests of all files (slower)
+    encoding    - Local character encodings for terminal and filesystem
+    verbose     - Print extra statistics
+'''
+
+
+##############################################################################
+# Global variables
+##############################################################################
+
+debug = False
+
+
+##############################################################################
+# Public module-level functions
+##############################################################################
+
+def run(pgmname, argv):
+    global debug
+
+    # Determine system character encodings.
+    try:
+        # getdefaultlocale() may sometimes return None.
+        # Fall back to ASCII encoding in that case.
+        terminalenc = locale.getdefaultlocale()[1] + ""
+    except TypeError:
+        # Invalid locale, fall back to ASCII terminal encoding.
+        terminalenc = "ascii"
+
+    try:
+        # sys.getfilesystemencoding() was introduced in Python v2.3 and
+        # it can sometimes return None. Fall back to ASCII if something
+        # goes wrong.
+        filesystemenc = sys.getfilesystemencoding() + ""
+    except (AttributeError, TypeError):
+        filesystemenc = "ascii"
+
+    try:
+        gopt = getopt.gnu_getopt
+    except:
+        # Python <v2.3, GNU-style parameter ordering not supported.
+        gopt = getopt.getopt
+
+    # Parse command line arguments.
+    short_opts = "e:vh"
+    long_opts = [
+        "hashes", "encoding=", "verbose", "debug", "help"
+    ]
+    args = gopt(argv, short_opts, long_opts)
+
+    opts = dict(args[0])
+    pargs = args[1]
+
+    if len(pargs) == 0:
+        raise ValueError("no SIS file name given")
+
+    # Override character encoding of command line and filesystem.
+    encs = opts.get("--encoding", opts.get("-e", "%s,%s" % (terminalenc,
+                                                            filesystemenc)))
+    try:
+        terminalenc, filesystemenc = encs.split(",")
+    except (ValueError, TypeError):
+        raise ValueError("invalid encoding string '%s'" % encs)
+
+    # Get input SIS file names.
+    infiles = [name.decode(terminalenc).encode(filesystemenc)
+               for name in pargs]
+
+    # Determine if file hashes are to be checked.
+    checkhashes = False
+    if "--hashes" in opts.keys():
+        checkhashes = True
+
+    # Determine verbosity.
+    verbose = False
+    if "--verbose" in opts.keys() or "-v" in opts.keys():
+        verbose = True
+
+    # Determine if debug output is requested.
+    if "--debug" in opts.keys():
+        debug = True
+
+    # Ingredients for successful SIS validation:
+    #
+    # terminalenc          Terminal character encoding (autodetected)
+    # filesystemenc        File system name encoding (autodetected)
+    # infiles              A list of input SIS file names, filesystemenc encoded
+    # checkhashes          Boolean indicating SHA-1 digest checks of files
+    # verbose              Boolean indicating verbose terminal output
+
+    if verbose:
+        print
+        print "SIS files         %d"        % len(infiles)
+        print "Check file hashes %s"        % ((checkhashes and "Yes") or
+                                               "No")
+        print
+
+    failed = 0
+    for infile in infiles:
+        name = infile.decode(filesystemenc).encode(terminalenc)
+        try:
+            warnings = sisfile.validatesis(infile, checkhashes)
+        except (sisfield.SISException, EnvironmentError), e:
+            if debug:
+                # Debug output requested, print exception traceback.
+                traceback.print_exc()
+            print "FAILED  %s: %s" % (name, e)
+            failed += 1
+            continue
+
+        for warning in warnings:
+            print "%s: %s: warning: %s" % (pgmname, name, warning)
+        print "OK      %s" % name
+
+    if failed > 0:
+        raise ValueError("%d of %d SIS files are invalid" %
+                         (failed, len(infiles)))
@@ -24,23 +24,47 @@
 
 import struct
 import zlib
+import weakref
 
 import symbianutil
 
 
-# TODO: 1. Make all tostring() methods cache the result.
-# TODO: 2. Allow modifying objects after creation, keeping string cache in sync.
-# TODO: 3. Implement a list-of-strings type, which the tostring() (or
-#          some other method with a better name) can use, to eliminate
-#          superfluous string concatenations.
-
-
 ##############################################################################
 # Parameters
 ##############################################################################
 
 DEBUG               = 0     # (0: None, 1: Basic, 2: Verbose)
 MAXNUMSIGNATURES    = 8     # Maximum number of signatures in a SISController
+WRITEBLOCKSIZE      = 65536 # Largest single write done by writeto()
+DATABLOCKSIZE       = 65536 # Default block size for SISCompressed.iterdata()
+SAMPLESIZE          = 4096  # Size of each sample in guessincompressible()
+NUMSAMPLES          = 3     # Samples taken from the start, middle and end
+SAMPLECOMPRATIO     = 0.98  # Samples compressing worse are incompressible
+
+
+##############################################################################
+# Compression profiles
+##############################################################################
+
+Z_RLE = 3   # Not exported by the zlib module of Python v2.x
+
+# Each profile is a list of (level, window bits, memory level, strategy)
+# zlib settings. All of them are tried and the smallest result is used.
+compressionprofiles = {
+    "fast":         [(1, 15, 8, zlib.Z_DEFAULT_STRATEGY)],
+    "normal":       [(6, 15, 8, zlib.Z_DEFAULT_STRATEGY)],
+    "max":          [(9, 15, 8, zlib.Z_DEFAULT_STRATEGY)],
+    "exhaustive":   [(9, 15, 8, zlib.Z_DEFAULT_STRATEGY),
+                     (9, 15, 9, zlib.Z_DEFAULT_STRATEGY),
+                     (8, 15, 9, zlib.Z_DEFAULT_STRATEGY),
+                     (9, 15, 9, zlib.Z_FILTERED),
+                     (9, 15, 9, zlib.Z_HUFFMAN_ONLY),
+                     (9, 15, 9, Z_RLE),
+                     (9, 13, 9, zlib.Z_DEFAULT_STRATEGY),
+                     (9, 11, 9, zlib.Z_DEFAULT_STRATEGY)]
+}
+
+compressionprofile = "max"  # Default profile, set by setcompressionprofile()
 
 
 ##############################################################################
@@ -116,26 +140,33 @@ class SISException(StandardError):
 # Public module-level functions
 ##############################################################################
 
-def SISField(fromstring, exactlength = True):
+def SISField(fromstring, exactlength = True, offset = 0, length = None):
     '''Generator function for creating SISField subclass instances from a string
 
     If exactlength is False, return a tuple of (SISField, bytes consumed).
-    Otherwise return SISField directly.'''
+    Otherwise return SISField directly.
+
+    The string may also be a buffer object or an mmap object. Only the part
+    starting at offset and spanning length bytes (all of it by default) is
+    parsed. The string is never sliced as a whole: only the leaf values
+    (integers, strings, blobs and compressed data) are copied out of it.'''
+
+    if length == None:
+        length = len(fromstring) - offset
 
     # Determine SISField subclass type.
     ftype, hdrlen, flen, padlen = parsesisfieldheader(fromstring, None,
-                                                      exactlength)
+                                                      exactlength,
+                                                      offset, length)
 
     try:
         fclass = fieldnumtoclass[ftype]
     except KeyError:
         raise SISException("invalid SISField type '%d'" % ftype)
 
-    # Limit string to actual data length (in case exactlength was False).
-    fromstring = fromstring[:(hdrlen + flen + padlen)]
-
-    # Create a subclass instance.
-    field = fclass(fromstring = fromstring)
+    # Create a subclass instance. Only the contents of the field are
+    # passed on, the header has been parsed already.
+    field = fclass(fromcontents = (fromstring, offset + hdrlen, flen))
 
     if exactlength:
         return field
@@ -144,7 +175,7 @@ def SISField(fromstring, exactlength = True):
         # Number of consumed bytes need to be passed back in that case. This
         # may violate the idea of a generator function somewhat, but eliminates
         # a bit of duplicated code.
-        return (field, len(fromstring))
+        return (field, hdrlen + flen + padlen)
 
 def stripheaderandpadding(fromstring):
     '''Return the actual content of SISField string.
@@ -161,32 +192,177 @@ def stripheaderandpadding(fromstring):
     # Return field contents.
     return fromstring[hdrlen:(hdrlen + flen)]
 
+def setcompressionprofile(profile):
+    '''Set the default compression profile.
+
+    setcompressionprofile(...) -> None
+
+    profile     "fast", "normal", "max" (the default) or "exhaustive"
+
+    The default profile is used by all SISCompressed SISFields
+    which have not been given a profile of their own.'''
+
+    global compressionprofile
+
+    if profile not in compressionprofiles:
+        raise ValueError("invalid compression profile '%s'" % profile)
+
+    compressionprofile = profile
+
+def makecompressobjs(profile = None):
+    '''Return a list of zlib compression objects,
+    one for each setting in the given compression profile.'''
+
+    if profile == None:
+        profile = compressionprofile
+
+    try:
+        settings = compressionprofiles[profile]
+    except KeyError:
+        raise ValueError("invalid compression profile '%s'" % profile)
+
+    return [zlib.compressobj(level, zlib.DEFLATED, wbits, memlevel, strategy)
+            for level, wbits, memlevel, strategy in settings]
+
+def compressstring(string, profile = None):
+    '''Compress a string using a compression profile.
+
+    compressstring(...) -> cstring
+
+    string      data to compress, a binary string
+    profile     name of the compression profile, default profile if None
+
+    cstring     smallest RFC1950 compressed result, a binary string'''
+
+    cstring = None
+    for compobj in makecompressobjs(profile):
+        result = compobj.compress(string) + compobj.flush()
+        if cstring == None or len(result) < len(cstring):
+            cstring = result
+    return cstring
+
+def guessincompressible(data):
+    '''Guess if compressing the given data is futile.
+
+    guessincompressible(...) -> reason
+
+    data        data to be compressed, a binary string or a seekable
+                file-like object
+
+    reason      a short description why the data is considered
+                incompressible, or None if it should be compressed
+
+    Data with a known compressed file format signature (JPEG, PNG, ZIP
+    and so on) is never compressed. For other data larger than a few
+    samples, samples are compressed quickly. If they do not compress well
+    enough, neither will the whole data. Short signatures which may also
+    start a text file (bzip2, MP3, Flash) only name the format, samples must
+    still fail to compress.
+
+    File-like objects are sampled from the current position to the end,
+    at the same offsets as strings. The position is restored afterwards.'''
+
+    if isinstance(data, str):
+        length = len(data)
+        def readsample(offset, size):
+            return data[offset:(offset + size)]
+    else:
+        start = data.tell()
+        data.seek(0, 2)
+        length = data.tell() - start
+        def readsample(offset, size):
+            data.seek(start + offset)
+            return data.read(size)
+
+    try:
+        head = readsample(0, MAXMAGICLENGTH)
+        formatname = None
+        for magic, offset, name, conclusive in compressedfilemagic:
+            if head[offset:(offset + len(magic))] == magic:
+                if conclusive:
+                    return "%s data" % name
+                formatname = name
+                break
+
+        if length <= SAMPLESIZE * NUMSAMPLES:
+            # Short data, compressing all of it is cheap enough.
+            return None
+
+        # Take samples spread evenly over the data.
+        step = (length - SAMPLESIZE) / (NUMSAMPLES - 1)
+        samplelen = 0
+        complen = 0
+        for n in xrange(NUMSAMPLES):
+            sample = readsample(n * step, SAMPLESIZE)
+            samplelen += len(sample)
+            complen += len(zlib.compress(sample, 1))
+    finally:
+        if not isinstance(data, str):
+            data.seek(start)
+
+    if complen > samplelen * SAMPLECOMPRATIO:
+        if formatname != None:
+            return "%s data" % formatname
+        return "samples did not compress"
+
+    return None
+
 
 ##############################################################################
 # Module-level functions which are normally only used by this module
 ##############################################################################
 
-def parsesisfieldheader(string, requiredtype = None, exactlength = True):
+# Signatures of file formats which contain compressed data:
+# (magic string, offset, format name, conclusive). Signatures which are
+# not conclusive are plain letters, which may also start a text file.
+compressedfilemagic = [
+    ("\xff\xd8\xff",          0, "JPEG",      True),
+    ("\x89PNG\r\n\x1a\n",     0, "PNG",       True),
+    ("GIF87a",              0, "GIF",       True),
+    ("GIF89a",              0, "GIF",       True),
+    ("PK\x03\x04",          0, "ZIP",       True),
+    ("\x1f\x8b",            0, "gzip",      True),
+    ("BZh",                 0, "bzip2",     False),
+    ("7z\xbc\xaf\x27\x1c",   0, "7-Zip",     True),
+    ("Rar!\x1a\x07",        0, "RAR",       True),
+    ("ID3",                 0, "MP3",       False),
+    ("OggS",                0, "Ogg",       True),
+    ("#!AMR",               0, "AMR",       True),
+    ("ftyp",                4, "MPEG-4",    True),
+    ("\x30\x26\xb2\x75",     0, "ASF",       True),
+    ("CWS",                 0, "Flash",     False)
+]
+MAXMAGICLENGTH = max([len(magic) + offset
+                      for magic, offset, name, conclusive
+                      in compressedfilemagic])
+
+def parsesisfieldheader(string, requiredtype = None, exactlength = True,
+                        offset = 0, length = None):
     '''Parse the header of a SISField string and return the field type and
     lengths of the various parts (header, data, padding). Optionally, check
-    that the type is correct and that the string length is not too long.'''
+    that the type is correct and that the string length is not too long.
+
+    Only the part of the string starting at offset and spanning length
+    bytes (the rest of the string by default) is considered.'''
+
+    if length == None:
+        length = len(string) - offset
 
     hdrlen = 8
-    if hdrlen > len(string):
+    if hdrlen > length:
         raise SISException("not enough data for a complete SISField header")
 
     # Get SISField type and first part of the length.
-    ftype, flen = struct.unpack("<LL", string[:8])
+    ftype, flen = struct.unpack_from("<LL", string, offset)
 
     # Get rest of the SISField length, 31-bit or 63-bit.
-    flen2 = None
-    if flen & 0x8000000L:
+    if flen & 0x80000000L:
         # 63-bit length, read rest of length.
         hdrlen = 12
-        if hdrlen > len(string):
+        if hdrlen > length:
             raise SISException("not enough data for a complete SISField header")
-        flen2 = struct.unpack("<L", string[8:12])[0]
-        flen = (flen & 0x7ffffffL) | (flen2 << 31)
+        flen2 = struct.unpack_from("<L", string, offset + 8)[0]
+        flen = (flen & 0x7fffffffL) | (flen2 << 31)
 
     # Calculate padding to 32-bit boundary.
     padlen = ((flen + 3) & ~0x3L) - flen
@@ -194,11 +370,11 @@ def parsesisfieldheader(string, requiredtype = None, exactlength = True):
     if requiredtype != None and ftype != requiredtype:
         raise SISException("invalid SISField type '%d'" % ftype)
 
-    if (hdrlen + flen + padlen) > len(string):
+    if (hdrlen + flen + padlen) > length:
         raise SISException("SISField contents too short")
 
     # Allow oversized strings when parsing recursive SISFields.
-    if exactlength and (hdrlen + flen + padlen) < len(string):
+    if exactlength and (hdrlen + flen + padlen) < length:
         raise SISException("SISField contents too long")
 
     return ftype, hdrlen, flen, padlen
@@ -225,26 +401,196 @@ def makesisfieldpadding(fieldlen):
 
     return "\x00" * padlen
 
+def sisfieldlength(fieldlen):
+    '''Return the total length of a SISField with contents of given length,
+    including header and padding.'''
+
+    if fieldlen < 0x80000000L:
+        hdrlen = 8      # 31-bit length
+    else:
+        hdrlen = 12     # 63-bit length
+
+    # Calculate padding to 32-bit boundary.
+    padlen = ((fieldlen + 3) & ~0x3L) - fieldlen
+
+    return hdrlen + fieldlen + padlen
+
+def chunkslength(chunks):
+    '''Return the total length of a list of chunks. A chunk is either a
+    string, a (string, offset, length) tuple referring to part of a string
+    (or a buffer or an mmap object), or a SISField with a valid cache.'''
+
+    length = 0
+    for chunk in chunks:
+        if type(chunk) == str:
+            length += len(chunk)
+        elif type(chunk) == tuple:
+            length += chunk[2]
+        else:
+            length += chunk.getlength()
+    return length
+
+def flattenchunks(chunks, strings):
+    '''Convert a list of chunks to strings, appending them to a list.'''
+
+    for chunk in chunks:
+        if type(chunk) == str:
+            strings.append(chunk)
+        elif type(chunk) == tuple:
+            data, offset, length = chunk
+            strings.append(data[offset:(offset + length)])
+        else:
+            flattenchunks(chunk.tochunks(), strings)
+
+def writechunks(chunks, fileobj):
+    '''Write a list of chunks to a file object.'''
+
+    for chunk in chunks:
+        if type(chunk) == str:
+            fileobj.write(chunk)
+        elif type(chunk) == tuple:
+            # Copy parts of the original string in blocks, so that
+            # large unmodified SISFields are never copied as a whole.
+            data, offset, length = chunk
+            end = offset + length
+            while offset < end:
+                n = min(end - offset, WRITEBLOCKSIZE)
+                fileobj.write(data[offset:(offset + n)])
+                offset += n
+        else:
+            writechunks(chunk.tochunks(), fileobj)
+
+def parsearrayitemheader(string, offset, end):
+    '''Parse the header of a SISArray item, which only contains a length
+    (SISArray items have no type code). Return the lengths of the various
+    parts (header, data, padding). Padding may be missing for the last item.'''
+
+    hdrlen = 4
+    if offset + hdrlen > end:
+        raise SISException("not enough data for a complete SISField header")
+
+    # Get first part of the SISField length.
+    flen = struct.unpack_from("<L", string, offset)[0]
+
+    # Get rest of the SISField length, 31-bit or 63-bit.
+    if flen & 0x80000000L:
+        # 63-bit length, read rest of length.
+        hdrlen = 8
+        if offset + hdrlen > end:
+            raise SISException(
+                "not enough data for a complete SISField header")
+        flen2 = struct.unpack_from("<L", string, offset + 4)[0]
+        flen = (flen & 0x7fffffffL) | (flen2 << 31)
+
+    if offset + hdrlen + flen > end:
+        raise SISException("SISField contents too short")
+
+    # Calculate padding to 32-bit boundary.
+    padlen = ((flen + 3) & ~0x3L) - flen
+    padlen = min(padlen, end - (offset + hdrlen + flen))
+
+    return hdrlen, flen, padlen
+
 
 ##############################################################################
 # SISField base classes
 ##############################################################################
 
+# Subfield types for normal SISFields
+FTYPE_INTEGRAL  = 0     # Integer
+FTYPE_MANDATORY = 1     # Mandatory SISField
+FTYPE_OPTIONAL  = 2     # Optional SISField
+FTYPE_ARRAY     = 3     # SISArray with zero or more items
+
+def compilesubfields(subfields):
+    '''Combine runs of adjacent integral subfields to
+    single entries with a precompiled struct.Struct.'''
+
+    compiled = []
+    for fattr, fkind, ffmt in subfields:
+        if fkind != FTYPE_INTEGRAL:
+            compiled.append((fattr, fkind, ffmt))
+            continue
+
+        if not ffmt.startswith("<"):
+            # Formats are concatenated, byte order must be the same.
+            raise ValueError("integral subfield '%s' not little-endian" %
+                             fattr)
+
+        if len(compiled) > 0 and compiled[-1][1] == FTYPE_INTEGRAL:
+            # Append to previous run of integral subfields.
+            fattrs, fkind, fmt = compiled[-1]
+            compiled[-1] = (fattrs + (fattr,), fkind, fmt + ffmt[1:])
+        else:
+            compiled.append(((fattr,), fkind, ffmt))
+
+    return [(fattr, fkind, (fkind == FTYPE_INTEGRAL and struct.Struct(ffmt))
+             or ffmt) for fattr, fkind, ffmt in compiled]
+
+class SISFieldClass(type):
+    '''Metaclass for SISField classes
+
+    Instances use __slots__ instead of a per-instance dictionary. Normal
+    SISField classes get a slot for each subfield in their class-level
+    subfield list. The public instance variables (all slots not in
+    lowercase) are collected to a class-level "attributes" tuple, which
+    is used for checking keyword parameters.
+
+    The subfield list is also compiled to a class-level "compiledfields"
+    list. It is like the subfield list, but each run of adjacent integral
+    subfields is combined to a single entry of (tuple of attribute names,
+    FTYPE_INTEGRAL, struct.Struct object).'''
+
+    def __new__(mcs, name, bases, namespace):
+        if "subfields" in namespace:
+            namespace["__slots__"] = tuple([fattr for fattr, fkind, ffmt in
+                                            namespace["subfields"]])
+            namespace["compiledfields"] = compilesubfields(
+                namespace["subfields"])
+        elif "__slots__" not in namespace:
+            namespace["__slots__"] = ()
+
+        cls = type.__new__(mcs, name, bases, namespace)
+
+        # Collect public instance variables from this and all base classes.
+        attributes = []
+        for c in reversed(cls.__mro__):
+            for slot in c.__dict__.get("__slots__", ()):
+                # Filter out private instance variables (all in lowercase).
+                if slot != slot.lower():
+                    attributes.append(slot)
+        cls.attributes = tuple(attributes)
+
+        return cls
+
 class SISFieldBase(object):
-    '''SISField base class'''
+    '''SISField base class
+
+    The string form of a SISField is cached as a list of chunks (see
+    tochunks()). Assigning to a public attribute (or modifying a SISArray)
+    discards the cached chunks of the SISField and of all SISFields
+    containing it. A SISField parsed from a string uses the original
+    contents as its cache until it is modified.
+
+    Subclasses list their instance variables in __slots__ and must not set
+    them before calling SISFieldBase.__init__(). Public instance variables
+    not given as keyword parameters are set to None.'''
+
+    __metaclass__ = SISFieldClass
+
+    # Cached string form of the SISField and length of the SISField
+    # contents (None if not valid) and weak references to SISFields
+    # containing this SISField.
+    __slots__ = ("chunkcache", "lengthcache", "parents", "__weakref__")
+
     def __init__(self, **kwds):
         if DEBUG > 0:
             # DEBUG: Print class name during initialization.
             print "%s.__init__()" % self.__class__.__name__
 
-        # Get the names of all instance variables.
-        validkwds = self.__dict__.keys()
-
-        # Filter out private instance variables (all in lowercase).
-        validkwds = filter(lambda s: s != s.lower(), validkwds)
-
-        # Set type code.
-        self.fieldtype = fieldnametonum[self.__class__.__name__]
+        object.__setattr__(self, "chunkcache", None)
+        object.__setattr__(self, "lengthcache", None)
+        object.__setattr__(self, "parents", ())
 
         if "fromstring" in kwds:
             if DEBUG > 1:
@@ -256,14 +602,143 @@ class SISFieldBase(object):
                 raise TypeError(
                     "keyword 'fromstring' may not be given with other keywords")
             self.fromstring(kwds["fromstring"])
+        elif "fromcontents" in kwds:
+            # Load instance variables from a (string, offset, length) tuple,
+            # pointing to the contents of an already parsed SISField header.
+            if len(kwds) != 1:
+                raise TypeError(
+                    "keyword 'fromcontents' may not be given with other "
+                    "keywords")
+            data, offset, length = kwds["fromcontents"]
+            self.loadcontents(data, offset, length)
         else:
             # Load instance variables from keywords.
             # Only accept existing variable names.
-            for kwd in kwds.keys():
-                if kwd not in validkwds:
+            for kwd in kwds:
+                if kwd not in self.attributes:
                     raise AttributeError("'%s' object has no attribute '%s'" %
                                          (self.__class__.__name__, kwd))
-                self.__dict__[kwd] = kwds[kwd]
+
+            for attr in self.attributes:
+                value = kwds.get(attr, None)
+                object.__setattr__(self, attr, value)
+                self.adopt(value)
+
+    def __setattr__(self, name, value):
+        # NOTE: Frequently set private instance variables are set using
+        # object.__setattr__() directly, bypassing this method.
+        object.__setattr__(self, name, value)
+
+        # Filter out private instance variables (all in lowercase).
+        if name != name.lower():
+            # Public attribute modified, discard cached strings.
+            self.adopt(value)
+            self.invalidate()
+
+    def adopt(self, value):
+        '''Register this SISField as a parent of a SISField or
+        a list of SISFields. Other values are ignored.'''
+
+        if isinstance(value, SISFieldBase):
+            value.addparent(self)
+        elif type(value) == list:
+            for field in value:
+                if isinstance(field, SISFieldBase):
+                    field.addparent(self)
+
+    def addparent(self, parent):
+        '''Register a SISField containing this SISField.'''
+
+        # Drop references to parents which no longer exist.
+        parents = [ref for ref in self.parents if ref() != None]
+        for ref in parents:
+            if ref() is parent:
+                break
+        else:
+            parents.append(weakref.ref(parent))
+        object.__setattr__(self, "parents", parents)
+
+    def invalidate(self):
+        '''Discard the cached string of this SISField and
+        of all SISFields containing it.'''
+
+        object.__setattr__(self, "chunkcache", None)
+        object.__setattr__(self, "lengthcache", None)
+        for ref in self.parents:
+            parent = ref()
+            # A parent without a cached string or length cannot
+            # have grandparents with a cached string or length, either.
+            if parent != None and (parent.chunkcache != None or
+                                   parent.lengthcache != None):
+                parent.invalidate()
+
+    def tochunks(self):
+        '''Return the SISField as a list of chunks (see chunkslength()).
+        The first chunk is always the SISField header string and the
+        last chunk is always the padding string.'''
+
+        if self.chunkcache == None:
+            chunks = self.makechunks()
+            object.__setattr__(self, "chunkcache", chunks)
+            object.__setattr__(self, "lengthcache", chunkslength(chunks[1:-1]))
+        return self.chunkcache
+
+    def tostring(self):
+        '''Return the SISField as a string.'''
+
+        strings = []
+        flattenchunks(self.tochunks(), strings)
+        return "".join(strings)
+
+    def writeto(self, fileobj):
+        '''Write the SISField to a file object. Unlike with tostring(), the
+        SISField is never converted to a single (possibly very large) string.'''
+
+        writechunks(self.tochunks(), fileobj)
+
+    def getlength(self):
+        '''Return the length of the SISField string,
+        including header and padding.'''
+
+        return sisfieldlength(self.getcontentlength())
+
+    def getcontentlength(self):
+        '''Return the length of the SISField contents,
+        excluding header and padding.'''
+
+        if self.lengthcache == None:
+            object.__setattr__(self, "lengthcache", self.computelength())
+        return self.lengthcache
+
+    def fromstring(self, string):
+        '''Load instance variables from a complete SISField string.'''
+        self.frombuffer(string, 0, len(string))
+
+    def frombuffer(self, data, offset, length):
+        '''Load instance variables from a complete SISField inside a string,
+        buffer or mmap object, without copying the whole field.'''
+
+        # Parse field header.
+        ftype, hdrlen, flen, padlen = parsesisfieldheader(data,
+                                                          self.fieldtype,
+                                                          True, offset,
+                                                          length)
+
+        # Parse field contents.
+        self.loadcontents(data, offset + hdrlen, flen)
+
+    def loadcontents(self, data, offset, length):
+        '''Load instance variables from the contents of a SISField and use
+        the contents as the cached string until the SISField is modified.'''
+
+        self.invalidate()
+        self.fromcontents(data, offset, length)
+
+        hdr = makesisfieldheader(self.fieldtype, length)
+        pad = makesisfieldpadding(length)
+        object.__setattr__(self, "chunkcache",
+                           [hdr, (data, offset, length), pad])
+        object.__setattr__(self, "lengthcache", length)
 
     def __str__(self):
         # Default __str__() for SISFields, only return the field name.
@@ -271,106 +746,163 @@ class SISFieldBase(object):
 
 class SISFieldNormal(SISFieldBase):
     '''SISField base class for normal fields (fields containing only other
-    fields and integers)'''
+    fields and integers)
+
+    Subclasses list their subfields in a class-level "subfields" list of
+    (attribute name, subfield type, format) tuples. Format is a struct
+    format for integers and a SISField class name for SISFields.
 
-    # Subfield types
-    FTYPE_INTEGRAL  = 0     # Integer
-    FTYPE_MANDATORY = 1     # Mandatory SISField
-    FTYPE_OPTIONAL  = 2     # Optional SISField
-    FTYPE_ARRAY     = 3     # SISArray with zero or more items
+    When parsed from a string, subfields that are SISFields are not parsed
+    right away. Only their location in the string is recorded and the actual
+    parsing happens on first access. Subfields that are never accessed are
+    copied to the output of tostring() verbatim.'''
+
+    # Subfields not parsed yet, a dictionary of
+    # attribute name: (string, offset, length) or None
+    __slots__ = ("lazyfields",)
+
+    # Subfield types, also available as class attributes
+    FTYPE_INTEGRAL  = FTYPE_INTEGRAL
+    FTYPE_MANDATORY = FTYPE_MANDATORY
+    FTYPE_OPTIONAL  = FTYPE_OPTIONAL
+    FTYPE_ARRAY     = FTYPE_ARRAY
 
     def __init__(self, **kwds):
-        # Initialize instance variables to None.
-        for fattr, fkind, ffmt in self.subfields:
-            self.__dict__[fattr] = None
+        object.__setattr__(self, "lazyfields", None)
 
         # Set instance variables.
         SISFieldBase.__init__(self, **kwds)
 
+        lazyfields = self.lazyfields or {}
         for fattr, fkind, ffmt in self.subfields:
+            if fattr in lazyfields:
+                # Not parsed yet, type was already checked by fromcontents().
+                continue
+
+            field = getattr(self, fattr)
+
             # Check that all required instance variables are set.
-            if fkind != self.FTYPE_OPTIONAL and self.__dict__[fattr] == None:
+            if fkind != FTYPE_OPTIONAL and field == None:
                 raise AttributeError("missing '%s' attribute for '%s'" %
                                      (fattr, self.__class__.__name__))
 
-            if fkind in (self.FTYPE_MANDATORY, self.FTYPE_OPTIONAL):
+            if fkind in (FTYPE_MANDATORY, FTYPE_OPTIONAL):
                 # Verify SISField types.
-                if (self.__dict__[fattr] != None and
-                    fieldnumtoname[self.__dict__[fattr].fieldtype] != ffmt):
+                if (field != None and
+                    fieldnumtoname[field.fieldtype] != ffmt):
                     raise TypeError(
                         "attribute '%s' for '%s' is of invalid SISField type" %
                         (fattr, self.__class__.__name__))
-            elif fkind == self.FTYPE_ARRAY:
+            elif fkind == FTYPE_ARRAY:
                 # Verify SISArray contents.
-                if (fieldnumtoname[self.__dict__[fattr].fieldtype] != "SISArray"
-                    or
-                    fieldnumtoname[self.__dict__[fattr].SISFieldType] != ffmt):
+                if (fieldnumtoname[field.fieldtype] != "SISArray" or
+                    fieldnumtoname[field.SISFieldType] != ffmt):
                     raise TypeError(
                         "SISArray attribute '%s' for '%s' is of invalid type" %
                         (fattr, self.__class__.__name__))
 
-    def fromstring(self, string):
-        # Parse field header.
-        ftype, hdrlen, flen, padlen = parsesisfieldheader(string,
-                                                          self.fieldtype)
-
-        # Recursively parse subfields.
-        pos = hdrlen
-        reuse = None    # SISField to re-use or None
+    def __getattr__(self, name):
+        # Only called when an attribute is not found the normal way.
+        # Parse a lazily loaded subfield on first access.
+        if name != "lazyfields":
+            lazyfields = self.lazyfields
+            if lazyfields and name in lazyfields:
+                data, offset, length = lazyfields.pop(name)
+                field = SISField(data, True, offset, length)
+                field.addparent(self)
+                object.__setattr__(self, name, field)
+                return field
+
+        raise AttributeError("'%s' object has no attribute '%s'" %
+                             (self.__class__.__name__, name))
+
+    def __setattr__(self, name, value):
+        if name != "lazyfields" and self.lazyfields:
+            # New value replaces a subfield not parsed yet.
+            self.lazyfields.pop(name, None)
+        SISFieldBase.__setattr__(self, name, value)
+
+    def fromcontents(self, data, offset, length):
+        # Scan subfield headers. SISFields are parsed later, on first access.
+        lazyfields = {}
+        pos = offset
+        end = offset + length
+        reuse = None    # SISField header to re-use or None
         try:
-            for fattr, fkind, ffmt in self.subfields:
+            for fattr, fkind, ffmt in self.compiledfields:
                 field = None    # No value by default
 
-                if fkind == self.FTYPE_INTEGRAL:
-                    # Integer, unpack it.
+                if fkind == FTYPE_INTEGRAL:
+                    # A run of integers, unpack them all at once.
                     if reuse:
                         # It is an error if there is a field to
                         # re-use present at this time.
                         raise ValueError("integral field preceded optional")
 
-                    n = struct.calcsize(ffmt)
-                    field = struct.unpack(ffmt, string[pos:(pos + n)])[0]
+                    n = ffmt.size
+                    if pos + n > end:
+                        raise ValueError("unexpected end-of-data")
+                    values = ffmt.unpack_from(data, pos)
+                    for attr, value in zip(fattr, values):
+                        object.__setattr__(self, attr, value)
                     pos += n
+                    continue
+
+                # SISField, read header from string or
+                # re-use header from previous round.
+                if not reuse:
+                    # No old header to handle, parse header from string.
+                    if pos < end:
+                        ftype, hdrlen, flen, padlen = parsesisfieldheader(
+                            data, None, False, pos, end - pos)
+                        atype = None
+                        if fieldnumtoname[ftype] == "SISArray":
+                            # Type of SISFields in the array is needed, too.
+                            if flen < 4:
+                                raise ValueError("invalid SISArray type")
+                            atype = struct.unpack_from("<L", data,
+                                                       pos + hdrlen)[0]
+                        n = hdrlen + flen + padlen
+                        field = (ftype, atype, pos, n)
+                        pos += n
+                    elif fkind != FTYPE_OPTIONAL:
+                        # No more data in string, raise an exception.
+                        raise ValueError("unexpected end-of-data")
                 else:
-                    # SISField, read data from string or
-                    # re-use field from previous round.
-                    if not reuse:
-                        # No old field to handle, convert string to SISField.
-                        if pos < (hdrlen + flen):
-                            field, n = SISField(string[pos:(hdrlen + flen)],
-                                                False)
-                            pos += n
-                        elif fkind != self.FTYPE_OPTIONAL:
-                            # No more data in string, raise an exception.
-                            raise ValueError("unexpected end-of-data")
-                    else:
-                        # Field from previous round present, re-use it.
-                        field = reuse
-                        reuse = None
-
-                    # Verify SISField type.
-                    if field != None:
-                        fname = fieldnumtoname[field.fieldtype]
-                        if fkind == self.FTYPE_ARRAY:
-                            if (fname != "SISArray" or
-                                fieldnumtoname[field.SISFieldType] != ffmt):
-                                    # Wrong type of fields inside SISArray,
-                                    # raise an exception.
-                                    raise ValueError("invalid SISArray type")
-                        elif fkind == self.FTYPE_MANDATORY:
-                            if fname != ffmt:
-                                # Mandatory field missing, raise an exception.
-                                raise ValueError("mandatory field missing")
-                        elif fkind == self.FTYPE_OPTIONAL:
-                            if fname != ffmt:
-                                # Wrong type for optional field. Skip optional
-                                # field and re-use already parsed field on next
-                                # round.
-                                reuse = field
-                                field = None
-
-                # Introduce field as an instance variable.
-                self.__dict__[fattr] = field
+                    # Header from previous round present, re-use it.
+                    field = reuse
+                    reuse = None
+
+                # Verify SISField type.
+                if field != None:
+                    fname = fieldnumtoname[field[0]]
+                    if fkind == FTYPE_ARRAY:
+                        if (fname != "SISArray" or
+                            fieldnumtoname[field[1]] != ffmt):
+                                # Wrong type of fields inside SISArray,
+                                # raise an exception.
+                                raise ValueError("invalid SISArray type")
+                    elif fkind == FTYPE_MANDATORY:
+                        if fname != ffmt:
+                            # Mandatory field missing, raise an exception.
+                            raise ValueError("mandatory field missing")
+                    elif fkind == FTYPE_OPTIONAL:
+                        if fname != ffmt:
+                            # Wrong type for optional field. Skip optional
+                            # field and re-use already parsed header on next
+                            # round.
+                            reuse = field
+                            field = None
+
+                if field != None:
+                    # Record location of the field for parsing it later.
+                    try:
+                        object.__delattr__(self, fattr)
+                    except AttributeError:
+                        pass
+                    lazyfields[fattr] = (data, field[2], field[3])
+                else:
+                    object.__setattr__(self, fattr, None)
         except (ValueError, KeyError, struct.error):
             if DEBUG > 0:
                 # DEBUG: Raise a detailed exception.
@@ -379,46 +911,70 @@ class SISFieldNormal(SISFieldBase):
                 raise SISException("invalid '%s' structure" %
                                    self.__class__.__name__)
 
-    def tostring(self):
-        # Recursively create strings from subfields.
-        fstrings = [None]
+        object.__setattr__(self, "lazyfields", lazyfields or None)
+
+    def makechunks(self):
+        # Recursively create chunks from subfields.
+        chunks = [None]
         totlen = 0
-        for fattr, fkind, ffmt in self.subfields:
-            field = self.__dict__[fattr]
-            if fkind == self.FTYPE_INTEGRAL:
-                # Integer, pack it.
+        lazyfields = self.lazyfields or {}
+        for fattr, fkind, ffmt in self.compiledfields:
+            if fkind == FTYPE_INTEGRAL:
+                # A run of integers, pack them all at once.
+                values = [getattr(self, a) for a in fattr]
                 try:
-                    string = struct.pack(ffmt, field)
-                except:
-                    print "%s %s %s" % (self.__class__, ffmt, repr(field))
+                    string = ffmt.pack(*values)
+                except struct.error:
+                    if DEBUG > 0:
+                        # DEBUG: Print the values which could not be packed.
+                        print "%s %s %s" % (self.__class__, ffmt.format,
+                                            repr(values))
                     raise
-                fstrings.append(string)
+                chunks.append(string)
                 totlen += len(string)
-            else:
-                if field == None:
-                    if fkind == self.FTYPE_OPTIONAL:
-                        # Optional field missing, skip it.
-                        pass
-                    else:
-                        # Mandatory field missing, raise an exception.
-                        raise SISException("field '%s' missing for '%s'" %
-                                           (fattr, self.__dict__.__name__))
+                continue
+
+            if fattr in lazyfields:
+                # Subfield never parsed, copy it verbatim.
+                chunk = lazyfields[fattr]
+                chunks.append(chunk)
+                totlen += chunk[2]
+                continue
+
+            field = getattr(self, fattr)
+            if field == None:
+                if fkind == FTYPE_OPTIONAL:
+                    # Optional field missing, skip it.
+                    pass
                 else:
-                    # Convert SISField to string.
-                    string = field.tostring()
-                    fstrings.append(string)
-                    totlen += len(string)
+                    # Mandatory field missing, raise an exception.
+                    raise SISException("field '%s' missing for '%s'" %
+                                       (fattr, self.__class__.__name__))
+            else:
+                # Refer to the SISField, it caches its own chunks.
+                chunks.append(field)
+                totlen += field.getlength()
 
-        try:
-            del string  # Try to free some memory early.
-        except:
-            pass
+        chunks[0] = makesisfieldheader(self.fieldtype, totlen)
+        chunks.append(makesisfieldpadding(totlen))
 
-        fstrings[0] = makesisfieldheader(self.fieldtype, totlen)
-        fstrings.append(makesisfieldpadding(totlen))
+        return chunks
 
-        # TODO: Heavy on memory, optimize (new string type with concat.)
-        return "".join(fstrings)
+    def computelength(self):
+        # Same as makechunks(), but only add up the lengths.
+        totlen = 0
+        lazyfields = self.lazyfields or {}
+        for fattr, fkind, ffmt in self.compiledfields:
+            if fkind == FTYPE_INTEGRAL:
+                totlen += ffmt.size
+            elif fattr in lazyfields:
+                # Subfield never parsed, copied verbatim.
+                totlen += lazyfields[fattr][2]
+            else:
+                field = getattr(self, fattr)
+                if field != None:
+                    totlen += field.getlength()
+        return totlen
 
 class SISFieldSpecial(SISFieldBase):
     '''SISField base class for special fields (fields that do something
@@ -434,10 +990,9 @@ class SISFieldSpecial(SISFieldBase):
 
 class SISString(SISFieldSpecial):
     '''UCS-2 (UTF-16LE) string'''
-    def __init__(self, **kwds):
-        # Set default values.
-        self.String = None
+    __slots__ = ("String",)
 
+    def __init__(self, **kwds):
         # Parse keyword parameters.
         SISFieldSpecial.__init__(self, **kwds)
 
@@ -446,37 +1001,45 @@ class SISString(SISFieldSpecial):
             raise AttributeError("missing '%s' attribute for '%s'" %
                                  ("String", self.__class__.__name__))
 
-    def fromstring(self, string):
-        ftype, hdrlen, flen, padlen = parsesisfieldheader(string,
-                                                          self.fieldtype)
-        self.String = string[hdrlen:(hdrlen + flen)].decode("UTF-16LE")
+    def fromcontents(self, data, offset, length):
+        self.String = data[offset:(offset + length)].decode("UTF-16LE")
 
-    def tostring(self):
+    def makechunks(self):
         encstr = self.String.encode("UTF-16LE")
-        return "%s%s%s" % (makesisfieldheader(self.fieldtype, len(encstr)),
-                           encstr, makesisfieldpadding(len(encstr)))
+        return [makesisfieldheader(self.fieldtype, len(encstr)),
+                encstr, makesisfieldpadding(len(encstr))]
+
+    def computelength(self):
+        # Characters outside the BMP take four bytes,
+        # the rest two. Easiest to just encode.
+        return len(self.String.encode("UTF-16LE"))
 
     def __str__(self):
         # Always return Unicode string. Let Python default encoding handle it.
         return u"<SISString '%s'>" % self.String
 
 class SISArray(SISFieldSpecial):
-    '''An array of other SISFields, all of the same type'''
-    def __init__(self, **kwds):
-        # Set default values.
-        self.SISFieldType = None    # Invalid type, checked later.
-        self.SISFields = []
+    '''An array of other SISFields, all of the same type
+
+    When parsed from a string, the items are not parsed right away. Only
+    their location in the string is recorded and the actual parsing happens
+    on first access. Items that are never accessed are copied to the output
+    of tostring() verbatim.'''
+    __slots__ = ("SISFieldType", "SISFields")
 
+    def __init__(self, **kwds):
         # Parse keyword parameters.
         SISFieldSpecial.__init__(self, **kwds)
 
-        # Make a copy of the supplied list
-        # (caller may try to modify the original).
-        self.SISFields = self.SISFields[:]
+        # Make a copy of the supplied list (caller may try to modify the
+        # original) or use an empty list by default. Not a modification,
+        # leave the cached string intact.
+        object.__setattr__(self, "SISFields", list(self.SISFields or []))
 
         # Allow type to be a string or number.
-        self.SISFieldType = fieldnametonum.get(self.SISFieldType,
-                                               self.SISFieldType)
+        object.__setattr__(self, "SISFieldType",
+                           fieldnametonum.get(self.SISFieldType,
+                                              self.SISFieldType))
 
         # Get type of first field if not given explicitly.
         if self.SISFieldType == None:
@@ -487,64 +1050,95 @@ class SISArray(SISFieldSpecial):
 
         # Check that all fields are of the same type.
         for f in self.SISFields:
+            if type(f) == tuple:
+                # Not parsed yet, type was already checked by fromcontents().
+                continue
             if f.fieldtype != self.SISFieldType:
                 raise TypeError("SISFieldType mismatch for SISArray")
 
-    def fromstring(self, string):
-        # Parse field header.
-        ftype, hdrlen, flen, padlen = parsesisfieldheader(string,
-                                                          self.fieldtype)
-
-        if flen < 4:
+    def fromcontents(self, data, offset, length):
+        if length < 4:
             raise SISException("not enough data for a complete SISArray header")
 
         # Get array type (type of SISFields in the array).
-        atype = struct.unpack("<L", string[hdrlen:(hdrlen + 4)])[0]
+        atype = struct.unpack_from("<L", data, offset)[0]
+
+        if atype not in fieldnumtoclass:
+            raise SISException("invalid SISField type '%d'" % atype)
 
-        pos = hdrlen + 4    # Skip SISFieldType.
-        totlen = hdrlen + flen
+        pos = offset + 4    # Skip SISFieldType.
+        totlen = offset + length
         fields = []
         while pos < totlen:
-            # Get first part of the SISField length.
-            alen = struct.unpack("<L", string[pos:(pos+4)])[0]
-            pos += 4
+            # Array items have no type code, only a length.
+            hdrlen, alen, apadlen = parsearrayitemheader(data, pos, totlen)
 
-            # Get rest of the SISField length, 31-bit or 63-bit.
-            alen2 = None
-            if alen & 0x8000000L:
-                # 63-bit length, read rest of length.
-                alen2 = struct.unpack("<L", string[pos:(pos+4)])[0]
-                alen = (alen & 0x7ffffffL) | (alen2 << 31)
-                pos += 4
+            # Record location of the item for parsing it later.
+            n = hdrlen + alen + apadlen
+            fields.append((data, pos, n))
 
-            # Calculate padding to 32-bit boundary.
-            apadlen = ((alen + 3) & ~0x3L) - alen
+            pos += n
 
-            # Construct a valid SISField header and proper padding.
-            fhdr = makesisfieldheader(atype, alen)
-            fpad = makesisfieldpadding(alen)
+        self.SISFieldType = atype
+        self.SISFields = fields
 
-            # Create a SISField.
-            # TODO: Heavy on memory, optimize (new string type with concat.)
-            field = SISField(fhdr + string[pos:(pos + alen)] + fpad)
+    def loaditem(self, index):
+        '''Return an item of the array, parsing it first if necessary.'''
+
+        field = self.SISFields[index]
+        if type(field) == tuple:
+            # Not parsed yet, parse it now.
+            data, offset, length = field
+            hdrlen, flen, padlen = parsearrayitemheader(data, offset,
+                                                        offset + length)
+            fclass = fieldnumtoclass[self.SISFieldType]
+            field = fclass(fromcontents = (data, offset + hdrlen, flen))
+            field.addparent(self)
+            self.SISFields[index] = field
+        return field
 
-            fields.append(field)
+    def getrawitem(self, index):
+        '''Return an item of the array without parsing it. Items not parsed
+        yet are returned as (string, offset, length) tuples, which may be
+        appended to another SISArray of the same SISFieldType. Such items
+        are copied verbatim, the string must remain valid until output.'''
 
-            pos += alen + apadlen
+        return self.SISFields[index]
 
-        self.SISFieldType = atype
-        self.SISFields = fields
+    def registeritem(self, obj):
+        '''Make this array a parent of a new item.'''
 
-    def tostring(self):
+        if type(obj) != tuple:
+            # Unparsed items (see getrawitem()) have no parents.
+            obj.addparent(self)
+
+    def makechunks(self):
+        chunks = [None, struct.pack("<L", self.SISFieldType)]
+        for f in self.SISFields:
+            if type(f) == tuple:
+                # Item never parsed, copy it verbatim.
+                chunks.append(f)
+                chunks.append(makesisfieldpadding(f[2]))
+            else:
+                # Re-use item chunks, strip type code from the header.
+                fchunks = f.tochunks()
+                chunks.append(fchunks[0][4:])
+                chunks.extend(fchunks[1:])
+        totlen = chunkslength(chunks[1:])
+        chunks[0] = makesisfieldheader(self.fieldtype, totlen)
+        chunks.append(makesisfieldpadding(totlen))  # Not really necessary.
+        return chunks
+
+    def computelength(self):
         totlen = 4  # For the SISFieldType of the array
-        fstrings = ["", struct.pack("<L", self.SISFieldType)]
         for f in self.SISFields:
-            s = f.tostring()[4:]    # Strip type code.
-            fstrings.append(s)
-            totlen += len(s)
-        fstrings[0] = makesisfieldheader(self.fieldtype, totlen)
-        fstrings.append(makesisfieldpadding(totlen))    # Not really necessary.
-        return "".join(fstrings)
+            if type(f) == tuple:
+                # Item never parsed, copied verbatim.
+                length = f[2]
+                totlen += length + len(makesisfieldpadding(length))
+            else:
+                totlen += f.getlength() - 4     # No type code.
+        return totlen
 
     def __str__(self):
         return "<SISArray of %d %s fields>" % (
@@ -552,11 +1146,11 @@ class SISArray(SISFieldSpecial):
 
     # Standard list semantics ([n:m], len, append, insert, pop, del, iteration)
     def __getitem__(self, key):
-        # Support older Python versions as well (v2.0 onwards).
-        try:
-            return self.SISFields[key]
-        except TypeError:
-            return self.SISFields[key.start:key.stop]
+        if isinstance(key, slice):
+            # Parse all items of the slice.
+            return [self.loaditem(n) for n in
+                    xrange(*key.indices(len(self.SISFields)))]
+        return self.loaditem(key)
 
     def __setitem__(self, key, value):
         # Support older Python versions as well (v2.0 onwards).
@@ -564,6 +1158,13 @@ class SISArray(SISFieldSpecial):
             self.SISFields[key] = value
         except TypeError:
             self.SISFields[key.start:key.stop] = value
+        if type(key) in (int, long):
+            self.registeritem(value)
+        else:
+            # A slice, register all new items.
+            for f in value:
+                self.registeritem(f)
+        self.invalidate()
 
     def __delitem__(self, key):
         # Support older Python versions as well (v2.0 onwards).
@@ -571,6 +1172,7 @@ class SISArray(SISFieldSpecial):
             del self.SISFields[key]
         except TypeError:
             del self.SISFields[key.start:key.stop]
+        self.invalidate()
 
 # Not supported in Python v2.2, where __getitem__() is used instead.
 #    def __iter__(self):
@@ -580,24 +1182,45 @@ class SISArray(SISFieldSpecial):
         return self.SISFields.__len__()
 
     def append(self, obj):
+        self.registeritem(obj)
+        self.invalidate()
         return self.SISFields.append(obj)
 
     def insert(self, idx, obj):
+        self.registeritem(obj)
+        self.invalidate()
         return self.SISFields.insert(idx, obj)
 
     def extend(self, iterable):
-        return self.SISFields.extend(iterable)
+        objs = list(iterable)
+        for obj in objs:
+            self.registeritem(obj)
+        self.invalidate()
+        return self.SISFields.extend(objs)
 
     def pop(self):
+        self.loaditem(-1)
+        self.invalidate()
         return self.SISFields.pop()
 
 class SISCompressed(SISFieldSpecial):
-    '''A compression wrapper for another SISField or raw data'''
-    def __init__(self, **kwds):
-        # Set default values.
-        self.CompressionAlgorithm = None
-        self.Data = None
+    '''A compression wrapper for another SISField or raw data
+
+    When parsed from a string, the data is not decompressed right away.
+    Only the location of the compressed data in the string is recorded and
+    the actual decompression happens when Data is first accessed. Raw data
+    may also be read in blocks using iterdata() and peekdata(), without
+    decompressing all of it into memory.'''
+
+    # Compression algorithm and the wrapped SISField or raw data string,
+    # True if Data is raw data instead of a SISField, compressed data not
+    # decompressed yet (a tuple of (string, offset, length, compression
+    # algorithm, uncompressed length) or None) and the name of the
+    # compression profile (None for the default profile).
+    __slots__ = ("CompressionAlgorithm", "Data", "rawdatainside", "wiredata",
+                 "profile")
 
+    def __init__(self, **kwds):
         if "rawdatainside" in kwds:
             self.rawdatainside = kwds["rawdatainside"]
             del kwds["rawdatainside"]
@@ -605,9 +1228,17 @@ class SISCompressed(SISFieldSpecial):
             # Wrap a SISField by default.
             self.rawdatainside = False
 
+        # Compression profile, None for the default profile.
+        self.profile = kwds.pop("profile", None)
+        self.wiredata = None
+
         # Parse keyword parameters.
         SISFieldSpecial.__init__(self, **kwds)
 
+        if self.wiredata != None:
+            # Parsed from a string, already checked by fromcontents().
+            return
+
         # Check that all required instance variables are set.
         if self.CompressionAlgorithm == None or self.Data == None:
             raise AttributeError("missing '%s' or '%s' attribute for '%s'" %
@@ -620,45 +1251,151 @@ class SISCompressed(SISFieldSpecial):
             raise TypeError("invalid CompressionAlgorithm '%d'" %
                             self.CompressionAlgorithm)
 
-    def fromstring(self, string):
-        # Parse field header.
-        ftype, hdrlen, flen, padlen = parsesisfieldheader(string,
-                                                          self.fieldtype)
+    def __getattr__(self, name):
+        # Only called when an attribute is not found the normal way.
+        # Decompress data on first access.
+        if name == "Data" and self.wiredata != None:
+            dstring = "".join(self.iterdata(None))
+
+            if self.rawdatainside:
+                # Raw data inside
+                field = dstring
+            else:
+                # SISField inside
+                if dstring != "":
+                    # Construct a SISField out of the decompressed data.
+                    field = SISField(dstring)
+                    field.addparent(self)
+                else:
+                    # Decompressed to nothing, duh!
+                    field = None
 
-        if flen < 12:
+            object.__setattr__(self, "Data", field)
+            object.__setattr__(self, "wiredata", None)
+            return field
+
+        raise AttributeError("'%s' object has no attribute '%s'" %
+                             (self.__class__.__name__, name))
+
+    def __setattr__(self, name, value):
+        if name == "Data":
+            # New value replaces data not decompressed yet.
+            object.__setattr__(self, "wiredata", None)
+        SISFieldSpecial.__setattr__(self, name, value)
+
+    def fromcontents(self, data, offset, length):
+        if length < 12:
             raise SISException("SISCompressed contents too short")
 
-        compalgo, uncomplen = struct.unpack("<LQ", string[hdrlen:(hdrlen + 12)])
+        compalgo, uncomplen = struct.unpack_from("<LQ", data, offset)
 
-        if compalgo == ECompressNone:
-            # No compression, use as-is.
-            dstring = string[(hdrlen + 12):(hdrlen + flen)]
-        elif compalgo == ECompressDeflate:
-            # RFC1950 (zlib header and checksum) compression, decompress.
-            dstring = zlib.decompress(string[(hdrlen + 12):(hdrlen + flen)])
-        else:
+        if compalgo not in (ECompressNone, ECompressDeflate):
             raise SISException("invalid SISCompressed algorithm '%d'" %
                                compalgo)
 
-        if uncomplen != len(dstring):
+        # Record location of the data for decompressing it later.
+        try:
+            object.__delattr__(self, "Data")
+        except AttributeError:
+            pass
+        self.wiredata = (data, offset + 12, length - 12, compalgo, uncomplen)
+
+        self.CompressionAlgorithm = compalgo
+
+    def iterdata(self, blocksize = DATABLOCKSIZE):
+        '''Generate the uncompressed data in blocks of at most blocksize
+        bytes (the whole data in one block if blocksize is None). If Data
+        has not been accessed yet, the data is decompressed block by block
+        and never kept in memory as a whole.'''
+
+        if self.wiredata == None:
+            # Already decompressed or never compressed.
+            if self.rawdatainside:
+                dstring = self.Data
+            elif self.Data != None:
+                dstring = self.Data.tostring()
+            else:
+                dstring = ""
+
+            if blocksize == None:
+                yield dstring
+            else:
+                for pos in xrange(0, len(dstring), blocksize):
+                    yield dstring[pos:(pos + blocksize)]
+            return
+
+        data, offset, length, compalgo, uncomplen = self.wiredata
+        end = offset + length
+        totlen = 0
+
+        if compalgo == ECompressNone:
+            # No compression, use as-is.
+            if blocksize == None:
+                blocksize = length
+            while offset < end:
+                n = min(blocksize, end - offset)
+                totlen += n
+                yield data[offset:(offset + n)]
+                offset += n
+        else:
+            # RFC1950 (zlib header and checksum) compression, decompress.
+            # Use buffer objects to avoid copying the compressed data.
+            try:
+                if blocksize == None:
+                    dstring = zlib.decompress(buffer(data, offset, length))
+                    totlen += len(dstring)
+                    yield dstring
+                else:
+                    decomp = zlib.decompressobj()
+                    while offset < end:
+                        n = min(blocksize, end - offset)
+                        cstring = buffer(data, offset, n)
+                        offset += n
+                        while len(cstring) > 0:
+                            dstring = decomp.decompress(cstring, blocksize)
+                            cstring = decomp.unconsumed_tail
+                            if dstring != "":
+                                totlen += len(dstring)
+                                yield dstring
+                    dstring = decomp.flush()
+                    if dstring != "":
+                        totlen += len(dstring)
+                        yield dstring
+            except zlib.error:
+                raise SISException("invalid SISCompressed data")
+
+        if uncomplen != totlen:
             raise SISException(
                 "SISCompressed uncompressed data length mismatch")
 
-        if self.rawdatainside:
-            # Raw data inside
-            self.Data = dstring
+    def peekdata(self, length):
+        '''Return the first length bytes of uncompressed data,
+        decompressing only as much of the data as necessary.'''
+
+        dstring = ""
+        for block in self.iterdata(max(length, 4096)):
+            dstring += block
+            if len(dstring) >= length:
+                break
+        return dstring[:length]
+
+    def getuncompressedlength(self):
+        '''Return the length of the uncompressed data,
+        without decompressing it.'''
+
+        if self.wiredata != None:
+            return self.wiredata[4]
+        elif self.rawdatainside:
+            return len(self.Data)
+        elif self.Data != None:
+            return self.Data.getlength()
         else:
-            # SISField inside
-            if dstring != "":
-                # Construct a SISField out of the decompressed data.
-                self.Data = SISField(dstring)
-            else:
-                # Decompressed to nothing, duh!
-                self.Data = None
+            return 0
 
-        self.CompressionAlgorithm = compalgo
-
-    def tostring(self):
+    def makechunks(self):
+        # Only called when there is no cached string. Original compressed
+        # data is re-used as-is until Data, CompressionAlgorithm or the
+        # enclosed SISField is modified.
         if self.rawdatainside:
             # Raw data inside
             string = self.Data
@@ -672,25 +1409,27 @@ class SISCompressed(SISFieldSpecial):
                 string = ""
 
         # Compress or not, depending on selected algorithm.
-        if self.CompressionAlgorithm in (ECompressAuto, ECompressDeflate):
-            cstring = zlib.compress(string, 9)  # Maximum compression
-            compalgo = ECompressDeflate
-
-        if self.CompressionAlgorithm == ECompressAuto:
-            if len(cstring) >= len(string):
-                # Compression is not beneficial, use data as-is.
-                cstring = string
+        compalgo = self.CompressionAlgorithm
+        if compalgo == ECompressAuto:
+            if guessincompressible(string) != None:
+                # Compressing is futile, do not even try.
                 compalgo = ECompressNone
-        elif self.CompressionAlgorithm == ECompressNone:
+            else:
+                cstring = compressstring(string, self.profile)
+                if len(cstring) < len(string):
+                    compalgo = ECompressDeflate
+                else:
+                    # Compression is not beneficial, use data as-is.
+                    compalgo = ECompressNone
+        elif compalgo == ECompressDeflate:
+            cstring = compressstring(string, self.profile)
+        elif compalgo != ECompressNone:
+            raise SISException("invalid SISCompressed algorithm '%d'" %
+                               compalgo)
+
+        if compalgo == ECompressNone:
             # No compression, simply use data as-is.
             cstring = string
-            compalgo = ECompressNone
-        elif self.CompressionAlgorithm == ECompressDeflate:
-            # Already handled above.
-            pass
-        else:
-            raise SISException("invalid SISCompressed algorithm '%d'" %
-                               self.CompressionAlgorithm)
 
         # Construct the SISCompressed and SISField headers.
         chdr = struct.pack("<LQ", compalgo, len(string))
@@ -699,8 +1438,15 @@ class SISCompressed(SISFieldSpecial):
 
         del string      # Try to free some memory early.
 
-        # TODO: Heavy on memory, optimize (new string type with concat.)
-        return "%s%s%s%s" % (fhdr, chdr, cstring, fpad)
+        return [fhdr, chdr, cstring, fpad]
+
+    def computelength(self):
+        if self.CompressionAlgorithm == ECompressNone:
+            # No compression, length is known without converting anything.
+            return 12 + self.getuncompressedlength()
+
+        # Compressed length is only known after compressing.
+        return chunkslength(self.tochunks()[1:-1])
 
     def __str__(self):
         dtype = (self.rawdatainside and "raw data") or "SISField"
@@ -710,10 +1456,9 @@ class SISCompressed(SISFieldSpecial):
 
 class SISBlob(SISFieldSpecial):
     '''Arbitrary binary data holder'''
-    def __init__(self, **kwds):
-        # Set default values.
-        self.Data = None
+    __slots__ = ("Data",)
 
+    def __init__(self, **kwds):
         # Parse keyword parameters.
         SISFieldSpecial.__init__(self, **kwds)
 
@@ -722,66 +1467,66 @@ class SISBlob(SISFieldSpecial):
             raise AttributeError("missing '%s' attribute for '%s'" %
                                  ("Data", self.__class__.__name__))
 
-    def fromstring(self, string):
-        ftype, hdrlen, flen, padlen = parsesisfieldheader(string,
-                                                          self.fieldtype)
-
+    def fromcontents(self, data, offset, length):
         # Does not get any simpler than this.
-        self.Data = string[hdrlen:(hdrlen + flen)]
+        self.Data = data[offset:(offset + length)]
 
-    def tostring(self):
-        # TODO: Heavy on memory, optimize (new string type with concat.)
-        return "%s%s%s" % (makesisfieldheader(self.fieldtype, len(self.Data)),
-                           self.Data, makesisfieldpadding(len(self.Data)))
+    def makechunks(self):
+        return [makesisfieldheader(self.fieldtype, len(self.Data)),
+                self.Data, makesisfieldpadding(len(self.Data))]
+
+    def computelength(self):
+        return len(self.Data)
 
     def __str__(self):
         return u"<SISBlob, %d bytes>" % len(self.Data)
 
 class SISFileData(SISFieldSpecial):
     '''File binary data holder (wraps a special SISCompressed SISField)'''
-    def __init__(self, **kwds):
-        # Create a special SISCompressed object.
-        self.FileData = SISCompressed(CompressionAlgorithm = ECompressNone,
-                                      Data = "", rawdatainside = True)
+    __slots__ = ("FileData",)
 
+    def __init__(self, **kwds):
         # Parse keyword parameters.
         SISFieldSpecial.__init__(self, **kwds)
 
-    def fromstring(self, string):
-        # Parse field header.
-        ftype, hdrlen, flen, padlen = parsesisfieldheader(string,
-                                                          self.fieldtype)
+        if self.FileData == None:
+            # Create a special SISCompressed object.
+            self.FileData = SISCompressed(CompressionAlgorithm = ECompressNone,
+                                          Data = "", rawdatainside = True)
 
-        if flen < 20:
+    def fromcontents(self, data, offset, length):
+        if length < 20:
             raise SISException("SISFileData contents too short")
 
-        self.FileData.fromstring(string[hdrlen:(hdrlen + flen)])
+        # Parse the special SISCompressed object.
+        ftype, hdrlen, flen, padlen = parsesisfieldheader(
+            data, SISCompressed.fieldtype, True, offset, length)
+        self.FileData = SISCompressed(rawdatainside = True,
+                                      fromcontents = (data, offset + hdrlen,
+                                                      flen))
 
-    def tostring(self):
-        string = self.FileData.tostring()
-
-        # TODO: Heavy on memory, optimize (new string type with concat.)
-        return "%s%s%s" % (makesisfieldheader(self.fieldtype, len(string)),
-                           string, makesisfieldpadding(len(string)))
+    def makechunks(self):
+        flen = self.FileData.getlength()
 
-    def getcompressedlength(self):
-        # TODO: This is stupid! Compressing the data just
-        # to find the resulting length is not very efficient...
-        string = self.FileData.tostring()
+        return [makesisfieldheader(self.fieldtype, flen),
+                self.FileData, makesisfieldpadding(flen)]
 
-        ftype, hdrlen, flen, padlen = parsesisfieldheader(string)
+    def computelength(self):
+        return self.FileData.getlength()
 
-        return (flen - 12)  # SISCompressed has an internal header of 12 bytes.
+    def getcompressedlength(self):
+        # SISCompressed has an internal header of 12 bytes.
+        return self.FileData.getcontentlength() - 12
 
     def __str__(self):
-        return "<SISFileData, %d bytes>" % len(self.FileData.Data)
+        return "<SISFileData, %d bytes>" % (
+            self.FileData.getuncompressedlength())
 
 class SISCapabilities(SISFieldSpecial):
     '''Variable length capability bitmask'''
-    def __init__(self, **kwds):
-        # Set default values.
-        self.Capabilities = None
+    __slots__ = ("Capabilities",)
 
+    def __init__(self, **kwds):
         # Parse keyword parameters.
         SISFieldSpecial.__init__(self, **kwds)
 
@@ -794,22 +1539,22 @@ class SISCapabilities(SISFieldSpecial):
         if len(self.Capabilities) & 3 != 0:
             raise SISException("capabilities length not a multiple of 32 bits")
 
-    def fromstring(self, string):
-        ftype, hdrlen, flen, padlen = parsesisfieldheader(string,
-                                                          self.fieldtype)
-
-        caps = string[hdrlen:(hdrlen + flen)]
+    def fromcontents(self, data, offset, length):
+        caps = data[offset:(offset + length)]
         if len(caps) & 3 != 0:
             raise SISException("capabilities length not a multiple of 32 bits")
 
         self.Capabilities = caps
 
-    def tostring(self):
+    def makechunks(self):
         if len(self.Capabilities) & 3 != 0:
             raise SISException("capabilities length not a multiple of 32 bits")
 
-        return "%s%s" % (makesisfieldheader(self.fieldtype,
-                         len(self.Capabilities)), self.Capabilities)
+        return [makesisfieldheader(self.fieldtype, len(self.Capabilities)),
+                self.Capabilities, ""]     # Always a multiple of 32 bits.
+
+    def computelength(self):
+        return len(self.Capabilities)
 
 
 ##############################################################################
@@ -818,27 +1563,19 @@ class SISCapabilities(SISFieldSpecial):
 
 class SISVersion(SISFieldNormal):
     '''Major, minor and build numbers'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("Major", self.FTYPE_INTEGRAL, "<l"),
-            ("Minor", self.FTYPE_INTEGRAL, "<l"),
-            ("Build", self.FTYPE_INTEGRAL, "<l")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("Major", FTYPE_INTEGRAL, "<l"),
+        ("Minor", FTYPE_INTEGRAL, "<l"),
+        ("Build", FTYPE_INTEGRAL, "<l")]
 
     def __str__(self):
         return "<SISVersion %d, %d, %d>" % (self.Major, self.Minor, self.Build)
 
 class SISVersionRange(SISFieldNormal):
     '''A range of two SISVersions, or optionally only one'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("FromVersion", self.FTYPE_MANDATORY, "SISVersion"),
-            ("ToVersion",   self.FTYPE_OPTIONAL,  "SISVersion")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("FromVersion", FTYPE_MANDATORY, "SISVersion"),
+        ("ToVersion",   FTYPE_OPTIONAL,  "SISVersion")]
 
     def __str__(self):
         ver1 = "from %d, %d, %d" % (self.FromVersion.Major,
@@ -853,14 +1590,10 @@ class SISVersionRange(SISFieldNormal):
 
 class SISDate(SISFieldNormal):
     '''Year, month (0-11) and day (1-31)'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("Year",  self.FTYPE_INTEGRAL, "<H"),
-            ("Month", self.FTYPE_INTEGRAL, "<B"),
-            ("Day",   self.FTYPE_INTEGRAL, "<B")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("Year",  FTYPE_INTEGRAL, "<H"),
+        ("Month", FTYPE_INTEGRAL, "<B"),
+        ("Day",   FTYPE_INTEGRAL, "<B")]
 
     def __str__(self):
         return "<SISDate %04d-%02d-%02d>" % (self.Year, self.Month + 1,
@@ -868,14 +1601,10 @@ class SISDate(SISFieldNormal):
 
 class SISTime(SISFieldNormal):
     '''Hours (0-23), minutes (0-59) and seconds (0-59)'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("Hours",   self.FTYPE_INTEGRAL, "<B"),
-            ("Minutes", self.FTYPE_INTEGRAL, "<B"),
-            ("Seconds", self.FTYPE_INTEGRAL, "<B")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("Hours",   FTYPE_INTEGRAL, "<B"),
+        ("Minutes", FTYPE_INTEGRAL, "<B"),
+        ("Seconds", FTYPE_INTEGRAL, "<B")]
 
     def __str__(self):
         return "<SISTime %02d:%02d:%02d>" % (
@@ -883,13 +1612,9 @@ class SISTime(SISFieldNormal):
 
 class SISDateTime(SISFieldNormal):
     '''A bundled SISDate and a SISTime'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("Date", self.FTYPE_MANDATORY, "SISDate"),
-            ("Time", self.FTYPE_MANDATORY, "SISTime")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("Date", FTYPE_MANDATORY, "SISDate"),
+        ("Time", FTYPE_MANDATORY, "SISTime")]
 
     def __str__(self):
         return "<SISDateTime %04d-%02d-%02d %02d:%02d:%02d>" % (
@@ -898,22 +1623,14 @@ class SISDateTime(SISFieldNormal):
 
 class SISUid(SISFieldNormal):
     '''A 32-bit Symbian OS UID'''
-    def __init__(self, **kwds):
-        self.subfields = [("UID1", self.FTYPE_INTEGRAL, "<L")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [("UID1", FTYPE_INTEGRAL, "<L")]
 
     def __str__(self):
         return "<SISUid 0x%08x>" % self.UID1
 
 class SISLanguage(SISFieldNormal):
     '''A Symbian OS language number'''
-    def __init__(self, **kwds):
-        self.subfields = [("Language", self.FTYPE_INTEGRAL, "<L")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [("Language", FTYPE_INTEGRAL, "<L")]
 
     def __str__(self):
         try:
@@ -924,15 +1641,11 @@ class SISLanguage(SISFieldNormal):
 
 class SISContents(SISFieldNormal):
     '''The root type of a SIS file'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("ControllerChecksum", self.FTYPE_OPTIONAL,  "SISControllerChecksum"),
-            ("DataChecksum",       self.FTYPE_OPTIONAL,  "SISDataChecksum"),
-            ("Controller",         self.FTYPE_MANDATORY, "SISCompressed"),
-            ("Data",               self.FTYPE_MANDATORY, "SISData")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("ControllerChecksum", FTYPE_OPTIONAL,  "SISControllerChecksum"),
+        ("DataChecksum",       FTYPE_OPTIONAL,  "SISDataChecksum"),
+        ("Controller",         FTYPE_MANDATORY, "SISCompressed"),
+        ("Data",               FTYPE_MANDATORY, "SISData")]
 
     def __str__(self):
         cksum1 = "N/A"
@@ -945,6 +1658,28 @@ class SISContents(SISFieldNormal):
 
 class SISController(SISFieldNormal):
     '''SIS file metadata'''
+
+    # DataIndex is really not optional. However, calculating
+    # signatures require that SISController strings without
+    # the DataIndex field can be generated.
+    subfields = [
+        ("Info",          FTYPE_MANDATORY, "SISInfo"),
+        ("Options",       FTYPE_MANDATORY, "SISSupportedOptions"),
+        ("Languages",     FTYPE_MANDATORY, "SISSupportedLanguages"),
+        ("Prerequisites", FTYPE_MANDATORY, "SISPrerequisites"),
+        ("Properties",    FTYPE_MANDATORY, "SISProperties"),
+        ("Logo",          FTYPE_OPTIONAL,  "SISLogo"),
+        ("InstallBlock",  FTYPE_MANDATORY, "SISInstallBlock"),
+        ("Signature0",    FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
+        ("Signature1",    FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
+        ("Signature2",    FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
+        ("Signature3",    FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
+        ("Signature4",    FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
+        ("Signature5",    FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
+        ("Signature6",    FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
+        ("Signature7",    FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
+        ("DataIndex",     FTYPE_OPTIONAL,  "SISDataIndex")]
+
     def __init__(self, **kwds):
         # Convert a list of signatures to separate parameters
         # so that base class constructor can parse them.
@@ -957,27 +1692,6 @@ class SISController(SISFieldNormal):
                 kwds["Signature%d" % n] = signatures[n]
             del kwds["Signatures"]
 
-        # DataIndex is really not optional. However, calculating
-        # signatures require that SISController strings without
-        # the DataIndex field can be generated.
-        self.subfields = [
-            ("Info",          self.FTYPE_MANDATORY, "SISInfo"),
-            ("Options",       self.FTYPE_MANDATORY, "SISSupportedOptions"),
-            ("Languages",     self.FTYPE_MANDATORY, "SISSupportedLanguages"),
-            ("Prerequisites", self.FTYPE_MANDATORY, "SISPrerequisites"),
-            ("Properties",    self.FTYPE_MANDATORY, "SISProperties"),
-            ("Logo",          self.FTYPE_OPTIONAL,  "SISLogo"),
-            ("InstallBlock",  self.FTYPE_MANDATORY, "SISInstallBlock"),
-            ("Signature0",    self.FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
-            ("Signature1",    self.FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
-            ("Signature2",    self.FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
-            ("Signature3",    self.FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
-            ("Signature4",    self.FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
-            ("Signature5",    self.FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
-            ("Signature6",    self.FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
-            ("Signature7",    self.FTYPE_OPTIONAL,  "SISSignatureCertificateChain"),
-            ("DataIndex",     self.FTYPE_OPTIONAL,  "SISDataIndex")]
-
         # Parse keyword parameters.
         SISFieldNormal.__init__(self, **kwds)
 
@@ -986,7 +1700,7 @@ class SISController(SISFieldNormal):
         # Return signatures as a list.
         signatures = []
         for n in xrange(MAXNUMSIGNATURES):
-            sig = self.__dict__["Signature%d" % n]
+            sig = getattr(self, "Signature%d" % n)
             if sig != None:
                 signatures.append(sig)
         return signatures
@@ -1004,78 +1718,50 @@ class SISController(SISFieldNormal):
                 sig = signatures[n]
             else:
                 sig = None
-            self.__dict__["Signature%d" % n] = sig
+            setattr(self, "Signature%d" % n, sig)
 
 class SISInfo(SISFieldNormal):
     '''Information about the SIS file'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("UID",              self.FTYPE_MANDATORY, "SISUid"),
-            ("VendorUniqueName", self.FTYPE_MANDATORY, "SISString"),
-            ("Names",            self.FTYPE_ARRAY,     "SISString"),
-            ("VendorNames",      self.FTYPE_ARRAY,     "SISString"),
-            ("Version",          self.FTYPE_MANDATORY, "SISVersion"),
-            ("CreationTime",     self.FTYPE_MANDATORY, "SISDateTime"),
-            ("InstallType",      self.FTYPE_INTEGRAL,  "<B"),
-            ("InstallFlags",     self.FTYPE_INTEGRAL,  "<B")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("UID",              FTYPE_MANDATORY, "SISUid"),
+        ("VendorUniqueName", FTYPE_MANDATORY, "SISString"),
+        ("Names",            FTYPE_ARRAY,     "SISString"),
+        ("VendorNames",      FTYPE_ARRAY,     "SISString"),
+        ("Version",          FTYPE_MANDATORY, "SISVersion"),
+        ("CreationTime",     FTYPE_MANDATORY, "SISDateTime"),
+        ("InstallType",      FTYPE_INTEGRAL,  "<B"),
+        ("InstallFlags",     FTYPE_INTEGRAL,  "<B")]
 
 class SISSupportedLanguages(SISFieldNormal):
     '''An array of SISLanguage fields'''
-    def __init__(self, **kwds):
-        self.subfields = [("Languages", self.FTYPE_ARRAY, "SISLanguage")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [("Languages", FTYPE_ARRAY, "SISLanguage")]
 
 class SISSupportedOptions(SISFieldNormal):
     '''An array of SISSupportedOption fields, user selectable options'''
-    def __init__(self, **kwds):
-        self.subfields = [("Options", self.FTYPE_ARRAY, "SISSupportedOption")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [("Options", FTYPE_ARRAY, "SISSupportedOption")]
 
 class SISPrerequisites(SISFieldNormal):
     '''An array of SISDependency fields'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("TargetDevices", self.FTYPE_ARRAY, "SISDependency"),
-            ("Dependencies",  self.FTYPE_ARRAY, "SISDependency")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("TargetDevices", FTYPE_ARRAY, "SISDependency"),
+        ("Dependencies",  FTYPE_ARRAY, "SISDependency")]
 
 class SISDependency(SISFieldNormal):
     '''Versioned SIS package dependency'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("UID",             self.FTYPE_MANDATORY, "SISUid"),
-            ("VersionRange",    self.FTYPE_OPTIONAL,  "SISVersionRange"),
-            ("DependencyNames", self.FTYPE_ARRAY,     "SISString")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("UID",             FTYPE_MANDATORY, "SISUid"),
+        ("VersionRange",    FTYPE_OPTIONAL,  "SISVersionRange"),
+        ("DependencyNames", FTYPE_ARRAY,     "SISString")]
 
 class SISProperties(SISFieldNormal):
     '''An array of SISProperty fields'''
-    def __init__(self, **kwds):
-        self.subfields = [("Properties", self.FTYPE_ARRAY, "SISProperty")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [("Properties", FTYPE_ARRAY, "SISProperty")]
 
 class SISProperty(SISFieldNormal):
     '''Key:value pair'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("Key",   self.FTYPE_INTEGRAL, "<l"),
-            ("Value", self.FTYPE_INTEGRAL, "<l")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("Key",   FTYPE_INTEGRAL, "<l"),
+        ("Value", FTYPE_INTEGRAL, "<l")]
 
 # SISSignatures: Legacy field type, not used
 #
@@ -1084,45 +1770,33 @@ class SISProperty(SISFieldNormal):
 
 class SISCertificateChain(SISFieldNormal):
     '''ASN.1 encoded X509 certificate chain'''
-    def __init__(self, **kwds):
-        self.subfields = [("CertificateData", self.FTYPE_MANDATORY, "SISBlob")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [("CertificateData", FTYPE_MANDATORY, "SISBlob")]
 
 class SISLogo(SISFieldNormal):
     '''A logo file to display during installation'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("LogoFile", self.FTYPE_MANDATORY, "SISFileDescription")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("LogoFile", FTYPE_MANDATORY, "SISFileDescription")]
 
 class SISFileDescription(SISFieldNormal):
     '''Information about an enclosed file'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("Target",             self.FTYPE_MANDATORY, "SISString"),
-            ("MIMEType",           self.FTYPE_MANDATORY, "SISString"),
-            ("Capabilities",       self.FTYPE_OPTIONAL,  "SISCapabilities"),
-            ("Hash",               self.FTYPE_MANDATORY, "SISHash"),
-            ("Operation",          self.FTYPE_INTEGRAL,  "<L"),
-            ("OperationOptions",   self.FTYPE_INTEGRAL,  "<L"),
-            ("Length",             self.FTYPE_INTEGRAL,  "<Q"),
-            ("UncompressedLength", self.FTYPE_INTEGRAL,  "<Q"),
-            ("FileIndex",          self.FTYPE_INTEGRAL,  "<L")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("Target",             FTYPE_MANDATORY, "SISString"),
+        ("MIMEType",           FTYPE_MANDATORY, "SISString"),
+        ("Capabilities",       FTYPE_OPTIONAL,  "SISCapabilities"),
+        ("Hash",               FTYPE_MANDATORY, "SISHash"),
+        ("Operation",          FTYPE_INTEGRAL,  "<L"),
+        ("OperationOptions",   FTYPE_INTEGRAL,  "<L"),
+        ("Length",             FTYPE_INTEGRAL,  "<Q"),
+        ("UncompressedLength", FTYPE_INTEGRAL,  "<Q"),
+        ("FileIndex",          FTYPE_INTEGRAL,  "<L")]
 
 class SISHash(SISFieldNormal):
     '''File hash'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("HashAlgorithm", self.FTYPE_INTEGRAL,  "<L"),
-            ("HashData",      self.FTYPE_MANDATORY, "SISBlob")]
+    subfields = [
+        ("HashAlgorithm", FTYPE_INTEGRAL,  "<L"),
+        ("HashData",      FTYPE_MANDATORY, "SISBlob")]
 
+    def __init__(self, **kwds):
         # Parse keyword parameters.
         SISFieldNormal.__init__(self, **kwds)
 
@@ -1133,113 +1807,69 @@ class SISHash(SISFieldNormal):
 
 class SISIf(SISFieldNormal):
     '''An "if"-branch of a conditional expression'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("Expression",   self.FTYPE_MANDATORY, "SISExpression"),
-            ("InstallBlock", self.FTYPE_MANDATORY, "SISInstallBlock"),
-            ("ElseIfs",      self.FTYPE_ARRAY,     "SISElseIf")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("Expression",   FTYPE_MANDATORY, "SISExpression"),
+        ("InstallBlock", FTYPE_MANDATORY, "SISInstallBlock"),
+        ("ElseIfs",      FTYPE_ARRAY,     "SISElseIf")]
 
 class SISElseIf(SISFieldNormal):
     '''An "else if"-branch of a conditional expression'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("Expression",   self.FTYPE_MANDATORY, "SISExpression"),
-            ("InstallBlock", self.FTYPE_MANDATORY, "SISInstallBlock")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("Expression",   FTYPE_MANDATORY, "SISExpression"),
+        ("InstallBlock", FTYPE_MANDATORY, "SISInstallBlock")]
 
 class SISInstallBlock(SISFieldNormal):
     '''A conditional file installation hierarchy'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("Files",            self.FTYPE_ARRAY, "SISFileDescription"),
-            ("EmbeddedSISFiles", self.FTYPE_ARRAY, "SISController"),
-            ("IfBlocks",         self.FTYPE_ARRAY, "SISIf")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("Files",            FTYPE_ARRAY, "SISFileDescription"),
+        ("EmbeddedSISFiles", FTYPE_ARRAY, "SISController"),
+        ("IfBlocks",         FTYPE_ARRAY, "SISIf")]
 
 class SISExpression(SISFieldNormal):
     '''A conditional expression'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("Operator",        self.FTYPE_INTEGRAL, "<L"),
-            ("IntegerValue",    self.FTYPE_INTEGRAL, "<l"),
-            ("StringValue",     self.FTYPE_OPTIONAL, "SISString"),
-            ("LeftExpression",  self.FTYPE_OPTIONAL, "SISExpression"),
-            ("RightExpression", self.FTYPE_OPTIONAL, "SISExpression")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("Operator",        FTYPE_INTEGRAL, "<L"),
+        ("IntegerValue",    FTYPE_INTEGRAL, "<l"),
+        ("StringValue",     FTYPE_OPTIONAL, "SISString"),
+        ("LeftExpression",  FTYPE_OPTIONAL, "SISExpression"),
+        ("RightExpression", FTYPE_OPTIONAL, "SISExpression")]
 
 class SISData(SISFieldNormal):
     '''An array of SISDataUnit fields'''
-    def __init__(self, **kwds):
-        self.subfields = [("DataUnits", self.FTYPE_ARRAY, "SISDataUnit")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [("DataUnits", FTYPE_ARRAY, "SISDataUnit")]
 
 class SISDataUnit(SISFieldNormal):
     '''An array of SISFileData fields'''
-    def __init__(self, **kwds):
-        self.subfields = [("FileData", self.FTYPE_ARRAY, "SISFileData")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [("FileData", FTYPE_ARRAY, "SISFileData")]
 
 class SISSupportedOption(SISFieldNormal):
     '''An array of supported option names in different languages'''
-    def __init__(self, **kwds):
-        self.subfields = [("Names", self.FTYPE_ARRAY, "SISString")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [("Names", FTYPE_ARRAY, "SISString")]
 
 class SISControllerChecksum(SISFieldNormal):
     '''CCITT CRC-16 of the SISController SISField'''
-    def __init__(self, **kwds):
-        self.subfields = [("Checksum", self.FTYPE_INTEGRAL, "<H")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [("Checksum", FTYPE_INTEGRAL, "<H")]
 
     def __str__(self):
         return "<SISControllerChecksum 0x%04x>" % self.Checksum
 
 class SISDataChecksum(SISFieldNormal):
     '''CCITT CRC-16 of the SISData SISField'''
-    def __init__(self, **kwds):
-        self.subfields = [("Checksum", self.FTYPE_INTEGRAL, "<H")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [("Checksum", FTYPE_INTEGRAL, "<H")]
 
     def __str__(self):
         return "<SISDataChecksum 0x%04x>" % self.Checksum
 
 class SISSignature(SISFieldNormal):
     '''Cryptographic signature of preceding SIS metadata'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("SignatureAlgorithm", self.FTYPE_MANDATORY, "SISSignatureAlgorithm"),
-            ("SignatureData",      self.FTYPE_MANDATORY, "SISBlob")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("SignatureAlgorithm", FTYPE_MANDATORY, "SISSignatureAlgorithm"),
+        ("SignatureData",      FTYPE_MANDATORY, "SISBlob")]
 
 class SISSignatureAlgorithm(SISFieldNormal):
     '''Object identifier string of a signature algorithm'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("AlgorithmIdentifier", self.FTYPE_MANDATORY, "SISString")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("AlgorithmIdentifier", FTYPE_MANDATORY, "SISString")]
 
     def __str__(self):
         return "<SISSignatureAlgorithm '%s'>" % (
@@ -1248,21 +1878,13 @@ class SISSignatureAlgorithm(SISFieldNormal):
 class SISSignatureCertificateChain(SISFieldNormal):
     '''An array of SISSignatures and a SIScertificateChain
     for signature validation'''
-    def __init__(self, **kwds):
-        self.subfields = [
-            ("Signatures",       self.FTYPE_ARRAY,     "SISSignature"),
-            ("CertificateChain", self.FTYPE_MANDATORY, "SISCertificateChain")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [
+        ("Signatures",       FTYPE_ARRAY,     "SISSignature"),
+        ("CertificateChain", FTYPE_MANDATORY, "SISCertificateChain")]
 
 class SISDataIndex(SISFieldNormal):
     '''Data index for files belonging to a SISController'''
-    def __init__(self, **kwds):
-        self.subfields = [("DataIndex", self.FTYPE_INTEGRAL, "<L")]
-
-        # Parse keyword parameters.
-        SISFieldNormal.__init__(self, **kwds)
+    subfields = [("DataIndex", FTYPE_INTEGRAL, "<L")]
 
     def __str__(self):
         return "<SISDataIndex %d>" % self.DataIndex
@@ -1319,3 +1941,7 @@ fieldinfo = [
 fieldnumtoclass = dict([(num,  klass) for num, name, klass in fieldinfo])
 fieldnametonum  = dict([(name, num)   for num, name, klass in fieldinfo])
 fieldnumtoname  = dict([(num,  name)  for num, name, klass in fieldinfo])
+
+# Type codes are class attributes, not stored in every instance.
+for num, name, klass in fieldinfo:
+    klass.fieldtype = num
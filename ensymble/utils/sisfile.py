@@ -24,14 +24,35 @@
 
 import os
 import time
+import zlib
 import struct
+import mmap
 from hashlib import sha1
 
+try:
+    import multiprocessing
+except ImportError:
+    # Not available on Python <v2.6, only serial compression is supported.
+    multiprocessing = None
+
 import symbianutil
 import cryptutil
 import sisfield
 
 
+##############################################################################
+# Parameters
+##############################################################################
+
+INGESTBLOCKSIZE = 65536     # Block size for reading and compressing files
+DEFAULTCACHESIZE = 1024 * 1024 * 256    # Compression cache size limit
+CACHEFILESUFFIX = ".deflate"    # Cache file name suffix
+SIGCACHEFILESUFFIX = ".sig"     # Signature cache file name suffix
+DSAALGORITHMOID = "1.2.840.10040.4.3"       # DSA with SHA-1
+RSAALGORITHMOID = "1.2.840.113549.1.1.5"    # RSA (PKCS #1 v1.5) with SHA-1
+MAXCONTROLLERSIZE = 1024 * 1024 * 16    # SISController size limit
+
+
 ##############################################################################
 # Public module-level functions
 ##############################################################################
@@ -72,7 +93,7 @@ def parseexpression(expr):
                                   LeftExpression = leftfield,
                                   RightExpression = rightfield)
 
-def signstring(privkey, passphrase, string):
+def signstring(privkey, passphrase, string, cache = None):
     '''Sign a binary string using a given private key and its pass phrase.
 
     signstring(...) -> (signature, algorithm oid)
@@ -80,28 +101,279 @@ def signstring(privkey, passphrase, string):
     privkey         private key (RSA or DSA), a binary string in PEM format
     passphrase      pass phrase (non-Unicode) for the private key or None
     string          binary string from which the signature is to be calculated
+    cache           SignatureCache instance or None
 
     signature       signature, a binary string
     algorithm oid   signature algorithm object identifier, a string'''
 
+    signkey = privkey
+    if cache != None:
+        # Re-use a previous signature of the same string, if any. Only
+        # RSA signatures are cached, so the key type must be known first.
+        # Encrypted keys are decrypted only once, see cryptutil.preparekey().
+        signkey, keytype = cryptutil.preparekey(privkey, passphrase)
+        result = cache.lookup(privkey, string, keytypetooid(keytype))
+        if result != None:
+            return result
+
     # Sign string.
-    signature, keytype = cryptutil.signstring(privkey, passphrase, string)
+    signature, keytype = cryptutil.signstring(signkey, passphrase, string)
 
     # Determine algorithm object identifier.
-    if keytype == "DSA":
-        algoid = "1.2.840.10040.4.3"
-    elif keytype == "RSA":
-        algoid = "1.2.840.113549.1.1.5"
-    else:
-        raise ValueError("unknown key type '%s'" % keytype)
+    algoid = keytypetooid(keytype)
+
+    if cache != None:
+        cache.store(privkey, string, signature, algoid)
 
     return (signature, algoid)
 
+def mapfile(filename):
+    '''Open a file for reading without reading it all into memory.
+
+    mapfile(...) -> data
+
+    filename        name of the file
+
+    data            file contents, a read-only memory map or a string
+
+    The returned memory map can be sliced and parsed like a string. Only
+    the parts of the file actually accessed are read from the disk. Files
+    that cannot be memory mapped (empty files, for example) are returned
+    as a string. Release the file using unmapfile().'''
+
+    f = file(filename, "rb")
+    try:
+        try:
+            return mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        except (mmap.error, ValueError):
+            # Cannot map, read the whole file instead.
+            return f.read()
+    finally:
+        # The memory map remains valid after closing the file.
+        f.close()
+
+def unmapfile(data):
+    '''Release file contents returned by mapfile(). Any SISFields parsed
+    from the contents become unusable.'''
+
+    if type(data) != str:
+        data.close()
+
+def writesiscontents(f, uidstring, contentsfield):
+    '''Write a SIS file to a file object, updating its checksums.
+
+    writesiscontents(...) -> None
+
+    f               file object to write to
+    uidstring       UID1, UID2, UID3 and UIDCRC, a binary string
+    contentsfield   a SISContents SISField
+
+    Checksum fields present in the SISContents are updated. If the file
+    object is seekable, checksums are calculated while writing and the
+    checksum fields are filled in afterwards. Otherwise SISController and
+    SISData are traversed twice.'''
+
+    ctrlcsfield = contentsfield.ControllerChecksum
+    datacsfield = contentsfield.DataChecksum
+
+    try:
+        f.tell()
+    except (AttributeError, IOError):
+        # Not seekable, calculate checksums before writing.
+        if ctrlcsfield != None:
+            cw = ChecksumWriter()
+            contentsfield.Controller.writeto(cw)
+            ctrlcsfield.Checksum = cw.getvalue()
+        if datacsfield != None:
+            cw = ChecksumWriter()
+            contentsfield.Data.writeto(cw)
+            datacsfield.Checksum = cw.getvalue()
+        f.write(uidstring)
+        contentsfield.writeto(f)
+        return
+
+    # Write SISContents header and placeholder checksum fields.
+    contentlen = contentsfield.getcontentlength()
+    f.write(uidstring)
+    f.write(sisfield.makesisfieldheader(contentsfield.fieldtype, contentlen))
+    cspos = f.tell()
+    for csfield in (ctrlcsfield, datacsfield):
+        if csfield != None:
+            csfield.writeto(f)
+
+    # Write SISController and SISData, calculating checksums on the way.
+    cw = ChecksumWriter(f)
+    contentsfield.Controller.writeto(cw)
+    if ctrlcsfield != None:
+        ctrlcsfield.Checksum = cw.getvalue()
+    cw = ChecksumWriter(f)
+    contentsfield.Data.writeto(cw)
+    if datacsfield != None:
+        datacsfield.Checksum = cw.getvalue()
+    f.write(sisfield.makesisfieldpadding(contentlen))
+
+    # Go back and fill in the checksums.
+    endpos = f.tell()
+    f.seek(cspos)
+    for csfield in (ctrlcsfield, datacsfield):
+        if csfield != None:
+            csfield.writeto(f)
+    f.seek(endpos)
+
+def validatesis(filename, checkhashes = False):
+    '''Check the structure of a SIS file without parsing it to SISFields.
+
+    validatesis(...) -> warnings
+
+    filename        name of the SIS file
+    checkhashes     True to also check the SHA-1 digests of all files
+
+    warnings        a list of non-fatal problems, strings
+
+    UIDs, SISField types and lengths and both checksums are checked in one
+    pass over the file. Only the SISController is decompressed. File data
+    is decompressed in blocks only if checkhashes is True.
+
+    SISException is raised for the first error found. The error message
+    includes the offset of the error in the file.'''
+
+    data = mapfile(filename)
+    try:
+        return SISValidator(data, checkhashes).validate()
+    finally:
+        unmapfile(data)
+
 
 ##############################################################################
 # Module-level functions which are normally only used by this module
 ##############################################################################
 
+def keytypetooid(keytype):
+    '''Return the signature algorithm object identifier for a key type
+    returned by cryptutil.signstring() or cryptutil.preparekey().'''
+
+    if keytype == "DSA":
+        return DSAALGORITHMOID
+    elif keytype == "RSA":
+        return RSAALGORITHMOID
+    else:
+        raise ValueError("unknown key type '%s'" % keytype)
+
+def ingestfile(contents, profile = None):
+    '''Make a SISFileData SISField out of the given file contents and
+    calculate the SHA-1 digest of the contents at the same time.
+
+    ingestfile(...) -> (SISFileData, sha1hash, uncompressedlen)
+
+    contents        file contents, a binary string or a file-like object
+    profile         compression profile name, see sisfield.compressionprofiles
+
+    SISFileData     the returned SISFileData instance
+    sha1hash        SHA-1 digest of the file contents, a binary string
+    uncompressedlen length of the file contents, an integer
+
+    The contents are read only once, in blocks. The compressed data is
+    stored inside the returned SISFileData and is not compressed again
+    when generating the SIS file.
+
+    NOTE: Data is compressed only if it is beneficial.'''
+
+    cstring, sha1hash, uncompressedlen, reason = compressfile(contents,
+                                                              profile)
+    return (makecompressedfiledata(cstring), sha1hash, uncompressedlen)
+
+def compressfile(contents, profile = None):
+    '''Compress the given file contents and calculate their SHA-1 digest.
+
+    compressfile(...) -> (cstring, sha1hash, uncompressedlen, reason)
+
+    contents        file contents, a binary string or a file-like object
+    profile         compression profile name, see sisfield.compressionprofiles
+
+    cstring         contents of a SISCompressed SISField, a binary string
+    sha1hash        SHA-1 digest of the file contents, a binary string
+    uncompressedlen length of the file contents, an integer
+    reason          why compression was not even tried, a string or None
+
+    Compression is skipped for data that looks incompressible, see
+    sisfield.guessincompressible(). If the profile has several compression
+    settings, they are all run side by side and the smallest result is
+    used. This function is also run in worker processes for parallel
+    compression, see SimpleSISWriter.'''
+
+    if not isinstance(contents, str):
+        try:
+            # Sample the file the same way as a binary string would be.
+            reason = sisfield.guessincompressible(contents)
+        except (AttributeError, IOError):
+            # Not seekable, samples cannot be taken without reading
+            # all of it. Blocks would be kept in memory anyway.
+            contents = contents.read()
+
+    if isinstance(contents, str):
+        # Process binary strings in blocks as well, to keep memory use low.
+        blocks = (contents[pos:(pos + INGESTBLOCKSIZE)]
+                  for pos in xrange(0, len(contents), INGESTBLOCKSIZE))
+        dlist = None
+        reason = sisfield.guessincompressible(contents)
+    else:
+        # Keep blocks read from a file, in case compression is not used.
+        blocks = iter(lambda: contents.read(INGESTBLOCKSIZE), "")
+        dlist = []
+
+    hashobj = sha1()
+    if reason == None:
+        compobjs = sisfield.makecompressobjs(profile)
+    else:
+        # Compressing is futile, do not even try.
+        compobjs = []
+    clists = [[] for compobj in compobjs]
+    uncompressedlen = 0
+    for block in blocks:
+        hashobj.update(block)
+        if dlist != None:
+            dlist.append(block)
+        uncompressedlen += len(block)
+        for compobj, clist in zip(compobjs, clists):
+            clist.append(compobj.compress(block))
+    for compobj, clist in zip(compobjs, clists):
+        clist.append(compobj.flush())
+    del compobjs
+
+    # Select the smallest result.
+    clist = []
+    compressedlen = uncompressedlen
+    for result in clists:
+        resultlen = sum([len(cstring) for cstring in result])
+        if not clist or resultlen < compressedlen:
+            clist = result
+            compressedlen = resultlen
+    del clists
+
+    if compressedlen < uncompressedlen:
+        compalgo = sisfield.ECompressDeflate
+    elif dlist == None:
+        # Compression is not beneficial, use data as-is.
+        compalgo = sisfield.ECompressNone
+        clist = [contents]
+    else:
+        compalgo = sisfield.ECompressNone
+        clist = dlist
+    del dlist
+
+    # Construct SISCompressed contents directly, so that
+    # the data is not compressed again when generating the SIS file.
+    clist.insert(0, struct.pack("<LQ", compalgo, uncompressedlen))
+    return ("".join(clist), hashobj.digest(), uncompressedlen, reason)
+
+def makecompressedfiledata(cstring):
+    '''Make a SISFileData SISField out of SISCompressed contents
+    returned by compressfile().'''
+
+    cfield = sisfield.SISCompressed(rawdatainside = True,
+                                    fromcontents = (cstring, 0, len(cstring)))
+    return sisfield.SISFileData(FileData = cfield)
+
 def makefiledata(contents):
     '''Make a SISFileData SISField out of the given binary string.
 
@@ -113,23 +385,18 @@ def makefiledata(contents):
 
     NOTE: Data is compressed only if it is beneficial.'''
 
-    # Wrap data inside SISCompressed SISField.
-    cfield = sisfield.SISCompressed(Data = contents,
-        CompressionAlgorithm = sisfield.ECompressAuto,
-        rawdatainside = True)
-
-    # Create a SISFileData SISField out of the wrapped data and return it.
-    return sisfield.SISFileData(FileData = cfield)
+    return ingestfile(contents)[0]
 
-def makefiledesc(contents, compressedlen, index, target = None,
-                 mimetype = None, capabilities = None,
+def makefiledesc(sha1hash, compressedlen, uncompressedlen, index,
+                 target = None, mimetype = None, capabilities = None,
                  operation = sisfield.EOpInstall, options = 0):
     '''Make a SISFileDescription SISField for the given file.
 
     makefiledesc(...) -> SISFileDescription
 
-    contents            file contents for SHA-1 digest calc., a binary string
+    sha1hash            SHA-1 digest of file contents, a binary string or None
     compressedlen       length of file contents inside a SISCompressed SISField
+    uncompressedlen     length of file contents, an integer
     index               index of file inside a SISDataUnit SISField, an integer
     target              install path in target device, a string or None
     mimetype            MIME type, a string or None
@@ -167,11 +434,9 @@ def makefiledesc(contents, compressedlen, index, target = None,
         # Only EXE- and DLL-files have a concept of capability.
         capfield = None
 
-    # Calculate file hash using SHA-1. Create a SISHash SISField out of it.
-    # Contents may be None, to properly support the EOpNull install operation.
-    if contents != None:
-        sha1hash = sha1(contents).digest()
-    else:
+    # Create a SISHash SISField out of the SHA-1 file hash. Hash may be
+    # None, to properly support the EOpNull install operation.
+    if sha1hash == None:
         # No data, the containing SISBlob is mandatory but empty.
         sha1hash = ""
     hashblob = sisfield.SISBlob(Data = sha1hash)
@@ -186,7 +451,7 @@ def makefiledesc(contents, compressedlen, index, target = None,
                                        Operation = operation,
                                        OperationOptions = options,
                                        Length = compressedlen,
-                                       UncompressedLength = len(contents),
+                                       UncompressedLength = uncompressedlen,
                                        FileIndex = index)
 
 def makedependency(uid, fromversion, toversion, names):
@@ -307,6 +572,279 @@ def makelangconditional(languages, langdepfiles):
                           ElseIfs = elseiffieldarray)
 
 
+def normalizetarget(target):
+    '''Convert a target path to a canonical form for SISReader look-ups.'''
+
+    return target.replace("/", "\\").lower()
+
+def listfiledescs(sisinstallblock, filedescs = None):
+    '''Recursively list the SISFileDescription SISFields of a
+    SISInstallBlock, including conditional blocks.'''
+
+    if filedescs == None:
+        filedescs = []
+
+    for n in xrange(len(sisinstallblock.Files)):
+        filedescs.append(sisinstallblock.Files[n])
+
+    for n in xrange(len(sisinstallblock.IfBlocks)):
+        sisif = sisinstallblock.IfBlocks[n]
+        listfiledescs(sisif.InstallBlock, filedescs)
+        for m in xrange(len(sisif.ElseIfs)):
+            listfiledescs(sisif.ElseIfs[m].InstallBlock, filedescs)
+
+    return filedescs
+
+def listembeddedcontrollers(sisinstallblock, controllers = None):
+    '''Recursively list the embedded SISController SISFields of a
+    SISInstallBlock, including conditional blocks.'''
+
+    if controllers == None:
+        controllers = []
+
+    for n in xrange(len(sisinstallblock.EmbeddedSISFiles)):
+        controllers.append(sisinstallblock.EmbeddedSISFiles[n])
+
+    for n in xrange(len(sisinstallblock.IfBlocks)):
+        sisif = sisinstallblock.IfBlocks[n]
+        listembeddedcontrollers(sisif.InstallBlock, controllers)
+        for m in xrange(len(sisif.ElseIfs)):
+            listembeddedcontrollers(sisif.ElseIfs[m].InstallBlock,
+                                    controllers)
+
+    return controllers
+
+
+##############################################################################
+# ChecksumWriter class for calculating checksums during output
+##############################################################################
+
+class ChecksumWriter(object):
+    '''A file-like object which calculates a CCITT CRC-16 checksum of all
+    data written to it, optionally passing the data on to another file
+    object. Used with SISField.writeto(), no string conversion is needed.'''
+
+    def __init__(self, fileobj = None):
+        self.fileobj    = fileobj
+        self.crc        = symbianutil.CRC16CCITT()
+
+    def write(self, data):
+        self.crc.update(data)
+        if self.fileobj != None:
+            self.fileobj.write(data)
+
+    def getvalue(self):
+        return self.crc.getvalue()
+
+
+##############################################################################
+# CompressionCache class for re-using compressed file contents
+##############################################################################
+
+class CompressionCache(object):
+    '''An on-disk cache of compressed file contents
+
+    Files are stored in a cache directory, named by the SHA-1 digest of the
+    uncompressed contents and the compression profile used. Each cache file
+    contains the contents of a SISCompressed SISField, preceded by a CRC-32
+    checksum. When the total size of the cache exceeds maxsize bytes, least
+    recently used files are removed by trim().
+
+    Errors accessing the cache are ignored. In the worst case the
+    files are compressed again.'''
+
+    def __init__(self, cachedir, maxsize = DEFAULTCACHESIZE):
+        self.cachedir   = cachedir
+        self.maxsize    = maxsize
+
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    def makepath(self, sha1hash, profile):
+        return os.path.join(self.cachedir, "%s-%s%s" % (
+            sha1hash.encode("hex"), profile, CACHEFILESUFFIX))
+
+    def lookup(self, sha1hash, uncompressedlen, profile):
+        '''Return SISCompressed contents for the file with the given
+        SHA-1 digest and length, compressed using the given profile,
+        or None if not found in the cache.'''
+
+        path = self.makepath(sha1hash, profile)
+        try:
+            f = file(path, "rb")
+            try:
+                string = f.read()
+            finally:
+                f.close()
+        except IOError:
+            # Not in cache.
+            return None
+
+        if len(string) < 16:
+            return None
+
+        # Verify the cache file, discard it if it is damaged.
+        crc, compalgo, uncomplen = struct.unpack("<LLQ", string[:16])
+        cstring = string[4:]
+        del string
+        if (crc != zlib.crc32(cstring) & 0xffffffffL or
+            compalgo not in (sisfield.ECompressNone,
+                             sisfield.ECompressDeflate) or
+            uncomplen != uncompressedlen):
+            return None
+
+        # Mark cache file as recently used.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return cstring
+
+    def store(self, sha1hash, profile, cstring):
+        '''Store SISCompressed contents for the file with the given
+        SHA-1 digest, compressed using the given profile, in the cache.'''
+
+        path = self.makepath(sha1hash, profile)
+        temppath = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            f = file(temppath, "wb")
+            try:
+                f.write(struct.pack("<L", zlib.crc32(cstring) & 0xffffffffL))
+                f.write(cstring)
+            finally:
+                f.close()
+
+            # Rename is atomic. Concurrent builds never see partial files.
+            try:
+                os.rename(temppath, path)
+            except OSError:
+                # Already exists on Windows, keep the old one.
+                os.remove(temppath)
+        except (IOError, OSError):
+            pass
+
+    def trim(self):
+        '''Remove least recently used files until the total
+        size of the cache is at most maxsize bytes.'''
+
+        files = []
+        totalsize = 0
+        try:
+            for name in os.listdir(self.cachedir):
+                if not name.endswith(CACHEFILESUFFIX):
+                    continue
+                path = os.path.join(self.cachedir, name)
+                st = os.stat(path)
+                files.append((st.st_mtime, st.st_size, path))
+                totalsize += st.st_size
+        except OSError:
+            return
+
+        files.sort()
+        for mtime, size, path in files:
+            if totalsize <= self.maxsize:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            totalsize -= size
+
+
+##############################################################################
+# SignatureCache class for re-using signatures
+##############################################################################
+
+class SignatureCache(object):
+    '''An on-disk cache of signatures
+
+    RSA (PKCS #1 v1.5) signatures only depend on the private key and the
+    signed string. Signatures are stored in a cache directory, named by
+    the SHA-1 digest of the private key, the signature algorithm and the
+    SHA-1 digest of the signed string. Each cache file contains the
+    signature algorithm and the signature, preceded by a CRC-32 checksum.
+
+    The cache is keyed by the private key exactly as given (the PEM text,
+    encrypted or not), not by the certificate. The certificate is not part
+    of the signature, so a renewed certificate for the same key still uses
+    the cached signatures. The same key in another PEM encoding or with
+    another pass phrase gets cache entries of its own.
+
+    DSA signatures are randomized and are never cached. Signatures are small,
+    so the cache is not trimmed. Errors accessing the cache are ignored.'''
+
+    def __init__(self, cachedir):
+        self.cachedir   = cachedir
+
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+
+    def makepath(self, privkey, algoid, string):
+        keyhash = sha1(privkey).digest()
+        stringhash = sha1(string).digest()
+        name = sha1("%s%s\0%s" % (keyhash, algoid, stringhash)).hexdigest()
+        return os.path.join(self.cachedir, name + SIGCACHEFILESUFFIX)
+
+    def lookup(self, privkey, string, algoid):
+        '''Return (signature, algorithm oid) of the string signed using
+        the given private key, or None if not found in the cache. The
+        algorithm oid must match the type of the parsed private key.'''
+
+        if algoid != RSAALGORITHMOID:
+            # DSA signatures are never cached.
+            return None
+
+        path = self.makepath(privkey, algoid, string)
+        try:
+            f = file(path, "rb")
+            try:
+                data = f.read()
+            finally:
+                f.close()
+        except IOError:
+            # Not in cache.
+            return None
+
+        # Verify the cache file, discard it if it is damaged.
+        if (len(data) < 4 or struct.unpack("<L", data[:4])[0] !=
+            zlib.crc32(data[4:]) & 0xffffffffL):
+            return None
+        algoid, signature = data[4:].split("\0", 1)
+        if algoid != RSAALGORITHMOID or len(signature) == 0:
+            return None
+
+        return (signature, algoid)
+
+    def store(self, privkey, string, signature, algoid):
+        '''Store a signature of the string signed using the given
+        private key in the cache. DSA signatures are ignored.'''
+
+        if algoid != RSAALGORITHMOID:
+            # Not a deterministic signature algorithm.
+            return
+
+        data = "%s\0%s" % (algoid, signature)
+        path = self.makepath(privkey, algoid, string)
+        temppath = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            f = file(temppath, "wb")
+            try:
+                f.write(struct.pack("<L", zlib.crc32(data) & 0xffffffffL))
+                f.write(data)
+            finally:
+                f.close()
+
+            # Rename is atomic. Concurrent builds never see partial files.
+            try:
+                os.rename(temppath, path)
+            except OSError:
+                # Already exists on Windows, keep the old one.
+                os.remove(temppath)
+        except (IOError, OSError):
+            pass
+
+
 ##############################################################################
 # SimpleSISWriter class for no-frills SIS file generation
 ##############################################################################
@@ -320,13 +858,40 @@ class SimpleSISWriter(object):
     - Condition blocks are not supported. Languages are, however.
     - Nested SIS files are not supported.
     - SIS type is always a full installation package (type EInstInstallation).
-    - Package options (EInstFlagShutdownApps) are not supported.'''
+    - Package options (EInstFlagShutdownApps) are not supported.
+
+    If jobs is larger than one, files are compressed in parallel using a
+    pool of that many worker processes. The resulting SIS file is identical
+    to the one generated with serial compression.
+
+    If a CompressionCache instance is given, files found in it are not
+    compressed again and newly compressed files are stored in it.
+
+    If a SignatureCache instance is given, signatures found in it are
+    re-used instead of signing the SIS metadata again.
+
+    The compression profile is one of the profiles listed in
+    sisfield.compressionprofiles, or None for the default profile.'''
 
     def __init__(self, languages, names, uid, version,
-                 vendorname, vendornames, creationtime = None):
+                 vendorname, vendornames, creationtime = None, jobs = 1,
+                 cache = None, profile = None, sigcache = None):
         # Set empty list of languages, names, files, certificates and so on.
         self.languages      = []
         self.filedata       = []
+        self.compressioninfo = []
+        self.pendingfiles   = []
+        self.pool           = None
+        self.jobs           = jobs
+        self.cache          = cache
+        self.sigcache       = sigcache
+
+        # Resolve the compression profile now, for worker processes.
+        if profile == None:
+            profile = sisfield.compressionprofile
+        elif profile not in sisfield.compressionprofiles:
+            raise ValueError("invalid compression profile '%s'" % profile)
+        self.profile        = profile
         self.files          = []
         self.langdepfiles   = []
         self.logo           = None
@@ -407,28 +972,23 @@ class SimpleSISWriter(object):
             raise ValueError("logo already set")
 
         # Create SISFileData and SISFileDescription SISFields.
-        filedata = makefiledata(contents)
-        complen = filedata.getcompressedlength()
         runopts = (sisfield.EInstFileRunOptionInstall |
                    sisfield.EInstFileRunOptionByMimeType)
-        filedesc = makefiledesc(contents, complen, len(self.filedata),
-                                None, mimetype, None, sisfield.EOpRun, runopts)
+        filedesc = self.addfiledata(contents, None, mimetype, None,
+                                    sisfield.EOpRun, runopts)
         self.logo = sisfield.SISLogo(LogoFile = filedesc)
-        self.filedata.append(filedata)
 
     def addfile(self, contents, target = None, mimetype = None,
                 capabilities = None, operation = sisfield.EOpInstall,
                 options = 0):
-        '''Add a file that is same for all languages to generated SIS file.'''
+        '''Add a file that is same for all languages to generated SIS file.
+
+        Contents may be a binary string or a file-like object.'''
 
         # Create SISFileData and SISFileDescription SISFields.
-        filedata = makefiledata(contents)
-        complen = filedata.getcompressedlength()
-        metadata = makefiledesc(contents, complen, len(self.filedata),
-                                target, mimetype, capabilities,
-                                operation, options)
+        metadata = self.addfiledata(contents, target, mimetype,
+                                    capabilities, operation, options)
         self.files.append(metadata)
-        self.filedata.append(filedata)
 
     def addlangdepfile(self, clist, target = None, mimetype = None,
                        capabilities = None, operation = sisfield.EOpInstall,
@@ -441,22 +1001,14 @@ class SimpleSISWriter(object):
             raise ValueError("%d files given but number of languages is %d" %
                              (len(clist), len(self.languages)))
 
-        data = []
         files = []
-        index = len(self.filedata)
         for contents in clist:
             # Create SISFileData and SISFileDescription SISFields.
-            filedata = makefiledata(contents)
-            complen = filedata.getcompressedlength()
-            metadata = makefiledesc(contents, complen, index,
-                                    target, mimetype, capabilities,
-                                    operation, options)
+            metadata = self.addfiledata(contents, target, mimetype,
+                                        capabilities, operation, options)
             files.append(metadata)
-            data.append(filedata)
-            index += 1
 
         self.langdepfiles.append(files)
-        self.filedata.extend(data)
 
     def addcertificate(self, privkey, cert, passphrase):
         '''Add a certificate to SIS file.
@@ -505,6 +1057,146 @@ class SimpleSISWriter(object):
     def tostring(self):
         '''Convert this SIS instance to a (possibly very large) string.'''
 
+        uidstring, contentsfield = self.makecontents()
+
+        return uidstring + contentsfield.tostring()
+
+    def tofile(self, outfile):
+        '''Write this SIS instance to a file object or a named file.'''
+
+        try:
+            f = file(outfile, "wb")
+            try:
+                self.writecontents(f)
+            finally:
+                f.close()
+        except TypeError:
+            # Not a file name, write to a file object.
+            self.writecontents(outfile)
+
+    def writecontents(self, f):
+        '''Write this SIS instance to a file object.'''
+
+        uidstring, contentsfield = self.makecontents(checksums = False)
+        writesiscontents(f, uidstring, contentsfield)
+
+    def addfiledata(self, contents, target, mimetype, capabilities,
+                    operation, options):
+        '''Add a SISFileData SISField for the given file contents and
+        return a matching SISFileDescription SISField.'''
+
+        # File hash and lengths are filled in by completefile().
+        metadata = makefiledesc(None, 0, 0, len(self.filedata), target,
+                                mimetype, capabilities, operation, options)
+        self.filedata.append(None)
+        self.compressioninfo.append(None)
+
+        if self.cache != None and isinstance(contents, str):
+            # Use previously compressed contents if available.
+            sha1hash = sha1(contents).digest()
+            uncomplen = len(contents)
+            cstring = self.cache.lookup(sha1hash, uncomplen, self.profile)
+            if cstring != None:
+                self.completefile(metadata,
+                                  (cstring, sha1hash, uncomplen, None), True)
+                return metadata
+
+        if self.jobs > 1 and isinstance(contents, str):
+            if self.pool == None:
+                self.startpool()
+
+        if self.pool == None:
+            # Serial compression, complete the SISFields right away.
+            result = compressfile(contents, self.profile)
+            if self.cache != None:
+                self.cache.store(result[1], self.profile, result[0])
+            self.completefile(metadata, result, False)
+        else:
+            # Parallel compression, complete the SISFields later.
+            result = self.pool.apply_async(compressfile,
+                                           (contents, self.profile))
+            self.pendingfiles.append((result, metadata))
+
+        return metadata
+
+    def completefile(self, metadata, result, cached):
+        '''Create the SISFileData SISField for a compressed file and
+        fill in the hash and lengths of its SISFileDescription SISField.'''
+
+        cstring, sha1hash, uncomplen, reason = result
+        filedata = makecompressedfiledata(cstring)
+        complen = filedata.getcompressedlength()
+        self.filedata[metadata.FileIndex] = filedata
+        metadata.Hash.HashData.Data = sha1hash
+        metadata.Length = complen
+        metadata.UncompressedLength = uncomplen
+
+        # Record the compression decision for getcompressioninfo().
+        if filedata.FileData.CompressionAlgorithm != sisfield.ECompressNone:
+            desc = "compressed"
+        elif reason != None:
+            desc = "not compressed, %s" % reason
+        elif cached:
+            desc = "not compressed"
+        else:
+            desc = "not compressed, compression not beneficial"
+        if cached:
+            desc += " (cached)"
+        self.compressioninfo[metadata.FileIndex] = (metadata.Target.String,
+                                                    uncomplen, complen, desc)
+
+    def getcompressioninfo(self):
+        '''Return a list of (target, uncompressed length, compressed
+        length, description) tuples, one for each file added so far.'''
+
+        self.finishfiles()
+        return self.compressioninfo[:]
+
+    def startpool(self):
+        '''Start a pool of worker processes for parallel compression.
+        Fall back to serial compression if that is not possible.'''
+
+        if multiprocessing == None:
+            self.jobs = 1
+            return
+
+        try:
+            self.pool = multiprocessing.Pool(self.jobs)
+        except (OSError, ImportError, NotImplementedError):
+            # Some platforms lack working process synchronization.
+            self.jobs = 1
+
+    def finishfiles(self):
+        '''Wait for parallel compression to finish and
+        complete the SISFields of pending files.'''
+
+        if self.pool == None:
+            return
+
+        try:
+            for result, metadata in self.pendingfiles:
+                result = result.get()
+                if self.cache != None:
+                    self.cache.store(result[1], self.profile, result[0])
+                self.completefile(metadata, result, False)
+        finally:
+            self.pendingfiles = []
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def makecontents(self, checksums = True):
+        '''Generate the SISContents SISField of this SIS instance. Return
+        a tuple of (SIS UID string, SISContents SISField). If checksums is
+        False, checksum fields are left zero, to be filled in by the caller.'''
+
+        # Complete any files still being compressed.
+        self.finishfiles()
+
+        if self.cache != None:
+            # Keep compression cache within its size limit.
+            self.cache.trim()
+
         # Generate a SISInfo SISField.
         infofield = sisfield.SISInfo(UID = self.uid,
                                      VendorUniqueName = self.vendorname,
@@ -571,7 +1263,8 @@ class SimpleSISWriter(object):
             # Calculate a signature of the SISController so far.
             string = ctrlfield.tostring()
             string = sisfield.stripheaderandpadding(string)
-            signature, algoid = signstring(cert[0], cert[2], string)
+            signature, algoid = signstring(cert[0], cert[2], string,
+                                           self.sigcache)
 
             # Create a SISCertificateChain SISField from certificate data.
             sf1 = sisfield.SISBlob(Data = cryptutil.certtobinary(cert[1]))
@@ -596,7 +1289,8 @@ class SimpleSISWriter(object):
         # and wrap it in SISCompressed SISField.
         ctrlfield.DataIndex = didxfield
         ctrlcompfield = sisfield.SISCompressed(Data = ctrlfield,
-            CompressionAlgorithm = sisfield.ECompressDeflate)
+            CompressionAlgorithm = sisfield.ECompressDeflate,
+            profile = self.profile)
 
         # Generate SISData SISField.
         sa = sisfield.SISArray(SISFields = self.filedata,
@@ -605,14 +1299,18 @@ class SimpleSISWriter(object):
         sa = sisfield.SISArray(SISFields = [dufield])
         datafield = sisfield.SISData(DataUnits = sa)
 
-        # Calculate SISController checksum.
-        # TODO: Requires an extra tostring() conversion.
-        ctrlcs = symbianutil.crc16ccitt(ctrlcompfield.tostring())
+        # Calculate SISController and SISData checksums. The fields are
+        # fed to the checksum in chunks, without converting them to strings.
+        ctrlcs = 0
+        datacs = 0
+        if checksums:
+            cw = ChecksumWriter()
+            ctrlcompfield.writeto(cw)
+            ctrlcs = cw.getvalue()
+            cw = ChecksumWriter()
+            datafield.writeto(cw)
+            datacs = cw.getvalue()
         ctrlcsfield = sisfield.SISControllerChecksum(Checksum = ctrlcs)
-
-        # Calculate SISData checksum.
-        # TODO: Requires an extra tostring() conversion.
-        datacs = symbianutil.crc16ccitt(datafield.tostring())
         datacsfield = sisfield.SISDataChecksum(Checksum = datacs)
 
         # Generate SISContents SISField.
@@ -625,19 +1323,471 @@ class SimpleSISWriter(object):
         uidstring = symbianutil.uidstostring(0x10201a7aL, 0x00000000L,
                                              self.uid.UID1)
 
-        # Return the completed SIS file as a string.
-        return uidstring + contentsfield.tostring()
+        return (uidstring, contentsfield)
 
-    def tofile(self, outfile):
-        '''Write this SIS instance to a file object or a named file.'''
 
-        s = self.tostring()
+##############################################################################
+# SISReader class for random access to files inside a SIS file
+##############################################################################
 
+class SISFileEntry(object):
+    '''Information about a file inside a SIS file, see SISReader
+
+    target              target path, a Unicode string (may be empty)
+    mimetype            MIME type, a Unicode string
+    operation           install operation, see sisfield.EOpInstall and others
+    options             install operation options
+    capabilities        capability bitmask, a binary string or None
+    hash                SHA-1 digest of the uncompressed file, a binary string
+    length              length of the compressed file
+    uncompressedlength  length of the uncompressed file
+    dataindex           index of the SISDataUnit holding the file
+    fileindex           index of the SISFileData in the SISDataUnit
+    offset              offset of the SISFileData in the SIS file or None
+    fieldlength         length of the SISFileData in the SIS file'''
+
+    __slots__ = ("target", "mimetype", "operation", "options", "capabilities",
+                 "hash", "length", "uncompressedlength", "dataindex",
+                 "fileindex", "offset", "fieldlength")
+
+    def __init__(self, filedesc, dataindex):
+        self.target             = filedesc.Target.String
+        self.mimetype           = filedesc.MIMEType.String
+        self.operation          = filedesc.Operation
+        self.options            = filedesc.OperationOptions
+        self.capabilities       = None
+        if filedesc.Capabilities != None:
+            self.capabilities   = filedesc.Capabilities.Capabilities
+        self.hash               = filedesc.Hash.HashData.Data
+        self.length             = filedesc.Length
+        self.uncompressedlength = filedesc.UncompressedLength
+        self.dataindex          = dataindex
+        self.fileindex          = filedesc.FileIndex
+        self.offset             = None
+        self.fieldlength        = 0
+
+    def __str__(self):
+        return u"<SISFileEntry '%s', %d bytes>" % (self.target,
+                                                   self.uncompressedlength)
+
+class SISReader(object):
+    '''Random access to the files inside a SIS file
+
+    The SIS file is memory mapped. Only the SISController (and the
+    SISControllers of embedded SIS files) are parsed when opening the file.
+    An index of SISFileEntry instances is built, recording the location of
+    the SISFileData of each file. Reading a file decompresses only its own
+    data. Release the SIS file using close().
+
+    uids                UID1, UID2, UID3 and UIDCRC of the SIS file
+    contents            the SISContents SISField, parsed on demand
+    extralength         number of extra bytes after the SIS file
+    files               a list of SISFileEntry instances, in the order of
+                        the SISFileDescription SISFields (the logo first)'''
+
+    def __init__(self, filename):
+        self.data = mapfile(filename)
         try:
-            f = file(outfile, "wb")
+            if len(self.data) < 16:
+                raise sisfield.SISException("not a SIS file")
+            self.uids = struct.unpack("<LLLL", self.data[:16])
+            self.contents, rlen = sisfield.SISField(self.data, False, 16)
+            if not isinstance(self.contents, sisfield.SISContents):
+                raise sisfield.SISException("not a SIS file")
+            self.extralength = len(self.data) - (rlen + 16)
+
+            # Build the file index.
+            self.files = []
+            self.targetmap = {}
+            self.dataunits = self.contents.Data.DataUnits
+            self.indexcontroller(self.contents.Controller.Data)
+        except:
+            self.close()
+            raise
+
+    def indexcontroller(self, ctrlfield):
+        '''Add files of a SISController and its embedded SIS files.'''
+
+        dataindex = ctrlfield.DataIndex.DataIndex
+        if dataindex >= len(self.dataunits):
+            raise sisfield.SISException("invalid SISDataIndex %d" % dataindex)
+        fdarray = self.dataunits[dataindex].FileData
+
+        # The logo is described outside the SISInstallBlock.
+        filedescs = []
+        if ctrlfield.Logo != None:
+            filedescs.append(ctrlfield.Logo.LogoFile)
+        listfiledescs(ctrlfield.InstallBlock, filedescs)
+
+        for filedesc in filedescs:
+            entry = SISFileEntry(filedesc, dataindex)
+            if entry.fileindex < len(fdarray):
+                # Record the location of the SISFileData, without parsing it.
+                item = fdarray.getrawitem(entry.fileindex)
+                if type(item) == tuple:
+                    entry.offset, entry.fieldlength = item[1:]
+            self.files.append(entry)
+
+            # First file with a given target wins.
+            if entry.target != "":
+                self.targetmap.setdefault(normalizetarget(entry.target), entry)
+
+        for embctrlfield in listembeddedcontrollers(ctrlfield.InstallBlock):
+            self.indexcontroller(embctrlfield)
+
+    def findfile(self, target):
+        '''Return the SISFileEntry for the given target path, or None if
+        not found. Case is ignored. A drive letter also matches "!:".'''
+
+        target = normalizetarget(target)
+        entry = self.targetmap.get(target, None)
+        if entry == None and target[1:3] == ":\\":
+            # Try again with a user selectable drive.
+            entry = self.targetmap.get("!" + target[1:], None)
+        return entry
+
+    def iterfile(self, entry, blocksize = INGESTBLOCKSIZE):
+        '''Generate the uncompressed contents of a file in blocks of at most
+        blocksize bytes (the whole file in one block if blocksize is None).
+        The SHA-1 digest of the contents is checked at the end.'''
+
+        if self.data == None:
+            raise ValueError("SIS file already closed")
+        if entry.offset == None:
+            raise sisfield.SISException("no file data")
+
+        end = entry.offset + entry.fieldlength
+        hdrlen, flen, padlen = sisfield.parsearrayitemheader(self.data,
+                                                             entry.offset, end)
+        fdfield = sisfield.SISFileData(fromcontents = (self.data,
+                                                       entry.offset + hdrlen,
+                                                       flen))
+
+        hashobj = sha1()
+        for block in fdfield.FileData.iterdata(blocksize):
+            hashobj.update(block)
+            yield block
+
+        if len(entry.hash) > 0 and hashobj.digest() != entry.hash:
+            raise sisfield.SISException("file hash mismatch")
+
+    def readfile(self, entry):
+        '''Return the uncompressed contents of a file as a string.'''
+
+        return "".join(self.iterfile(entry, None))
+
+    def close(self):
+        '''Release the SIS file. SISFields in contents become unusable.'''
+
+        if self.data != None:
+            unmapfile(self.data)
+            self.data = None
+
+
+##############################################################################
+# SISValidator class for checking SIS files without parsing them
+##############################################################################
+
+class SISValidator(object):
+    '''Structural checker for SIS files, see validatesis()
+
+    SISFields are checked against the subfield lists of the SISField classes,
+    without creating SISField instances. Only the SISController is
+    decompressed. Offsets inside the SISController refer to its uncompressed
+    contents.'''
+
+    def __init__(self, data, checkhashes = False):
+        self.data           = data
+        self.checkhashes    = checkhashes
+        self.where          = ""    # Error location suffix
+        self.files          = []    # Stack of file lists of SISControllers
+        self.filehashes     = {}    # (data index, file index) -> file info
+                                    # for files with no SISFileData seen yet
+        self.dataindexes    = []    # Data indexes of SISControllers
+        self.dataindex      = None  # Current SISDataUnit
+        self.fileindex      = None  # Current SISFileData
+        self.dataunitcount  = 0
+
+    def error(self, offset, message):
+        raise sisfield.SISException("%s at offset %d%s" %
+                                    (message, offset, self.where))
+
+    def validate(self):
+        '''Check the SIS file and return a list of warnings.'''
+
+        data = self.data
+        warnings = []
+
+        # Check UIDs.
+        if len(data) < 16:
+            self.error(0, "not enough data for UIDs")
+        uid1, uid2, uid3, uidcrc = struct.unpack("<LLLL", data[:16])
+        if uid1 != 0x10201a7aL:
+            self.error(0, "not a Symbian OS v9.x SIS file")
+        if symbianutil.uidcrc(uid1, uid2, uid3) != uidcrc:
+            self.error(12, "invalid UID checksum")
+
+        # Check SISContents SISField and everything inside it.
+        ftype, hdrlen, flen, padlen = self.parseheader(16, len(data))
+        if ftype != sisfield.SISContents.fieldtype:
+            self.error(16, "SISContents missing")
+        extralen = len(data) - (16 + hdrlen + flen + padlen)
+        if extralen > 0:
+            warnings.append("%d extra bytes after SIS file" % extralen)
+        values = self.checkcontents(sisfield.SISContents, 16 + hdrlen, flen)
+
+        # Check that all SISControllers refer to existing SISDataUnits.
+        for dataindex, offset, where in self.dataindexes:
+            if dataindex >= self.dataunitcount:
+                self.where = where
+                self.error(offset, "invalid SISDataIndex %d" % dataindex)
+
+        # Check that all files have data. Files created by the application
+        # (operation EOpNull) do not need any.
+        for (dataindex, fileindex), fileinfo in self.filehashes.items():
+            sha1hash, uncomplen, operation, offset, where = fileinfo
+            if operation != sisfield.EOpNull:
+                self.where = where
+                self.error(offset, "no SISFileData for FileIndex %d" %
+                           fileindex)
+
+        # Check checksums.
+        for csname, fname in (("ControllerChecksum", "Controller"),
+                              ("DataChecksum", "Data")):
+            csfield = values.get(csname, None)
+            if csfield == None:
+                continue
+            offset, length = values[fname][:2]
+            crc = symbianutil.CRC16CCITT()
+            crc.update(buffer(data, offset, length))
+            if crc.getvalue() != csfield[2]["Checksum"]:
+                self.error(csfield[0], "invalid %s 0x%04x, should be 0x%04x" %
+                           (csname, csfield[2]["Checksum"], crc.getvalue()))
+
+        return warnings
+
+    def parseheader(self, offset, end, exactlength = False):
+        try:
+            return sisfield.parsesisfieldheader(self.data, None, exactlength,
+                                                offset, end - offset)
+        except sisfield.SISException, e:
+            self.error(offset, str(e))
+
+    def checkcontents(self, fclass, offset, length):
+        '''Check the contents of a SISField. Return a dictionary of
+        subfield values for normal SISFields, (offset, length) for
+        SISBlobs and None for the rest.'''
+
+        if issubclass(fclass, sisfield.SISFieldNormal):
+            return self.checknormal(fclass, offset, length)
+        elif fclass == sisfield.SISBlob:
+            return (offset, length)
+        elif fclass == sisfield.SISString:
+            if length & 1:
+                self.error(offset, "SISString length not a multiple of 16 bits")
+        elif fclass == sisfield.SISCapabilities:
+            if length & 3:
+                self.error(offset,
+                           "capabilities length not a multiple of 32 bits")
+        elif fclass == sisfield.SISCompressed:
+            self.checkcontroller(offset, length)
+        elif fclass == sisfield.SISFileData:
+            self.checkfiledata(offset, length)
+        else:
+            self.error(offset, "unexpected %s" % fclass.__name__)
+        return None
+
+    def checknormal(self, fclass, offset, length):
+        '''Check the subfields of a normal SISField, in the same way
+        as SISFieldNormal.fromcontents() parses them.'''
+
+        data = self.data
+        name = fclass.__name__
+        values = {}
+        pos = offset
+        end = offset + length
+        reuse = None    # Header of a field not matching an optional one
+
+        if fclass == sisfield.SISController:
+            self.files.append([])
+
+        for fattr, fkind, ffmt in fclass.compiledfields:
+            if fkind == sisfield.FTYPE_INTEGRAL:
+                # A run of integers.
+                if reuse != None:
+                    self.error(reuse[3], "unexpected %s in %s" %
+                               (sisfield.fieldnumtoname[reuse[0]], name))
+                if pos + ffmt.size > end:
+                    self.error(pos, "%s too short" % name)
+                for attr, value in zip(fattr, ffmt.unpack_from(data, pos)):
+                    values[attr] = value
+                pos += ffmt.size
+                continue
+
+            if reuse != None:
+                # Header from previous round present, re-use it.
+                field = reuse
+                reuse = None
+            elif pos < end:
+                ftype, hdrlen, flen, padlen = self.parseheader(pos, end)
+                field = (ftype, hdrlen, flen, pos, hdrlen + flen + padlen)
+                pos += field[4]
+            elif fkind == sisfield.FTYPE_OPTIONAL:
+                continue
+            else:
+                self.error(pos, "%s missing from %s" % (ffmt, name))
+
+            ftype, hdrlen, flen, fpos, n = field
+            fname = sisfield.fieldnumtoname.get(ftype, None)
+            if fname == None:
+                self.error(fpos, "invalid SISField type %d" % ftype)
+
+            if fkind == sisfield.FTYPE_ARRAY:
+                if fname != "SISArray":
+                    self.error(fpos, "%s instead of SISArray in %s" %
+                               (fname, name))
+                self.checkarray(fpos + hdrlen, flen, ffmt)
+            elif fname == ffmt:
+                values[fattr] = (fpos, n, self.checkcontents(
+                    sisfield.fieldnumtoclass[ftype], fpos + hdrlen, flen))
+            elif fkind == sisfield.FTYPE_OPTIONAL:
+                # Not this optional field, try the next one.
+                reuse = field
+            else:
+                self.error(fpos, "%s instead of %s in %s" % (fname, ffmt, name))
+
+        # Any remaining data is ignored, like SISFieldNormal.fromcontents()
+        # does. Collect information needed for checking the file data.
+        if fclass == sisfield.SISHash:
+            if values["HashAlgorithm"] != sisfield.ESISHashAlgSHA1:
+                self.error(offset, "invalid SISHash algorithm %d" %
+                           values["HashAlgorithm"])
+        elif fclass == sisfield.SISFileDescription:
+            hoffset, hlength = values["Hash"][2]["HashData"][2]
+            self.files[-1].append((values["FileIndex"],
+                                   data[hoffset:(hoffset + hlength)],
+                                   values["UncompressedLength"],
+                                   values["Operation"], offset, self.where))
+        elif fclass == sisfield.SISController:
+            files = self.files.pop()
+            if values.get("DataIndex", None) == None:
+                self.error(offset, "SISDataIndex missing from SISController")
+            dataindex = values["DataIndex"][2]["DataIndex"]
+            self.dataindexes.append((dataindex, values["DataIndex"][0],
+                                     self.where))
+            for fileinfo in files:
+                self.filehashes[(dataindex, fileinfo[0])] = fileinfo[1:]
+
+        return values
+
+    def checkarray(self, offset, length, itemname):
+        '''Check the contents of a SISArray and all items in it.'''
+
+        if length < 4:
+            self.error(offset, "SISArray too short")
+        atype = struct.unpack_from("<L", self.data, offset)[0]
+        aname = sisfield.fieldnumtoname.get(atype, "type %d" % atype)
+        if aname != itemname:
+            self.error(offset, "SISArray of %s instead of %s" %
+                       (aname, itemname))
+        itemclass = sisfield.fieldnumtoclass[atype]
+
+        pos = offset + 4
+        end = offset + length
+        index = 0
+        while pos < end:
             try:
-                f.write(s)
-            finally:
-                f.close()
-        except TypeError:
-            f.write(s)
+                hdrlen, flen, padlen = sisfield.parsearrayitemheader(
+                    self.data, pos, end)
+            except sisfield.SISException, e:
+                self.error(pos, str(e))
+
+            # Keep track of file data locations.
+            if itemclass == sisfield.SISDataUnit:
+                self.dataindex = index
+                self.dataunitcount = index + 1
+            elif itemclass == sisfield.SISFileData:
+                self.fileindex = index
+
+            self.checkcontents(itemclass, pos + hdrlen, flen)
+            pos += hdrlen + flen + padlen
+            index += 1
+
+    def checkcontroller(self, offset, length):
+        '''Decompress and check a SISController.'''
+
+        data = self.data
+        if length < 12:
+            self.error(offset, "SISCompressed too short")
+        compalgo, uncomplen = struct.unpack_from("<LQ", data, offset)
+        if uncomplen > MAXCONTROLLERSIZE:
+            self.error(offset, "SISController too large")
+
+        if compalgo == sisfield.ECompressNone:
+            string = data[(offset + 12):(offset + length)]
+        elif compalgo == sisfield.ECompressDeflate:
+            try:
+                decomp = zlib.decompressobj()
+                string = decomp.decompress(buffer(data, offset + 12,
+                                                  length - 12),
+                                           uncomplen + 1)
+            except zlib.error:
+                self.error(offset, "invalid SISCompressed data")
+        else:
+            self.error(offset, "invalid SISCompressed algorithm %d" % compalgo)
+        if len(string) != uncomplen:
+            self.error(offset, "SISCompressed uncompressed length mismatch")
+
+        # Check the SISController inside, then return to the SIS file.
+        self.data = string
+        self.where = " of SISController uncompressed from offset %d" % offset
+        try:
+            ftype, hdrlen, flen, padlen = self.parseheader(0, len(string),
+                                                           True)
+            if ftype != sisfield.SISController.fieldtype:
+                self.error(0, "SISController missing")
+            self.checkcontents(sisfield.SISController, hdrlen, flen)
+        finally:
+            self.data = data
+            self.where = ""
+
+    def checkfiledata(self, offset, length):
+        '''Check a SISFileData and optionally the hash of its contents.'''
+
+        data = self.data
+        ftype, hdrlen, flen, padlen = self.parseheader(offset, offset + length,
+                                                       True)
+        if ftype != sisfield.SISCompressed.fieldtype:
+            self.error(offset, "SISCompressed missing from SISFileData")
+        if flen < 12:
+            self.error(offset, "SISCompressed too short")
+        coffset = offset + hdrlen
+        compalgo, uncomplen = struct.unpack_from("<LQ", data, coffset)
+        if compalgo not in (sisfield.ECompressNone, sisfield.ECompressDeflate):
+            self.error(coffset, "invalid SISCompressed algorithm %d" %
+                       compalgo)
+        if compalgo == sisfield.ECompressNone and uncomplen != flen - 12:
+            self.error(coffset, "SISCompressed uncompressed length mismatch")
+
+        fileinfo = self.filehashes.pop((self.dataindex, self.fileindex), None)
+        if fileinfo == None:
+            # Not referred to by any SISFileDescription.
+            return
+        sha1hash, filelen = fileinfo[:2]
+        if filelen != uncomplen:
+            self.error(coffset, "file length %d, should be %d" %
+                       (uncomplen, filelen))
+
+        if self.checkhashes and len(sha1hash) > 0:
+            # Decompress in blocks. SISCompressed checks the length.
+            cfield = sisfield.SISCompressed(rawdatainside = True,
+                                            fromcontents = (data, coffset,
+                                                            flen))
+            hashobj = sha1()
+            try:
+                for block in cfield.iterdata(INGESTBLOCKSIZE):
+                    hashobj.update(block)
+            except sisfield.SISException, e:
+                self.error(coffset, str(e))
+            if hashobj.digest() != sha1hash:
+                self.error(offset, "file hash mismatch")
@@ -24,6 +24,7 @@
 
 import struct
 import zlib
+import binascii
 
 
 ##############################################################################
@@ -128,20 +129,60 @@ def e32imagecaps(string):
 # Checksum functions for various types of checksums in Symbian OS
 ##############################################################################
 
-def crc16ccitt(string, initialvalue = 0x0000, finalxor = 0x0000):
-    '''Calculate a CCITT CRC-16 checksum using a
-    slow and straightforward algorithm.'''
+def crc16ccitttableupdate(data, value):
+    '''Update a CCITT CRC-16 value using a table-driven algorithm.
+    Only used by crc16ccittupdate() if binascii.crc_hqx() is not available.'''
+
+    table = crc16ccitttable
+    for c in str(data):
+        value = ((value << 8) & 0xff00) ^ table[(value >> 8) ^ ord(c)]
+
+    return value
+
+def makecrc16ccitttable():
+    '''Generate a lookup table for crc16ccitttableupdate().'''
 
-    value = initialvalue
-    for c in string:
-        value ^= (ord(c) << 8)
+    table = []
+    for n in xrange(256):
+        value = n << 8
         for b in xrange(8):
             value <<= 1
             if value & 0x10000:
                 value ^= 0x1021
             value &= 0xffff
+        table.append(value)
 
-    return value ^ finalxor
+    return table
+
+crc16ccitttable = makecrc16ccitttable()
+
+try:
+    # binascii.crc_hqx() calculates the same CRC in C.
+    crc16ccittupdate = binascii.crc_hqx
+except AttributeError:
+    crc16ccittupdate = crc16ccitttableupdate
+
+def crc16ccitt(string, initialvalue = 0x0000, finalxor = 0x0000):
+    '''Calculate a CCITT CRC-16 checksum.'''
+
+    return crc16ccittupdate(string, initialvalue) ^ finalxor
+
+class CRC16CCITT(object):
+    '''Incremental CCITT CRC-16 checksum calculation
+
+    Data may be fed in pieces using update(). The pieces may be binary
+    strings or buffer objects. getvalue() returns the checksum of all data
+    so far.'''
+
+    def __init__(self, initialvalue = 0x0000, finalxor = 0x0000):
+        self.value      = initialvalue
+        self.finalxor   = finalxor
+
+    def update(self, data):
+        self.value = crc16ccittupdate(data, self.value)
+
+    def getvalue(self):
+        return self.value ^ self.finalxor
 
 def crc32ccitt(data, initialvalue = 0x00000000L, finalxor = 0x00000000L):
     '''Use zlib to calculate a CCITT CRC-32 checksum. Work around zlib
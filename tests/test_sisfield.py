@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+# test_sisfield.py - Tests for Ensymble SISField classes
+#
+# This program is part of Ensymble developer utilities for Symbian OS(TM).
+#
+# Ensymble is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Ensymble is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ensymble; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##############################################################################
+
+import os
+import sys
+import zlib
+import random
+import unittest
+import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from ensymble.utils import sisfield
+
+
+def makearray(strings):
+    '''Return a parsed SISArray of SISStrings, with all items unparsed.'''
+
+    items = [sisfield.SISString(String = s) for s in strings]
+    data = sisfield.SISArray(SISFields = items).tostring()
+    return sisfield.SISField(data)
+
+def arraystrings(array):
+    return [array[n].String for n in xrange(len(array))]
+
+def randomstring(length, seed = 1):
+    rnd = random.Random(seed)
+    return "".join([chr(rnd.randrange(256)) for n in xrange(length)])
+
+def sampleoffsets(length):
+    '''Return the offsets guessincompressible() takes samples from.'''
+
+    step = (length - sisfield.SAMPLESIZE) / (sisfield.NUMSAMPLES - 1)
+    return [n * step for n in xrange(sisfield.NUMSAMPLES)]
+
+def fillsamples(string, length, fill):
+    '''Return data of the given length made by repeating the string,
+    with the sampled areas overwritten by the fill data.'''
+
+    data = (string * (length / len(string) + 1))[:length]
+    for offset in sampleoffsets(length):
+        data = (data[:offset] + fill[:sisfield.SAMPLESIZE] +
+                data[(offset + sisfield.SAMPLESIZE):])
+    return data
+
+# Repetitive text and random data, both longer than all samples together.
+TEXTDATA = "".join(["line %d of a text file\n" % n for n in xrange(2000)])
+BINDATA = randomstring(sisfield.SAMPLESIZE * sisfield.NUMSAMPLES + 1000)
+
+class SISArrayRawItemTest(unittest.TestCase):
+    def setUp(self):
+        self.src = makearray([u"one", u"two", u"three"])
+        self.dst = makearray([u"a", u"b"])
+        self.dst.tostring()     # Fill the chunk cache.
+
+    def roundtrip(self):
+        return arraystrings(sisfield.SISField(self.dst.tostring()))
+
+    def testinsert(self):
+        self.dst.insert(1, self.src.getrawitem(0))
+        self.assertEqual(self.roundtrip(), [u"a", u"one", u"b"])
+
+    def testextend(self):
+        self.dst.extend([self.src.getrawitem(n) for n in xrange(3)])
+        self.assertEqual(self.roundtrip(),
+                         [u"a", u"b", u"one", u"two", u"three"])
+
+    def testsetitem(self):
+        self.dst[0] = self.src.getrawitem(2)
+        self.assertEqual(self.roundtrip(), [u"three", u"b"])
+
+    def testsetslice(self):
+        self.dst[0:1] = [self.src.getrawitem(1), self.src[2]]
+        self.assertEqual(self.roundtrip(), [u"two", u"three", u"b"])
+
+    def testappend(self):
+        self.dst.append(self.src.getrawitem(1))
+        self.assertEqual(self.roundtrip(), [u"a", u"b", u"two"])
+
+class GuessIncompressibleTest(unittest.TestCase):
+    def setUp(self):
+        self.sampleratio = sisfield.SAMPLECOMPRATIO
+
+    def tearDown(self):
+        sisfield.SAMPLECOMPRATIO = self.sampleratio
+
+    def guess(self, data):
+        '''Guess both a string and a file-like object, which must agree.'''
+
+        reason = sisfield.guessincompressible(data)
+
+        # Sampling starts from the current position, which is restored.
+        f = StringIO.StringIO("garbage" + data)
+        f.seek(7)
+        self.assertEqual(sisfield.guessincompressible(f), reason)
+        self.assertEqual(f.tell(), 7)
+
+        return reason
+
+    def testmagic(self):
+        self.assertEqual(self.guess("\x89PNG\r\n\x1a\n" + TEXTDATA),
+                         "PNG data")
+        self.assertEqual(self.guess("\x1f\x8b" + TEXTDATA), "gzip data")
+        self.assertEqual(self.guess("\0\0\0\x18ftypmp42" + TEXTDATA),
+                         "MPEG-4 data")
+
+        # Conclusive signatures apply to short data, too.
+        self.assertEqual(self.guess("PK\x03\x04"), "ZIP data")
+
+        self.assertEqual(self.guess(TEXTDATA), None)
+        self.assertEqual(self.guess("PNG" + TEXTDATA), None)
+
+    def testinconclusivemagic(self):
+        # Text may start like a bzip2 or MP3 file, samples decide.
+        self.assertEqual(self.guess("BZh" + TEXTDATA), None)
+        self.assertEqual(self.guess("ID3" + TEXTDATA), None)
+        self.assertEqual(self.guess("BZh" + BINDATA), "bzip2 data")
+        self.assertEqual(self.guess("ID3" + BINDATA), "MP3 data")
+
+    def testshort(self):
+        # Data not longer than all samples together is always compressed.
+        length = sisfield.SAMPLESIZE * sisfield.NUMSAMPLES
+        self.assertEqual(self.guess(BINDATA[:length]), None)
+        self.assertEqual(self.guess(BINDATA[:(length + 1)]),
+                         "samples did not compress")
+
+    def testsampling(self):
+        # Only the start, the middle and the end of the data are sampled.
+        length = len(TEXTDATA)
+        self.assertEqual(sampleoffsets(length)[-1] + sisfield.SAMPLESIZE,
+                         length)
+        self.assertEqual(self.guess(fillsamples(TEXTDATA, length, BINDATA)),
+                         "samples did not compress")
+        self.assertEqual(self.guess(fillsamples(BINDATA, length, TEXTDATA)),
+                         None)
+
+    def testratio(self):
+        # Samples with about 2 % of repeated data compress just barely.
+        length = len(BINDATA)
+        fill = BINDATA[:(sisfield.SAMPLESIZE - 80)] + "\0" * 80
+        data = fillsamples(BINDATA, length, fill)
+
+        samplelen = 0
+        complen = 0
+        for offset in sampleoffsets(length):
+            sample = data[offset:(offset + sisfield.SAMPLESIZE)]
+            samplelen += len(sample)
+            complen += len(zlib.compress(sample, 1))
+        ratio = float(complen) / samplelen
+
+        sisfield.SAMPLECOMPRATIO = ratio + 0.001
+        self.assertEqual(self.guess(data), None)
+        sisfield.SAMPLECOMPRATIO = ratio - 0.001
+        self.assertEqual(self.guess(data), "samples did not compress")
+
+        # With the default threshold, such data is not worth compressing.
+        sisfield.SAMPLECOMPRATIO = self.sampleratio
+        self.failUnless(ratio < 1.0)
+        self.assertEqual(self.guess(data), "samples did not compress")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,474 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+# test_sisfile.py - Tests for Ensymble SIS file utilities
+#
+# This program is part of Ensymble developer utilities for Symbian OS(TM).
+#
+# Ensymble is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Ensymble is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ensymble; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##############################################################################
+
+import os
+import sys
+import zlib
+import struct
+import random
+import shutil
+import tempfile
+import unittest
+import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+# Needed for modules under ensymble.actions to correctly find ensymble.utils.*
+import ensymble
+sys.path.append(os.path.dirname(ensymble.__file__))
+
+from utils import sisfile
+from utils import sisfield
+from utils import defaultcert
+from ensymble.actions import mergesis
+from test_cryptutil import DSAKEY
+
+
+##############################################################################
+# Helper functions
+##############################################################################
+
+def randomstring(length, seed = 1):
+    rnd = random.Random(seed)
+    return "".join([chr(rnd.randrange(256)) for n in xrange(length)])
+
+# Compressible text and incompressible (stored as-is) binary data.
+TEXTDATA = "".join(["line %d of a text file\n" % n for n in xrange(20000)])
+BINDATA = randomstring(51200)
+
+def makesis(path, files, uid = 0x01234567, logo = None):
+    '''Write an unsigned SIS file with the given (target, contents) files.'''
+
+    sw = sisfile.SimpleSISWriter(["EN"], [u"Test"], uid, (1, 0, 0),
+                                 u"Vendor", [u"Vendor"])
+    if logo != None:
+        sw.setlogo(logo, u"image/png")
+    for target, contents in files:
+        sw.addfile(contents, target)
+    sw.tofile(path)
+
+def makemergedsis(path, inpaths):
+    '''Write a SIS file with the other SIS files embedded in the first one.'''
+
+    instrings = [sisfile.mapfile(inpath) for inpath in inpaths]
+    try:
+        insis = [sisfield.SISField(s, False, 16)[0] for s in instrings]
+        mergesis.mergesisfiles("test", insis, defaultcert.cert,
+                               defaultcert.privkey, None, None)
+        f = file(path, "wb")
+        try:
+            sisfile.writesiscontents(f, instrings[0][:16], insis[0])
+        finally:
+            f.close()
+    finally:
+        for s in instrings:
+            sisfile.unmapfile(s)
+
+def readstring(path):
+    f = file(path, "rb")
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def writestring(path, string):
+    f = file(path, "wb")
+    try:
+        f.write(string)
+    finally:
+        f.close()
+
+
+##############################################################################
+# CompressionCache tests
+##############################################################################
+
+class CompressionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.tempdir, "cache")
+        self.cache = sisfile.CompressionCache(self.cachedir)
+
+        # Count files actually compressed.
+        self.compressed = 0
+        self.compressfile = sisfile.compressfile
+        def countingcompressfile(*args):
+            self.compressed += 1
+            return self.compressfile(*args)
+        sisfile.compressfile = countingcompressfile
+
+    def tearDown(self):
+        sisfile.compressfile = self.compressfile
+        shutil.rmtree(self.tempdir)
+
+    def build(self):
+        '''Build a SIS file using the cache, return the contents of its file.'''
+
+        sw = sisfile.SimpleSISWriter(["EN"], [u"Test"], 0x01234567,
+                                     (1, 0, 0), u"Vendor", [u"Vendor"],
+                                     cache = self.cache)
+        sw.addfile(TEXTDATA, u"!:\\data\\text.txt")
+        path = os.path.join(self.tempdir, "test.sis")
+        sw.tofile(path)
+        reader = sisfile.SISReader(path)
+        try:
+            return reader.readfile(reader.files[0])
+        finally:
+            reader.close()
+
+    def cachefiles(self):
+        names = os.listdir(self.cachedir)
+        names.sort()
+        return [os.path.join(self.cachedir, name) for name in names]
+
+    def testhit(self):
+        self.assertEqual(self.build(), TEXTDATA)
+        self.assertEqual(self.compressed, 1)
+        self.assertEqual(len(self.cachefiles()), 1)
+
+        self.compressed = 0
+        self.assertEqual(self.build(), TEXTDATA)
+        self.assertEqual(self.compressed, 0)
+
+    def testdamaged(self):
+        self.build()
+        path = self.cachefiles()[0]
+        string = readstring(path)
+
+        # Truncated file, CRC-32 mismatch and a wrong algorithm
+        # (with a valid CRC-32) all cause the file to be compressed again.
+        crcstring = struct.pack("<LL", zlib.crc32("\x07\x00\x00\x00" +
+                                                  string[8:]) & 0xffffffffL, 7)
+        for damaged in (string[:10],
+                        string[:20] + chr(ord(string[20]) ^ 1) + string[21:],
+                        crcstring + string[8:]):
+            writestring(path, damaged)
+            self.compressed = 0
+            self.assertEqual(self.build(), TEXTDATA)
+            self.assertEqual(self.compressed, 1)
+
+    def testlength(self):
+        cstring = sisfile.compressfile(TEXTDATA)[0]
+        sha1hash = sisfile.sha1(TEXTDATA).digest()
+        self.cache.store(sha1hash, "max", cstring)
+        self.assertEqual(self.cache.lookup(sha1hash, len(TEXTDATA), "max"),
+                         cstring)
+        self.assertEqual(self.cache.lookup(sha1hash, len(TEXTDATA) + 1,
+                                           "max"), None)
+        self.assertEqual(self.cache.lookup(sha1hash, len(TEXTDATA), "fast"),
+                         None)
+
+    def testtrim(self):
+        hashes = []
+        for n in xrange(3):
+            string = "%d" % n * 1000
+            sha1hash = sisfile.sha1(string).digest()
+            self.cache.store(sha1hash, "max", sisfile.compressfile(string)[0])
+            os.utime(self.cache.makepath(sha1hash, "max"),
+                     (1000000 + n, 1000000 + n))
+            hashes.append((sha1hash, len(string)))
+        size = os.stat(self.cachefiles()[0]).st_size
+
+        # Looking up the oldest file makes it the most recently used.
+        self.failIfEqual(self.cache.lookup(hashes[0][0], hashes[0][1], "max"),
+                         None)
+
+        # Least recently used files are removed first.
+        self.cache.maxsize = size * 2
+        self.cache.trim()
+        self.assertEqual(len(self.cachefiles()), 2)
+        self.assertEqual(self.cache.lookup(hashes[1][0], hashes[1][1], "max"),
+                         None)
+        for sha1hash, length in (hashes[0], hashes[2]):
+            self.failIfEqual(self.cache.lookup(sha1hash, length, "max"), None)
+
+        self.cache.maxsize = 0
+        self.cache.trim()
+        self.assertEqual(self.cachefiles(), [])
+
+
+##############################################################################
+# SISReader tests
+##############################################################################
+
+class SISReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "test.sis")
+        makesis(self.path, [(u"!:\\Data\\Hello.TXT", "hello"),
+                            (u"c:\\data\\text.txt", TEXTDATA),
+                            (u"!:\\data\\binary.dat", BINDATA)],
+                logo = "LOGO" * 10)
+        self.reader = sisfile.SISReader(self.path)
+
+    def tearDown(self):
+        self.reader.close()
+        shutil.rmtree(self.tempdir)
+
+    def testfiles(self):
+        targets = [entry.target for entry in self.reader.files]
+        self.assertEqual(targets, [u"", u"!:\\Data\\Hello.TXT",
+                                   u"c:\\data\\text.txt",
+                                   u"!:\\data\\binary.dat"])
+        self.assertEqual(self.reader.extralength, 0)
+
+    def testlogo(self):
+        entry = self.reader.files[0]
+        self.assertEqual(entry.mimetype, u"image/png")
+        self.assertEqual(entry.operation, sisfield.EOpRun)
+        self.assertEqual(self.reader.readfile(entry), "LOGO" * 10)
+
+    def testfindfile(self):
+        entry = self.reader.findfile(u"!:\\data\\hello.txt")
+        self.assertEqual(entry.target, u"!:\\Data\\Hello.TXT")
+
+        # Any drive matches "!:", forward slashes match backslashes.
+        self.assertEqual(self.reader.findfile(u"E:/DATA/hello.txt"), entry)
+
+        # A fixed drive only matches itself.
+        entry = self.reader.findfile(u"C:\\Data\\Text.txt")
+        self.assertEqual(entry.target, u"c:\\data\\text.txt")
+        self.assertEqual(self.reader.findfile(u"e:\\data\\text.txt"), None)
+        self.assertEqual(self.reader.findfile(u"!:\\data\\missing"), None)
+
+    def testiterfile(self):
+        for target, contents in ((u"c:\\data\\text.txt", TEXTDATA),
+                                 (u"!:\\data\\binary.dat", BINDATA)):
+            entry = self.reader.findfile(target)
+            self.assertEqual(entry.uncompressedlength, len(contents))
+
+            blocks = list(self.reader.iterfile(entry, 4096))
+            self.failUnless(len(blocks) > 1)
+            for block in blocks:
+                self.failUnless(0 < len(block) <= 4096)
+            self.assertEqual("".join(blocks), contents)
+
+            blocks = list(self.reader.iterfile(entry, None))
+            self.assertEqual(blocks, [contents])
+            self.assertEqual(self.reader.readfile(entry), contents)
+
+    def testhashmismatch(self):
+        # Damage a byte of the uncompressed file data.
+        self.reader.close()
+        string = readstring(self.path)
+        offset = string.find(BINDATA[1000:1100]) + 50
+        self.failUnless(offset >= 50)
+        string = "%s%s%s" % (string[:offset], chr(ord(string[offset]) ^ 1),
+                             string[(offset + 1):])
+        writestring(self.path, string)
+
+        self.reader = sisfile.SISReader(self.path)
+        entry = self.reader.findfile(u"!:\\data\\binary.dat")
+        try:
+            self.reader.readfile(entry)
+        except sisfield.SISException, e:
+            self.assertEqual(str(e), "file hash mismatch")
+        else:
+            self.fail("SISException not raised")
+
+    def testembedded(self):
+        self.reader.close()
+        path2 = os.path.join(self.tempdir, "embedded.sis")
+        merged = os.path.join(self.tempdir, "merged.sis")
+        makesis(path2, [(u"!:\\data\\embedded.txt", TEXTDATA[:5000])],
+                0x01234568)
+        makemergedsis(merged, [self.path, path2])
+
+        self.reader = sisfile.SISReader(merged)
+        self.assertEqual(len(self.reader.files), 5)
+        entry = self.reader.findfile(u"c:\\DATA\\embedded.txt")
+        self.assertEqual(entry.dataindex, 1)
+        self.assertEqual(self.reader.readfile(entry), TEXTDATA[:5000])
+        entry = self.reader.findfile(u"c:\\data\\hello.txt")
+        self.assertEqual(entry.dataindex, 0)
+        self.assertEqual(self.reader.readfile(entry), "hello")
+
+
+##############################################################################
+# SISValidator tests
+##############################################################################
+
+def listcontentsfields(string):
+    '''Return a dictionary of (offset, header length) tuples of the
+    SISFields directly inside the SISContents SISField, by type name.'''
+
+    fields = {}
+    pos = 16 + sisfield.parsesisfieldheader(string, None, False, 16)[1]
+    while pos < len(string):
+        ftype, hdrlen, flen, padlen = sisfield.parsesisfieldheader(
+            string, None, False, pos)
+        fields[sisfield.fieldnumtoname[ftype]] = (pos, hdrlen)
+        pos += hdrlen + flen + padlen
+    return fields
+
+def rewritesis(string, func = None):
+    '''Parse a SIS file, let func modify the SISContents SISField and
+    return the SIS file with updated checksums.'''
+
+    contents = sisfield.SISField(string, False, 16)[0]
+    if func != None:
+        func(contents)
+    f = StringIO.StringIO()
+    sisfile.writesiscontents(f, string[:16], contents)
+    return f.getvalue()
+
+class SISValidatorTest(unittest.TestCase):
+    def setUp(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tempdir, "test.sis")
+            makesis(path, [(u"!:\\data\\text.txt", TEXTDATA),
+                           (u"!:\\data\\binary.dat", BINDATA)])
+            self.string = readstring(path)
+        finally:
+            shutil.rmtree(tempdir)
+
+    def validate(self, string, checkhashes = False):
+        '''Return the error message of SISValidator or None.'''
+
+        try:
+            sisfile.SISValidator(string, checkhashes).validate()
+        except sisfield.SISException, e:
+            return str(e)
+        return None
+
+    def testvalid(self):
+        self.assertEqual(self.validate(self.string, True), None)
+        self.assertEqual(sisfile.SISValidator(self.string + "xx").validate(),
+                         ["2 extra bytes after SIS file"])
+
+    def testtruncatedheader(self):
+        self.assertEqual(self.validate(self.string[:12]),
+                         "not enough data for UIDs at offset 0")
+        self.failUnless(self.validate(self.string[:20]).endswith(
+            " at offset 16"))
+
+    def testchecksum(self):
+        for name, csname in (("SISControllerChecksum", "ControllerChecksum"),
+                             ("SISDataChecksum", "DataChecksum")):
+            offset, hdrlen = listcontentsfields(self.string)[name]
+            pos = offset + hdrlen
+            string = "%s%s%s" % (self.string[:pos],
+                                 chr(ord(self.string[pos]) ^ 0x10),
+                                 self.string[(pos + 1):])
+            message = self.validate(string)
+            self.failUnless(message.startswith("invalid %s " % csname))
+            self.failUnless(message.endswith(" at offset %d" % offset))
+
+    def testdataindex(self):
+        def setdataindex(contents):
+            contents.Controller.Data.DataIndex.DataIndex = 3
+        string = rewritesis(self.string, setdataindex)
+
+        # Offsets inside the SISController refer to its uncompressed data.
+        contents = sisfield.SISField(string, False, 16)[0]
+        ctrlstring = contents.Controller.Data.tostring()
+        didxstring = contents.Controller.Data.DataIndex.tostring()
+        offset, hdrlen = listcontentsfields(string)["SISCompressed"]
+        self.assertEqual(self.validate(string),
+                         "invalid SISDataIndex 3 at offset %d of SISController "
+                         "uncompressed from offset %d" %
+                         (ctrlstring.rfind(didxstring), offset + hdrlen))
+
+    def testfilehash(self):
+        # Damage a byte of the uncompressed file data, update checksums.
+        pos = self.string.find(BINDATA[1000:1100]) + 50
+        string = rewritesis("%s%s%s" % (self.string[:pos],
+                                        chr(ord(self.string[pos]) ^ 1),
+                                        self.string[(pos + 1):]))
+        self.assertEqual(self.validate(string), None)
+
+        # The offset of the SISFileData contents is reported. They start
+        # with a SISCompressed header, compression algorithm and length.
+        offset = string.find(BINDATA[:100]) - 20
+        ftype = sisfield.parsesisfieldheader(string, None, False, offset)[0]
+        self.assertEqual(ftype, sisfield.SISCompressed.fieldtype)
+        self.assertEqual(self.validate(string, True),
+                         "file hash mismatch at offset %d" % offset)
+
+
+##############################################################################
+# SignatureCache tests
+##############################################################################
+
+class SignatureCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = sisfile.SignatureCache(self.tempdir)
+
+        # Count strings actually signed.
+        self.signed = 0
+        self.signstring = sisfile.cryptutil.signstring
+        def countingsignstring(*args):
+            self.signed += 1
+            return self.signstring(*args)
+        sisfile.cryptutil.signstring = countingsignstring
+
+    def tearDown(self):
+        sisfile.cryptutil.signstring = self.signstring
+        shutil.rmtree(self.tempdir)
+
+    def sign(self, privkey, string):
+        return sisfile.signstring(privkey, None, string, self.cache)
+
+    def testrsa(self):
+        result = self.sign(defaultcert.privkey, "first")
+        self.assertEqual(result[1], sisfile.RSAALGORITHMOID)
+        self.assertEqual(self.signed, 1)
+
+        # The same string and key re-use the cached signature,
+        # also after the cache directory is opened again.
+        self.assertEqual(self.sign(defaultcert.privkey, "first"), result)
+        self.cache = sisfile.SignatureCache(self.tempdir)
+        self.assertEqual(self.sign(defaultcert.privkey, "first"), result)
+        self.assertEqual(self.signed, 1)
+
+        self.failIfEqual(self.sign(defaultcert.privkey, "second"), result)
+        self.assertEqual(self.signed, 2)
+        self.assertEqual(len(os.listdir(self.tempdir)), 2)
+
+    def testdamaged(self):
+        result = self.sign(defaultcert.privkey, "first")
+        path = os.path.join(self.tempdir, os.listdir(self.tempdir)[0])
+        string = readstring(path)
+        writestring(path, string[:-1] + chr(ord(string[-1]) ^ 1))
+
+        self.assertEqual(self.sign(defaultcert.privkey, "first"), result)
+        self.assertEqual(self.signed, 2)
+
+    def testdsa(self):
+        # DSA signatures are randomized, they bypass the cache.
+        signature, algoid = self.sign(DSAKEY, "first")
+        self.assertEqual(algoid, sisfile.DSAALGORITHMOID)
+        self.sign(DSAKEY, "first")
+        self.assertEqual(self.signed, 2)
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+        self.cache.store(DSAKEY, "first", signature, algoid)
+        self.assertEqual(os.listdir(self.tempdir), [])
+        self.assertEqual(self.cache.lookup(DSAKEY, "first", algoid), None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+# test_symbianutil.py - Tests for Ensymble Symbian OS utilities
+#
+# This program is part of Ensymble developer utilities for Symbian OS(TM).
+#
+# Ensymble is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Ensymble is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ensymble; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##############################################################################
+
+import os
+import sys
+import random
+import binascii
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+from ensymble.utils import symbianutil
+
+
+def randomstring(length, seed = 1):
+    rnd = random.Random(seed)
+    return "".join([chr(rnd.randrange(256)) for n in xrange(length)])
+
+def crc16ccittbitwise(string, initialvalue = 0x0000, finalxor = 0x0000):
+    '''The original bit-by-bit CCITT CRC-16 algorithm, for reference.'''
+
+    value = initialvalue
+    for c in string:
+        value ^= (ord(c) << 8)
+        for b in xrange(8):
+            value <<= 1
+            if value & 0x10000:
+                value ^= 0x1021
+            value &= 0xffff
+
+    return value ^ finalxor
+
+DATA = randomstring(3000)
+LENGTHS = (0, 1, 2, 3, 7, 64, 1000, len(DATA))
+INITIALVALUES = (0x0000, 0x1d0f, 0xffff)
+
+class CRC16CCITTTest(unittest.TestCase):
+    def setUp(self):
+        self.crc16ccittupdate = symbianutil.crc16ccittupdate
+
+    def tearDown(self):
+        symbianutil.crc16ccittupdate = self.crc16ccittupdate
+
+    def checkupdate(self, update):
+        for length in LENGTHS:
+            data = DATA[:length]
+            for initialvalue in INITIALVALUES:
+                self.assertEqual(update(data, initialvalue),
+                                 crc16ccittbitwise(data, initialvalue))
+
+    def checkcrc16ccitt(self):
+        # Known value: CRC-16/XMODEM of "123456789" is 0x31c3.
+        self.assertEqual(symbianutil.crc16ccitt("123456789"), 0x31c3)
+
+        for length in LENGTHS:
+            data = DATA[:length]
+            for initialvalue in INITIALVALUES:
+                value = crc16ccittbitwise(data, initialvalue, 0x5a5a)
+                self.assertEqual(symbianutil.crc16ccitt(data, initialvalue,
+                                                        0x5a5a), value)
+
+                # Feed data in uneven pieces, as strings and buffers.
+                crcobj = symbianutil.CRC16CCITT(initialvalue, 0x5a5a)
+                for pos in xrange(0, length, 1237):
+                    crcobj.update(data[pos:(pos + 1237)])
+                self.assertEqual(crcobj.getvalue(), value)
+
+                crcobj = symbianutil.CRC16CCITT(initialvalue, 0x5a5a)
+                for pos in xrange(0, length, 7):
+                    crcobj.update(buffer(data, pos, 7))
+                self.assertEqual(crcobj.getvalue(), value)
+
+    def testcrchqx(self):
+        self.checkupdate(binascii.crc_hqx)
+        self.failUnless(symbianutil.crc16ccittupdate is binascii.crc_hqx)
+        self.checkcrc16ccitt()
+
+    def testtable(self):
+        self.checkupdate(symbianutil.crc16ccitttableupdate)
+        symbianutil.crc16ccittupdate = symbianutil.crc16ccitttableupdate
+        self.checkcrc16ccitt()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+##############################################################################
+# test_unsis.py - Tests for the Ensymble unsis command
+#
+# This program is part of Ensymble developer utilities for Symbian OS(TM).
+#
+# Ensymble is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# Ensymble is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Ensymble; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##############################################################################
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+
+# Needed for modules under ensymble.actions to correctly find ensymble.utils.*
+import ensymble
+sys.path.append(os.path.dirname(ensymble.__file__))
+
+from utils import sisfile
+from ensymble.actions import unsis
+
+
+class UnsisTest(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, "test.sis")
+        self.outdir = os.path.join(self.tempdir, "out")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def rununsis(self, argv):
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            unsis.run("unsis", argv)
+        finally:
+            sys.stdout = stdout
+
+    def readfile(self, *names):
+        f = file(os.path.join(self.outdir, *names), "rb")
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def testlogo(self):
+        logo = "\x89PNG\r\n\x1a\n" + "logo data" * 100
+        sw = sisfile.SimpleSISWriter(["EN"], [u"Test"], 0x01234567,
+                                     (1, 0, 0), u"Vendor", [u"Vendor"])
+        sw.setlogo(logo, u"image/png")
+        sw.addfile("hello", u"!:\\data\\hello.txt")
+        sw.tofile(self.path)
+
+        self.rununsis([self.path, self.outdir])
+
+        # The logo has no target path, it is named by its position.
+        self.assertEqual(self.readfile("file0"), logo)
+        self.assertEqual(self.readfile("!", "data", "hello.txt"), "hello")
+
+        lines = [line.split("\t") for line in
+                 self.readfile(unsis.MANIFESTNAME).splitlines()
+                 if not line.startswith("#")]
+        self.assertEqual([(l[0], l[1], l[4]) for l in lines],
+                         [("file0", "", "image/png"),
+                          (os.path.join("!", "data", "hello.txt"),
+                           "!:\\data\\hello.txt", "")])
+
+    def testclashingpaths(self):
+        sw = sisfile.SimpleSISWriter(["EN"], [u"Test"], 0x01234567,
+                                     (1, 0, 0), u"Vendor", [u"Vendor"])
+        sw.addfile("A", u"!:\\data\\foo")
+        sw.addfile("B", u"!:\\data\\foo\\bar.txt")
+        sw.addfile("C", u"\\manifest.txt")
+        sw.tofile(self.path)
+
+        self.rununsis([self.path, self.outdir])
+
+        self.assertEqual(self.readfile("!", "data", "foo"), "A")
+        self.assertEqual(self.readfile("!", "data", "foo.1", "bar.txt"), "B")
+        self.assertEqual(self.readfile("manifest.txt.1"), "C")
+        self.failUnless(self.readfile("manifest.txt").startswith("#"))
+
+
+if __name__ == "__main__":
+    unittest.main()